@@ -0,0 +1,472 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+#
+# Headless grading of scanned answer sheets
+#
+from __future__ import division, print_function
+
+from optparse import OptionParser
+import os
+import sys
+import time
+import threading
+import multiprocessing
+
+import cv2
+
+from . import utils
+from . import images
+from . import detection
+from . import sessiondb
+from . import timing
+from . import pdfpages
+
+# Per-process state of the worker processes (see _init_worker)
+_worker = None
+
+
+class GradedSheet(object):
+    """Result of grading one image, or one sheet of an image.
+
+    Only lightweight data travels back from the worker processes: the
+    captures are stored already encoded as PNG. `page` is the number
+    of the page (from 1) when the image comes from a PDF file, and
+    `sheet_num` the number of the sheet within the image in the
+    multi-sheet mode. Both are None otherwise.
+
+    """
+    def __init__(self, filename, capture=None, decisions=None, score=None,
+                 error=None, stages=None, sheet_num=None, page=None):
+        self.filename = filename
+        self.capture = capture
+        self.decisions = decisions
+        self.score = score
+        self.error = error
+        self.stages = stages
+        self.sheet_num = sheet_num
+        self.page = page
+
+    @property
+    def success(self):
+        return self.error is None
+
+    @property
+    def name(self):
+        name = self.filename
+        if self.page is not None:
+            name = '{0}:{1}'.format(name, self.page)
+        if self.sheet_num is not None:
+            name = '{0}#{1}'.format(name, self.sheet_num + 1)
+        return name
+
+
+class EncodedCapture(object):
+    """Exam capture whose images are already encoded as PNG.
+
+    It provides the interface `sessiondb.SessionDB.store_exam` needs
+    from `capture.ExamCapture`.
+
+    """
+    def __init__(self, capture):
+        self.answer_cells = capture.answer_cells
+        self.id_cells = capture.id_cells
+        self.data_raw = images.encode_image(capture.image_raw)
+        self.data_drawn = images.encode_image(capture.image_drawn)
+
+    def save_image_raw(self, filename):
+        _write_data(filename, self.data_raw)
+
+    def save_image_drawn(self, filename):
+        _write_data(filename, self.data_drawn)
+
+
+class SheetGrader(object):
+    """Grades still images against the exam configuration of a session.
+
+    With `multi_sheet`, every image may contain several sheets, which
+    are graded independently. Each sheet is detected only once: the
+    detection that accepts its region when the image is split is also
+    the one graded. The pages of PDF files are rasterised at
+    `resolution` dots per inch.
+
+    """
+    def __init__(self, session, resize_width=None, record_timing=False,
+                 multi_sheet=False, resolution=pdfpages.param_resolution):
+        self.session = session
+        self.exam_data = session.exam_config
+        self.resize_width = resize_width
+        self.multi_sheet = multi_sheet
+        self.resolution = resolution
+        self.context = detection.ExamDetectorContext()
+        self.options = detector_options(self.exam_data)
+        self.options['timing'] = record_timing
+
+    def grade_source(self, filename, page=None):
+        """Grades an image file, or a page of a PDF file.
+
+        Returns the list of `GradedSheet` objects of the sheets found
+        in the image, which has just one element unless in the
+        multi-sheet mode.
+
+        """
+        if page is None:
+            image = images.load_image(filename)
+        else:
+            image = pdfpages.load_page(filename, page, self.resolution)
+        if image is None:
+            return [GradedSheet(filename, error='cannot read the image',
+                                page=page)]
+        if self.multi_sheet:
+            detectors = self.find_sheets(image)
+        else:
+            detectors = []
+        if not detectors:
+            return [self.grade_image(filename, self._region_image(image),
+                                     page=page)]
+        return [self.grade_detector(filename, detector, sheet_num=i,
+                                    page=page) \
+                for i, detector in enumerate(detectors)]
+
+    def find_sheets(self, image):
+        """Returns the detectors of the sheets of the image.
+
+        The image is split only where the answer tables of the exam
+        are detected in both parts. The detector of every sheet is the
+        one that accepted its region. It returns an empty list when
+        there is only one sheet.
+
+        """
+        detectors = {}
+        def accept(region):
+            detector = self.detect(self._region_image(image, region))
+            if detector.status['cells']:
+                detectors[region] = detector
+            return detector.status['cells']
+        regions = detection.find_sheet_regions(image, accept=accept)
+        if len(regions) < 2:
+            return []
+        return [detectors[region] for region in regions]
+
+    def detect(self, image):
+        return detect_image(image, self.exam_data.dimensions, self.context,
+                            self.options)
+
+    def _region_image(self, image, region=None):
+        """Returns a region (x0, y0, x1, y1) of the image, or all of it."""
+        if region is not None:
+            x0, y0, x1, y1 = region
+            image = image[y0:y1, x0:x1].copy()
+        if (self.resize_width is not None
+            and images.width(image) > self.resize_width):
+            height = int(round(images.height(image) * self.resize_width
+                               / images.width(image)))
+            image = cv2.resize(image, (self.resize_width, height),
+                               interpolation=cv2.INTER_AREA)
+        return image
+
+    def grade_image(self, filename, image, sheet_num=None, page=None):
+        return self.grade_detector(filename, self.detect(image),
+                                   sheet_num=sheet_num, page=page)
+
+    def grade_detector(self, filename, detector, sheet_num=None, page=None):
+        """Grades the result of a detector that has already run."""
+        stages = detector.timer.stages if self.options['timing'] else None
+        if not detector.success:
+            return GradedSheet(filename, error='answer tables not detected',
+                               stages=stages, sheet_num=sheet_num,
+                               page=page)
+        model = detector.decisions.model
+        solutions = self.exam_data.get_solutions(model)
+        if solutions is None:
+            return GradedSheet(filename,
+                               error='no solutions for model {0}'\
+                                     .format(model),
+                               stages=stages, sheet_num=sheet_num,
+                               page=page)
+        if model in self.exam_data.scores:
+            scores = self.exam_data.scores[model]
+        else:
+            scores = None
+        exam = utils.Exam(detector.capture, detector.decisions, solutions,
+                          self.session.students, None, scores)
+        exam.draw_answers()
+        # The rank of students is not needed any more and it may be long:
+        exam.decisions.set_students_rank([])
+        return GradedSheet(filename, capture=EncodedCapture(exam.capture),
+                           decisions=exam.decisions, score=exam.score,
+                           stages=stages, sheet_num=sheet_num, page=page)
+
+
+class BatchGrading(object):
+    """Grades a list of image and PDF files in a pool of worker processes.
+
+    Detection runs in the workers. The results are stored in the
+    session database from the main process, in the same order as the
+    input files, because SQLite does not support concurrent writers.
+    When `record_timing` is True, the stage times the workers report
+    are aggregated in `timing_stats`.
+
+    Every page of a PDF file is rasterised by the worker that grades
+    it. No more than two images per process are in flight at the same
+    time, so that memory use does not depend on the size of the input.
+
+    With `multi_sheet`, every image may contain several sheets, which
+    are graded independently.
+
+    """
+    def __init__(self, session_dir, num_processes=None, resize_width=None,
+                 record_timing=False, multi_sheet=False,
+                 resolution=pdfpages.param_resolution):
+        self.session_dir = session_dir
+        self.num_processes = num_processes
+        self.resize_width = resize_width
+        self.record_timing = record_timing
+        self.multi_sheet = multi_sheet
+        self.resolution = resolution
+        self.timing_stats = timing.TimingStats()
+        self.num_graded = 0
+        self.failures = []
+        self.elapsed_time = None
+
+    @property
+    def sheets_per_second(self):
+        if self.elapsed_time:
+            return (self.num_graded + len(self.failures)) / self.elapsed_time
+        else:
+            return 0.0
+
+    def run(self, filenames, listener=None):
+        """Grades the files and stores the results in the session.
+
+        `listener`, if not None, is called with the exam id (None on
+        failure) and the `GradedSheet` object of every image (or every
+        sheet in the multi-sheet mode).
+
+        """
+        start_time = time.time()
+        sources = self._sources(filenames, listener)
+        session = sessiondb.SessionDB(self.session_dir)
+        num_processes = self.num_processes or multiprocessing.cpu_count()
+        tasks = _BoundedTasks(sources, 2 * num_processes)
+        pool = multiprocessing.Pool(num_processes,
+                                    initializer=_init_worker,
+                                    initargs=(self.session_dir,
+                                              self.resize_width,
+                                              self.record_timing,
+                                              self.multi_sheet,
+                                              self.resolution))
+        try:
+            exam_id = session.next_exam_id()
+            for sheets in pool.imap(_grade_source, tasks):
+                for sheet in sheets:
+                    if sheet.stages:
+                        self.timing_stats.add(sheet.stages)
+                    if sheet.success:
+                        session.store_exam(exam_id, sheet.capture,
+                                           sheet.decisions, sheet.score)
+                        self.num_graded += 1
+                        if listener is not None:
+                            listener(exam_id, sheet)
+                        exam_id += 1
+                    else:
+                        self._fail(sheet, listener)
+                tasks.done()
+            pool.close()
+        except:
+            tasks.cancel()
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            self.elapsed_time = time.time() - start_time
+            session.close()
+
+    def _sources(self, filenames, listener):
+        """Returns the (filename, page) pairs to grade.
+
+        The page is None for image files. The PDF files whose number
+        of pages cannot be read are reported as failures.
+
+        """
+        sources = []
+        for filename in filenames:
+            if not pdfpages.is_pdf_file(filename):
+                sources.append((filename, None))
+                continue
+            try:
+                num_pages = pdfpages.num_pages(filename)
+            except utils.EyegradeException as ex:
+                if ex.key is not None:
+                    # The Poppler utilities are not available
+                    raise
+                self._fail(GradedSheet(filename, error=str(ex)), listener)
+            else:
+                sources.extend((filename, page) \
+                               for page in range(1, num_pages + 1))
+        return sources
+
+    def _fail(self, sheet, listener):
+        self.failures.append(sheet)
+        if listener is not None:
+            listener(None, sheet)
+
+
+class _BoundedTasks(object):
+    """Iterable of tasks that keeps at most `limit` of them in flight.
+
+    The task handler thread of the pool blocks when the limit is
+    reached, until `done` is called for the result of a task.
+
+    """
+    def __init__(self, tasks, limit):
+        self.tasks = tasks
+        self.slots = threading.Semaphore(limit)
+        self.cancelled = False
+
+    def __iter__(self):
+        for task in self.tasks:
+            self.slots.acquire()
+            if self.cancelled:
+                return
+            yield task
+
+    def done(self):
+        self.slots.release()
+
+    def cancel(self):
+        """Unblocks the task handler thread and stops it."""
+        self.cancelled = True
+        self.slots.release()
+
+
+def detector_options(exam_data):
+    """Returns the detector options for grading the given exam."""
+    options = detection.ExamDetector.get_default_options()
+    if exam_data.id_num_digits and exam_data.id_num_digits > 0:
+        options['read-id'] = True
+        options['id-num-digits'] = exam_data.id_num_digits
+    options['left-to-right-numbering'] = exam_data.left_to_right_numbering
+    options['multi-threshold'] = True
+    return options
+
+def detect_image(image, dimensions, context, options):
+    """Runs detection on a still image.
+
+    Unlike the camera loop, which moves to the next Hough threshold
+    after failed frames, all the thresholds are tried on the same
+    image when `options` enable the multi-threshold mode.
+    Returns the detector.
+
+    """
+    detector = detection.ExamDetector(dimensions, context, options,
+                                      image_raw=image)
+    detector.detect_safe()
+    return detector
+
+def _write_data(filename, data):
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def _init_worker(session_dir, resize_width, record_timing, multi_sheet,
+                 resolution):
+    global _worker
+    _worker = SheetGrader(sessiondb.SessionDB(session_dir),
+                          resize_width=resize_width,
+                          record_timing=record_timing,
+                          multi_sheet=multi_sheet,
+                          resolution=resolution)
+
+def _grade_source(source):
+    filename, page = source
+    try:
+        return _worker.grade_source(filename, page=page)
+    except Exception as e:
+        return [GradedSheet(filename, error=str(e), page=page)]
+
+def read_cmd_options():
+    parser = OptionParser(usage='usage: %prog [options] <session_dir>'
+                                ' <image_or_pdf_dir_or_file> [...]',
+                          version=utils.program_name + ' ' + utils.version)
+    parser.add_option('-j', '--processes', type='int', dest='num_processes',
+                      default=None,
+                      help='number of worker processes (default: '
+                           'number of CPUs)')
+    parser.add_option('-w', '--resize-width', type='int',
+                      dest='resize_width', default=None,
+                      help='scale down wider images to this width '
+                           'before detection')
+    parser.add_option('-t', '--timing', dest='timing_file', default=None,
+                      help='save the time spent in every detection stage '
+                           'as JSON in this file')
+    parser.add_option('-m', '--multi-sheet', dest='multi_sheet',
+                      action='store_true', default=False,
+                      help='look for several answer sheets in every image')
+    parser.add_option('-r', '--resolution', type='int', dest='resolution',
+                      default=pdfpages.param_resolution,
+                      help='resolution in dots per inch at which the pages '
+                           'of PDF files are rasterised (default: '
+                           '{0})'.format(pdfpages.param_resolution))
+    parser.add_option('-q', '--quiet', dest='verbose', action='store_false',
+                      default=True, help='do not report every image')
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error('Required parameters expected')
+    return options, args
+
+def main():
+    options, args = read_cmd_options()
+    session_dir = utils.path_to_unicode(args[0])
+    filenames = images.image_files([utils.path_to_unicode(arg) \
+                                    for arg in args[1:]],
+                                   extensions=(images.image_extensions
+                                               + pdfpages.extensions))
+    if not filenames:
+        print('No image or PDF files found', file=sys.stderr)
+        sys.exit(1)
+    def report(exam_id, sheet):
+        if not options.verbose:
+            return
+        if exam_id is not None:
+            print('{0}: exam {1}, model {2}, score {3}'\
+                  .format(sheet.name, exam_id, sheet.decisions.model,
+                          sheet.score.score))
+        else:
+            print('{0}: {1}'.format(sheet.name, sheet.error),
+                  file=sys.stderr)
+    grading = BatchGrading(session_dir, num_processes=options.num_processes,
+                           resize_width=options.resize_width,
+                           record_timing=options.timing_file is not None,
+                           multi_sheet=options.multi_sheet,
+                           resolution=options.resolution)
+    try:
+        grading.run(filenames, listener=report)
+    except utils.EyegradeException as ex:
+        print(ex, file=sys.stderr)
+        sys.exit(1)
+    print('Graded {0} of {1} sheets in {2:.1f} s ({3:.2f} sheets/s)'\
+          .format(grading.num_graded,
+                  grading.num_graded + len(grading.failures),
+                  grading.elapsed_time,
+                  grading.sheets_per_second))
+    if options.timing_file is not None:
+        print(grading.timing_stats)
+        grading.timing_stats.save(options.timing_file)
+
+if __name__ == '__main__':
+    main()
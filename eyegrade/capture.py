@@ -99,11 +99,31 @@ class ExamCapture(object):
 
         """
         self.image_raw = image
-        self.image_drawn = None
         self.answer_cells = answer_cells
         self.id_cells = id_cells
         self.progress = progress
-        self.reset_image()
+        # The drawings are kept as a list of (bounding box, function,
+        # arguments) and composed on image_raw only when image_drawn
+        # is requested
+        self.overlay = []
+        self._image_drawn = None
+        self._composed = 0
+
+    @property
+    def image_drawn(self):
+        """The original image with the drawings on it.
+
+        It is composed on demand, and must not be modified by callers.
+
+        """
+        if not self.overlay and self._image_drawn is None:
+            return self.image_raw
+        if self._image_drawn is None:
+            self._image_drawn = self.image_raw.copy()
+        for _, function, args in self.overlay[self._composed:]:
+            function(self._image_drawn, *args)
+        self._composed = len(self.overlay)
+        return self._image_drawn
 
     def has_answer_cells(self):
         return len(self.answer_cells) > 0
@@ -135,31 +155,36 @@ class ExamCapture(object):
             return (None, None)
 
     def reset_image(self):
-        """Resets the drawn image by cloning the original image.
+        """Removes all the drawings.
 
-        All the drawings are lost.
+        Only the regions of the composed image covered by them are
+        restored from the original image.
 
         """
-        if self.image_raw is not None:
-            self.image_drawn = self.image_raw.copy()
+        if self._image_drawn is not None:
+            for (x0, y0, x1, y1), _, _ in self.overlay[:self._composed]:
+                self._image_drawn[y0:y1, x0:x1] = \
+                    self.image_raw[y0:y1, x0:x1]
+        self.overlay = []
+        self._composed = 0
 
     def save_image_drawn(self, filename):
-        assert self.image_drawn is not None
+        assert self.image_raw is not None
         cv2.imwrite(filename, self.image_drawn)
 
     def save_image_raw(self, filename):
         cv2.imwrite(filename, self.image_raw)
 
     def draw_status(self):
-        assert self.image_drawn is not None
+        assert self.image_raw is not None
         self._draw_status_bar()
 
     def draw_corner(self, point):
-        assert self.image_drawn is not None
-        cv2.circle(self.image_drawn, point, 4, _color_blue, thickness=1)
+        assert self.image_raw is not None
+        self._circle(point, 4, _color_blue, 1)
 
     def draw_answers(self, score):
-        assert self.image_drawn is not None
+        assert self.image_raw is not None
         if score.answers:
             if score.solutions:
                 self._draw_answers_solutions(score)
@@ -167,15 +192,15 @@ class ExamCapture(object):
                 self._draw_answers_no_solutions(score)
 
     def _draw_status_bar(self):
-        x0 = images.width(self.image_drawn) - 60
+        x0 = images.width(self.image_raw) - 60
         y0 = 10
         width = 50
         height = 20
         p0 = (x0, y0)
         p1 = geometry.round_point((x0 + self.progress * width, y0 + height))
         p2 = (x0 + width, y0 + height)
-        cv2.rectangle(self.image_drawn, p0, p2, _color_blue)
-        cv2.rectangle(self.image_drawn, p0, p1, _color_blue, thickness=-1)
+        self._rectangle(p0, p2, _color_blue, 1)
+        self._rectangle(p0, p1, _color_blue, -1)
 
     def _draw_answers_solutions(self, score):
         for answer, solution, status, cells in zip(score.answers,
@@ -199,11 +224,31 @@ class ExamCapture(object):
 
     def _draw_cell_circle(self, cell, color):
         radius = int(round(cell.diagonal / 3.5))
-        cv2.circle(self.image_drawn, cell.center, radius, color, thickness=2)
+        self._circle(cell.center, radius, color, 2)
 
     def _draw_cell_center(self, cell, color):
-        cv2.circle(self.image_drawn, cell.center, 4, color, thickness=-1)
+        self._circle(cell.center, 4, color, -1)
 
     def _draw_void_question(self, cells):
-        cv2.line(self.image_drawn, cells[0].center, cells[-1].center,
-                 _color_bad, thickness=3)
+        self._line(cells[0].center, cells[-1].center, _color_bad, 3)
+
+    def _circle(self, center, radius, color, thickness):
+        margin = radius + max(thickness, 1)
+        self._add_drawing(center, center, margin, cv2.circle,
+                          (center, radius, color, thickness))
+
+    def _rectangle(self, p0, p1, color, thickness):
+        self._add_drawing(p0, p1, max(thickness, 1), cv2.rectangle,
+                          (p0, p1, color, thickness))
+
+    def _line(self, p0, p1, color, thickness):
+        self._add_drawing(p0, p1, thickness, cv2.line,
+                          (p0, p1, color, thickness))
+
+    def _add_drawing(self, p0, p1, margin, function, args):
+        # The bounding box of the drawing, for restoring it at reset_image
+        bbox = (max(0, min(p0[0], p1[0]) - margin),
+                max(0, min(p0[1], p1[1]) - margin),
+                max(0, max(p0[0], p1[0]) + margin + 1),
+                max(0, max(p0[1], p1[1]) + margin + 1))
+        self.overlay.append((bbox, function, args))
@@ -21,6 +21,15 @@ from __future__ import division
 import math
 import copy
 import sys
+import time
+import threading
+import collections
+import itertools
+import glob
+import os
+import re
+import struct
+import Queue
 
 import cv2
 import numpy as np
@@ -30,6 +39,7 @@ from . import geometry as g
 from . import capture
 from . import sessiondb
 from . import images
+from . import timing
 from .ocr import classifiers
 from .ocr import sample
 
@@ -42,8 +52,55 @@ param_collapse_lines_maxgap = 7
 param_directions_threshold = 0.4
 param_hough_thresholds = [280, 260, 240, 225, 210, 195, 180, 160, 140, 120]
 param_failures_threshold = 10
+param_angle_window = 0.3
+param_angle_window_tracking = 0.1
+
+# Parameters for tracking the lines of the previous frame
+param_tracking_rho_var = 6
+param_tracking_theta_var = 0.01
+param_tracking_step = 2
+param_tracking_min_ink = 0.4
+
+# Width of the downscaled image in the pyramid detection mode
+param_pyramid_width = 640
 param_check_corners_tolerance_mul = 6
 
+# Detection engines: 'hough' finds the lines of the tables with the
+# Hough transform, 'contours' finds their outer rectangles
+detection_engines = ('hough', 'contours')
+
+# Parameters of the contours engine: minimum darkness of the table
+# lines with respect to their surroundings, minimum area of a table
+# (relative to the image), tolerance of the polygon approximation
+# (relative to the perimeter), number of the largest quadrilaterals
+# considered, and tolerances in the size of the cells of different
+# tables and in the alignment of their top lines (relative to the
+# height of a row)
+param_contours_threshold_offset = 10
+param_contours_min_area = 0.002
+param_contours_approx_epsilon = 0.03
+param_contours_max_quads = 8
+param_contours_cell_tolerance = 0.25
+param_contours_align_tolerance = 0.5
+
+# Parameters for splitting images with several answer sheets: width
+# at which ink is searched, minimum darkness of ink with respect to its
+# surroundings, fraction of ink pixels of an empty row or column,
+# minimum width of the empty bands between sheets and minimum size of a
+# sheet (relative to the size of the image), and margin added around
+# every sheet (relative to its size; detection ignores the lines that
+# are too close to the border of the image)
+param_sheets_width = 400
+param_sheets_ink_offset = 25
+param_sheets_empty_ink = 0.01
+param_sheets_min_gap = 0.03
+param_sheets_min_size = 0.2
+param_sheets_margin = 0.05
+
+# Parameters for detecting the removal of the exam
+param_change_width = 160
+param_change_max_difference = 0.05
+
 # Parameters for the infobits masks
 param_bit_mask_threshold = 0.25
 param_bit_mask_radius_multiplier = 0.333
@@ -55,10 +112,54 @@ param_id_boxes_energy_break = 0.99
 param_id_boxes_min_height = 15
 param_id_boxes_discard_distance = 20
 
+# Frames kept by the camera reader thread, and maximum time to wait
+# for the first frame of the camera, in seconds
+param_frame_buffer_size = 4
+param_first_frame_timeout = 2.0
+
+# Failed reads of the camera: number of them in a row after which the
+# camera is considered not to work any more, and the initial and
+# maximum waits before reading again, in seconds
+param_camera_max_failures = 20
+param_camera_retry_delay = 0.01
+param_camera_max_retry_delay = 0.5
+
+# Error logging: errors queued for the writer thread, minimum time
+# between stored errors in seconds, maximum size of the log (bytes)
+# before it is rotated, number of rotated logs kept, and maximum total
+# size of the error images (bytes)
+param_error_queue_size = 8
+param_error_min_interval = 1.0
+param_error_log_max_bytes = 1024 * 1024
+param_error_log_backups = 3
+param_error_images_max_bytes = 50 * 1024 * 1024
+
+# Frame rate of the image sequences replayed without a timestamps
+# file, and name of that file in the directory of the sequence
+param_sequence_fps = 30.0
+param_sequence_timestamps = 'timestamps.txt'
+
+# Frame recordings: extension of their files and frames queued for the
+# writer thread
+param_recording_extension = '.eyerec'
+param_recording_queue_size = 16
+
+# Video capture properties (their names differ in OpenCV 2 and 3)
+if hasattr(cv2, 'CAP_PROP_FPS'):
+    _cap_prop_fps = cv2.CAP_PROP_FPS
+    _cap_prop_pos_msec = cv2.CAP_PROP_POS_MSEC
+else:
+    _cap_prop_fps = cv2.cv.CV_CAP_PROP_FPS
+    _cap_prop_pos_msec = cv2.cv.CV_CAP_PROP_POS_MSEC
+
 # Other parameters
 param_error_log = 'eyegrade-errors.log'
 param_error_image_pattern = 'error-%s.png'
 
+# Header of every frame in recordings: capture time, Hough threshold
+# and length of the PNG data that follows
+_recording_header = struct.Struct('<dHI')
+
 
 class ExamDetector(object):
 
@@ -76,41 +177,52 @@ class ExamDetector(object):
         'capture-proc-ipl': None,
         'error-logging': False,
         'logging-dir': '.',
+        'multi-threshold': False,
+        'angle-windows': False,
+        'tracking': False,
+        'pyramid': False,
+        'timing': False,
+        'engine': 'hough',
         }
 
     @classmethod
     def get_default_options(cls):
         return copy.copy(cls.default_options)
 
-    def __init__(self, dimensions, context, options, image_raw=None):
+    def __init__(self, dimensions, context, options, image_raw=None,
+                 image_proc=None):
         self.options = options
         self.context = context
+        if self.options['timing']:
+            self.timer = timing.FrameTimer()
+        else:
+            self.timer = timing.null_timer
+        # The pre-processed image is computed on demand, see image_proc
+        self._image_proc = None
         if image_raw is not None:
             self.image_raw = image_raw
-            self.image_proc = pre_process(self.image_raw)
+            self._image_proc = image_proc
         elif not self.options['capture-from-file']:
-            self.image_raw = self.context.capture()
-            self.image_proc = pre_process(self.image_raw)
+            self.timer.start('capture')
+            # The frame is drawn on, and the camera may return it again
+            self.image_raw = self.context.capture(clone=True)
+            self.timer.stop('capture', self.image_raw is not None)
         elif self.options['capture-raw-file'] is not None:
             self.image_raw = \
                         images.load_image(self.options['capture-raw-file'])
-            self.image_proc = pre_process(self.image_raw)
         elif self.options['capture-proc-file'] is not None:
             self.image_raw = \
                         images.load_image(self.options['capture-proc-file'])
-            self.image_proc = images.rgb_to_gray(self.image_raw)
+            self._image_proc = images.rgb_to_gray(self.image_raw)
         elif self.options['capture-proc-ipl'] is not None:
             self.image_raw = self.options['capture-proc-ipl']
-            self.image_proc = self.options['capture-proc-ipl']
+            self._image_proc = self.options['capture-proc-ipl']
         else:
             raise Exception('Wrong capture options')
         self.dimensions = dimensions
-        self.status = {'lines': False,
-                       'boxes': False,
-                       'cells': False,
-                       'infobits': False,
-                       'id-box-hlines': False,
-                       'id-box': False}
+        self._reset_results()
+        self.hough_threshold = None
+        self.tracked = False
         if self.options['show-image-proc']:
             self.image_to_show = images.gray_to_rgb(self.image_proc)
         elif self.options['show-lines']:
@@ -119,6 +231,19 @@ class ExamDetector(object):
             self.image_to_show = self.image_raw
         self.decisions = None
         self.capture = None
+        # Set by the GUI when it grades the capture and converts it
+        # for display
+        self.exam = None
+        self.display_image = None
+
+    @property
+    def image_proc(self):
+        """The pre-processed image, which is computed on first access."""
+        if self._image_proc is None:
+            self.timer.start('pre-process')
+            self._image_proc = pre_process(self.image_raw)
+            self.timer.stop('pre-process')
+        return self._image_proc
 
     def detect_safe(self):
         try:
@@ -128,94 +253,344 @@ class ExamDetector(object):
             self.status['cells'] = False
             self.status['infobits'] = False
             self.context.notify_failure()
+            if self.options['timing']:
+                self.timer.stop('detect', False)
+                self.context.timing_stats.add(self.timer.stages)
             if self.options['error-logging']:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
                 self._write_error_trace(exc_type, exc_value, exc_traceback)
             # else... silence the exception, and try with the next capture
 
     def detect(self):
-        answers = None
-        detected_id = None
-        id_scores = None
-        bits = None
-        answer_cells = None
-        id_cells = None
-        id_hlines = None
+        self.timer.start('detect')
         success = False
-        axes = None
-        lines = detect_lines(self.image_proc,
-                             self.context.get_hough_threshold())
-        if len(lines) >= 2:
-            self.status['lines'] = True
-            axes = detect_boxes(lines, self.dimensions)
-        if axes is None:
-            self.context.next_hough_threshold()
-        else:
-            self.status['boxes'] = True
-            axes = filter_axes(axes, self.dimensions,
-                               images.width(self.image_raw),
-                               images.height(self.image_raw),
-                               self.options['read-id'])
-            corner_matrixes = cell_corners(axes[1][1], axes[0][1],
-                                           images.width(self.image_raw),
-                                           images.height(self.image_raw),
-                                           self.dimensions)
-            if len(corner_matrixes) > 0:
-                self.status['cells'] = True
-            if len(corner_matrixes) > 0:
-                answer_cells = self._answer_cells_geometry(corner_matrixes)
-                answers = self._decide_cells(answer_cells)
-                if self.options['infobits']:
-                    bits = read_infobits(self.image_proc, corner_matrixes)
-                    if bits is not None:
-                        self.status['infobits'] = True
-                        success = True
-                    else:
-                        success = False
-                else:
-                    success = True
-                if success and self.options['read-id']:
-                    id_hlines, id_cells = \
-                        id_boxes_geometry(self.image_proc,
-                                          self.options['id-num-digits'],
-                                          axes[1][1], self.dimensions)
-                    if id_hlines:
-                        self.status['id-box-hlines'] = True
-                    if not id_cells:
-                        success = False
-                    else:
-                        self.status['id-box'] = True
-                        detected_id, id_scores = self._detect_id(id_cells)
-                else:
-                    id_cells = []
+        self.tracked = False
+        pyramid = (self.options['pyramid']
+                   and images.width(self.image_raw) > param_pyramid_width
+                   and self._image_proc is None)
+        if (self.options['tracking']
+            and self.context.tracked_axes is not None):
+            # Try first to follow the lines of the previous frame
+            if pyramid:
+                self._pre_process_around(self.context.tracked_axes)
+            success = self._detect_tracked(self.context.tracked_axes)
+            self.tracked = success
+        if not success:
+            if self.options['engine'] == 'contours':
+                success = self._detect_contours()
+            elif pyramid:
+                success = self._detect_pyramid()
+            else:
+                success = self._detect_hough()
         if success:
+            self.context.tracked_axes = self.axes
+            self.context.lines_orientation = self.axes[1][0]
             self.context.notify_success()
         else:
+            self.context.tracked_axes = None
+            self.context.lines_orientation = None
             self.context.notify_failure()
         # Draw debug information on the capture
         if self.options['show-lines']:
             if self.status['cells']:
-                for line in axes[0][1]:
+                for line in self.axes[0][1]:
                     images.draw_line(self.image_to_show, line, (255, 0, 0))
-                for line in axes[1][1]:
+                for line in self.axes[1][1]:
                     images.draw_line(self.image_to_show, line, (255, 0, 255))
-                self._draw_cell_corners(corner_matrixes)
-            if id_hlines:
-                for line in id_hlines:
+                self._draw_cell_corners(self.corner_matrixes)
+            if self.id_hlines:
+                for line in self.id_hlines:
                     images.draw_line(self.image_to_show, line, (255, 255, 0))
-            if id_cells:
-                for cell in id_cells:
+            if self.id_cells:
+                for cell in self.id_cells:
                     for corner in cell.corners():
                         images.draw_point(self.image_to_show, corner)
         if self.options['show-status']:
             self._draw_status_flags()
-        self.decisions = capture.ExamDecisions(success, answers, detected_id,
-                                               id_scores, infobits=bits)
-        self.capture = capture.ExamCapture(self.image_to_show, answer_cells,
-                                           id_cells, self._compute_progress())
+        self.decisions = capture.ExamDecisions(success, self.answers,
+                                               self.detected_id,
+                                               self.id_scores,
+                                               infobits=self.bits)
+        self.capture = capture.ExamCapture(self.image_to_show,
+                                           self.answer_cells, self.id_cells,
+                                           self._compute_progress())
         self.success = success
+        self.timer.stop('detect', success)
+        if self.options['timing']:
+            self.context.timing_stats.add(self.timer.stages)
+        return success
+
+    def _detect_hough(self):
+        """Detects the exam from the lines of the Hough transform."""
+        return self._search_thresholds(self.image_proc, self._detect_in_lines)
+
+    def _detect_contours(self):
+        """Detects the exam from the outer rectangles of the tables.
+
+        The lines of the grid of every table are predicted from the
+        homography of its corners, instead of being found with the
+        Hough transform, and then adjusted to the image as when
+        tracking the lines of a previous frame.
+
+        """
+        self._reset_results()
+        self.timer.start('boxes')
+        quads = detect_quads(self.image_raw)
+        tables = select_table_quads(quads, self.dimensions)
+        self.timer.stop('boxes', tables is not None)
+        if tables is None:
+            return False
+        hlines, vlines = corners_lines(quads_corners(tables, self.dimensions))
+        if self.options['read-id']:
+            id_quad = select_id_quad(quads, tables, self.dimensions,
+                                     hlines[0], self.options['id-num-digits'])
+            if id_quad is not None:
+                hlines = [g.line_from_points(id_quad[0], id_quad[1]),
+                          g.line_from_points(id_quad[3], id_quad[2])] + hlines
+        axes = [(sum(l[1] for l in vlines) / len(vlines), vlines),
+                (sum(l[1] for l in hlines) / len(hlines), hlines)]
+        success = self._detect_tracked(axes)
+        self.status['lines'] = True
+        self.status['boxes'] = True
+        return success
+
+    def _detect_pyramid(self):
+        """Detects the exam from the lines of a downscaled image.
+
+        The lines are detected in the image scaled down to
+        `param_pyramid_width`, and then refined in the image at full
+        resolution, which is pre-processed only around the tables.
+
+        """
+        factor = images.width(self.image_raw) / param_pyramid_width
+        size = (param_pyramid_width,
+                int(round(images.height(self.image_raw) / factor)))
+        self.timer.start('pre-process')
+        image_small = pre_process(cv2.resize(self.image_raw, size,
+                                             interpolation=cv2.INTER_AREA))
+        self.timer.stop('pre-process')
+        def detect_in_lines(lines):
+            return self._detect_in_coarse_lines(lines, factor, size)
+        return self._search_thresholds(image_small, detect_in_lines)
+
+    def _search_thresholds(self, image_proc, detect_in_lines):
+        # Runs the Hough transform on image_proc and calls
+        # detect_in_lines with the lines of every Hough threshold to try
+        multi_threshold = self.options['multi-threshold']
+        if self.options['angle-windows']:
+            windows = self._angle_windows()
+        else:
+            windows = None
+        self.timer.start('hough')
+        if multi_threshold:
+            # Vote once, and try the thresholds from the highest one
+            candidates = detect_lines_multi(image_proc,
+                                            self.context.hough_thresholds,
+                                            angle_windows=windows)
+        else:
+            threshold = self.context.get_hough_threshold()
+            candidates = [(threshold,
+                           detect_lines(image_proc, threshold,
+                                        angle_windows=windows))]
+        self.timer.stop('hough', any(len(lines) >= 2 \
+                                     for threshold, lines in candidates))
+        for threshold, lines in candidates:
+            success = detect_in_lines(lines)
+            if success:
+                break
+        if success:
+            self.hough_threshold = threshold
+            if multi_threshold:
+                self.context.set_hough_threshold(threshold)
+        elif not self.status['boxes'] and not multi_threshold:
+            self.context.next_hough_threshold()
         return success
 
+    def _detect_in_coarse_lines(self, lines, factor, size):
+        """Detects the exam from the lines of a downscaled image.
+
+        `factor` is the scale factor of the downscaled image and
+        `size` its size.
+
+        """
+        self._reset_results()
+        axes = None
+        if len(lines) >= 2:
+            self.status['lines'] = True
+            self.timer.start('boxes')
+            axes = detect_boxes(lines, self.dimensions)
+            if axes is not None:
+                axes = filter_axes(axes, self.dimensions, size[0], size[1],
+                                   self.options['read-id'])
+            self.timer.stop('boxes', axes is not None)
+        if axes is None:
+            return False
+        self.status['boxes'] = True
+        self.timer.start('cells')
+        corner_matrixes = cell_corners(axes[1][1], axes[0][1],
+                                       size[0], size[1], self.dimensions)
+        self.timer.stop('cells', len(corner_matrixes) > 0)
+        if not corner_matrixes:
+            return False
+        axes = [(angle, [(rho * factor, theta) for rho, theta in axis]) \
+                for angle, axis in axes]
+        self._pre_process_around(axes)
+        success = self._detect_tracked(axes,
+                                       rho_var=int(math.ceil(factor)) + 1)
+        self.status['lines'] = True
+        self.status['boxes'] = True
+        return success
+
+    def _pre_process_around(self, axes):
+        # Pre-processes just the rows of the image around the tables,
+        # the ID box and the infobits
+        hlines = axes[1][1]
+        vlines = axes[0][1]
+        ys = [g.intersection(line, vline)[1] \
+              for line in hlines for vline in (vlines[0], vlines[-1])]
+        row_height = (max(ys) - min(ys)) / max(1, len(hlines) - 1)
+        self.timer.start('pre-process')
+        self._image_proc = pre_process_rows(self.image_raw,
+                                            int(min(ys) - row_height),
+                                            int(max(ys) + 2 * row_height))
+        self.timer.stop('pre-process')
+
+    def _detect_tracked(self, axes, rho_var=param_tracking_rho_var):
+        """Detects the exam by following the lines of a previous frame.
+
+        Returns True on success. The intermediate results are left in
+        the attributes of this object.
+
+        """
+        self._reset_results()
+        image_proc = self.image_proc
+        self.timer.start('tracking')
+        hends, vends = lines_extents(axes[1][1], axes[0][1], self.dimensions)
+        hlines = track_lines(image_proc, axes[1][1], hends, True,
+                             rho_var=rho_var)
+        vlines = None
+        if hlines is not None:
+            vlines = track_lines(image_proc, axes[0][1], vends, False,
+                                 rho_var=rho_var)
+        self.timer.stop('tracking', vlines is not None)
+        if vlines is None:
+            return False
+        self.status['lines'] = True
+        self.status['boxes'] = True
+        self.axes = [(sum(l[1] for l in vlines) / len(vlines), vlines),
+                     (sum(l[1] for l in hlines) / len(hlines), hlines)]
+        self.timer.start('cells')
+        self.corner_matrixes = cell_corners(hlines, vlines,
+                                            images.width(self.image_raw),
+                                            images.height(self.image_raw),
+                                            self.dimensions)
+        self.timer.stop('cells', len(self.corner_matrixes) > 0)
+        if len(self.corner_matrixes) > 0:
+            self.status['cells'] = True
+            return self._read_cells()
+        else:
+            return False
+
+    def _detect_in_lines(self, lines):
+        """Detects and reads the exam from the lines of the Hough transform.
+
+        Returns True on success. The intermediate results are left in
+        the attributes of this object.
+
+        """
+        self._reset_results()
+        success = False
+        if len(lines) >= 2:
+            self.status['lines'] = True
+            self.timer.start('boxes')
+            self.axes = detect_boxes(lines, self.dimensions)
+            if self.axes is not None:
+                self.axes = filter_axes(self.axes, self.dimensions,
+                                        images.width(self.image_raw),
+                                        images.height(self.image_raw),
+                                        self.options['read-id'])
+            self.timer.stop('boxes', self.axes is not None)
+        if self.axes is not None:
+            self.status['boxes'] = True
+            self.timer.start('cells')
+            self.corner_matrixes = cell_corners(self.axes[1][1],
+                                                self.axes[0][1],
+                                                images.width(self.image_raw),
+                                                images.height(self.image_raw),
+                                                self.dimensions)
+            self.timer.stop('cells', len(self.corner_matrixes) > 0)
+            if len(self.corner_matrixes) > 0:
+                self.status['cells'] = True
+                success = self._read_cells()
+        return success
+
+    def _read_cells(self):
+        """Reads the answer tables, infobits and ID box.
+
+        Expects the corners of the answer tables in
+        `self.corner_matrixes`. Returns True on success.
+
+        """
+        self.answer_cells = self._answer_cells_geometry(self.corner_matrixes)
+        self.timer.start('crosses')
+        self.answers = self._decide_cells(self.corner_matrixes)
+        self.timer.stop('crosses')
+        if self.options['infobits']:
+            self.timer.start('infobits')
+            self.bits = read_infobits(self.image_proc, self.corner_matrixes)
+            self.timer.stop('infobits', self.bits is not None)
+            if self.bits is not None:
+                self.status['infobits'] = True
+                success = True
+            else:
+                success = False
+        else:
+            success = True
+        if success and self.options['read-id']:
+            self.timer.start('id')
+            self.id_hlines, self.id_cells = \
+                id_boxes_geometry(self.image_proc,
+                                  self.options['id-num-digits'],
+                                  self.axes[1][1], self.dimensions)
+            if self.id_hlines:
+                self.status['id-box-hlines'] = True
+            if not self.id_cells:
+                success = False
+            else:
+                self.status['id-box'] = True
+                self.detected_id, self.id_scores = \
+                    self._detect_id(self.id_cells)
+            self.timer.stop('id', success)
+        else:
+            self.id_cells = []
+        return success
+
+    def _angle_windows(self):
+        # Narrow windows around the orientation of the last exam
+        # detected, or wider windows around the image axes otherwise
+        if self.context.lines_orientation is not None:
+            return angle_windows(self.context.lines_orientation,
+                                 param_angle_window_tracking)
+        else:
+            return angle_windows(math.pi / 2, param_angle_window)
+
+    def _reset_results(self):
+        self.status = {'lines': False,
+                       'boxes': False,
+                       'cells': False,
+                       'infobits': False,
+                       'id-box-hlines': False,
+                       'id-box': False}
+        self.axes = None
+        self.corner_matrixes = None
+        self.answer_cells = None
+        self.answers = None
+        self.bits = None
+        self.id_hlines = None
+        self.id_cells = None
+        self.detected_id = None
+        self.id_scores = None
+
     def detect_manual(self, manual_points):
         """Called when cell corners are obtained from manual detection."""
         bits = None
@@ -223,10 +598,10 @@ class ExamDetector(object):
         answers = None
         answer_cells = None
         corner_matrixes = process_box_corners(manual_points, self.dimensions)
-        if corner_matrixes != []:
+        if corner_matrixes:
             self.status['cells'] = True
             answer_cells = self._answer_cells_geometry(corner_matrixes)
-            answers = self._decide_cells(answer_cells)
+            answers = self._decide_cells(corner_matrixes)
             if self.options['infobits']:
                 bits = read_infobits(self.image_proc, corner_matrixes)
                 if bits is not None:
@@ -244,14 +619,22 @@ class ExamDetector(object):
         self.success = success
         return success
 
-    def exam_detected(self):
+    def exam_detected(self, reference_image=None):
         """Checks if the image has a probable exam.
 
         Sets `self.exam_detected` to True if an exam is detected as
-        probable. Right now, it just checks that the proper axes are
-        detected.
+        probable. If `reference_image` (the capture of the exam) is
+        given and this image barely differs from it, the exam is
+        assumed to be still there. Otherwise, it just checks that the
+        proper axes are detected.
 
         """
+        if (reference_image is not None and self.image_raw is not None
+            and reference_image.shape == self.image_raw.shape
+            and capture_difference(self.image_raw, reference_image)
+                < param_change_max_difference):
+            self.exam_detected = True
+            return
         self.exam_detected = False
         lines = detect_lines(self.image_proc,
                              self.context.get_hough_threshold())
@@ -262,25 +645,16 @@ class ExamDetector(object):
 
     def _write_error_trace(self, exc_type, exc_value, exc_traceback):
         import datetime
-        import re
         import traceback
-        import os
         if not self.options['capture-from-file']:
             print 'Exception catched! Storing trace into a log file...'
             date = str(datetime.datetime.now())
-            logname = os.path.join(self.options['logging-dir'],
-                                   param_error_log)
-            file_ = open(logname, 'a')
-            file_.write('-' * 60 + '\n')
-            file_.write(date + '\n')
-            file_.write('Hough threshold: %d\n'\
-                            %self.context.get_hough_threshold())
-            traceback.print_exception(exc_type, exc_value, exc_traceback,
-                                      file=file_)
-            file_.close()
-            im_file = param_error_image_pattern%re.sub(r'[-\ \.:]', '_', date)
-            save_image(os.path.join(self.options['logging-dir'], im_file),
-                       self.image_raw)
+            trace = ''.join(traceback.format_exception(exc_type, exc_value,
+                                                       exc_traceback))
+            text = ('Hough threshold: %d\n'%self.context.get_hough_threshold()
+                    + trace)
+            self.context.log_error(self.options['logging-dir'], date, text,
+                                   self.image_raw)
         else:
             traceback.print_exception(exc_type, exc_value, exc_traceback)
 
@@ -290,10 +664,10 @@ class ExamDetector(object):
             for i in range(0, len(corners) - 1):
                 row = []
                 for j in range(0, len(corners[0]) - 1):
-                    cell = capture.CellGeometry(corners[i][j],
-                                                corners[i][j + 1],
-                                                corners[i + 1][j],
-                                                corners[i + 1][j + 1],
+                    cell = capture.CellGeometry(_point(corners[i][j]),
+                                                _point(corners[i][j + 1]),
+                                                _point(corners[i + 1][j]),
+                                                _point(corners[i + 1][j + 1]),
                                                 None, None)
                     row.append(cell)
                 cells.append(row)
@@ -301,16 +675,27 @@ class ExamDetector(object):
             cells = self._set_left_to_right(cells)
         return cells
 
-    def _decide_cells(self, answer_cells):
+    def _decide_cells(self, corner_matrixes):
+        # Every answer table is rectified just once, and its cells are
+        # sliced from the rectified image. All the cells are classified
+        # at once, in just one SVM call.
+        cell_size = sample.CrossSampleFromGrid.cell_size
+        rows = []
+        for corners in corner_matrixes:
+            grid = sample.RectifiedGrid(self.image_proc, corners,
+                                        cell_size, cell_size)
+            for i in range(0, grid.num_rows):
+                rows.append([sample.CrossSampleFromGrid(grid, i, j) \
+                             for j in range(0, grid.num_cols)])
+        if self.options['left-to-right-numbering']:
+            rows = self._set_left_to_right(rows)
+        samples = [samp for row in rows for samp in row]
+        crosses = self.context.crosses_classifier.are_crosses(samples)
         decisions = []
-        for row in answer_cells:
-            row_decisions = []
-            for cell in row:
-                corners = np.array([cell.plu, cell.pru, cell.pld, cell.prd])
-                samp = sample.CrossSampleFromCam(corners, self.image_proc)
-                decision = self.context.crosses_classifier.is_cross(samp)
-                row_decisions.append(decision)
-            decisions.append(decide_answer(row_decisions))
+        pos = 0
+        for row in rows:
+            decisions.append(decide_answer(crosses[pos:pos + len(row)]))
+            pos += len(row)
         return decisions
 
     def _set_left_to_right(self, cells):
@@ -354,9 +739,18 @@ class ExamDetector(object):
             detected_id = None
         digits = []
         id_scores = []
-        for cell in id_cells:
-            corners = np.array([cell.plu, cell.pru, cell.pld, cell.prd])
-            samp = sample.DigitSampleFromCam(corners, self.image_proc)
+        # The ID box is rectified just once, at its natural cell size
+        corners_up = [cell.plu for cell in id_cells] + [id_cells[-1].pru]
+        corners_down = [cell.pld for cell in id_cells] + [id_cells[-1].prd]
+        cell_width = g.distance(corners_up[0], corners_up[-1]) / len(id_cells)
+        cell_height = (g.distance(corners_up[0], corners_down[0])
+                       + g.distance(corners_up[-1], corners_down[-1])) / 2
+        grid = sample.RectifiedGrid(self.image_proc,
+                                    [corners_up, corners_down],
+                                    max(1, int(round(cell_width))),
+                                    max(1, int(round(cell_height))))
+        for i in range(0, len(id_cells)):
+            samp = sample.DigitSampleFromGrid(grid, i)
             digit, scores = self.context.ocr.classify_digit(samp)
             digits.append(digit)
             id_scores.append(scores)
@@ -392,7 +786,209 @@ class ExamDetector(object):
         for corners in corner_matrixes:
             for h in corners:
                 for c in h:
-                    images.draw_point(self.image_to_show, c)
+                    images.draw_point(self.image_to_show, _point(c))
+
+
+class CameraReader(threading.Thread):
+    """Reads the frames of a camera in a background thread.
+
+    The newest frames are kept in a ring buffer as (timestamp, image)
+    tuples, so that detection takes always the freshest frame without
+    waiting for the camera. Failed reads are retried, waiting longer
+    after every failure, until `param_camera_max_failures` of them in
+    a row.
+
+    """
+    def __init__(self, camera):
+        super(CameraReader, self).__init__(name='CameraReader')
+        self.daemon = True
+        self.camera = camera
+        self.frames = collections.deque(maxlen=param_frame_buffer_size)
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def run(self):
+        failures = 0
+        while not self._stopped:
+            success, image = self.camera.read()
+            timestamp = time.time()
+            if success and image is not None:
+                failures = 0
+                with self._condition:
+                    self.frames.append((timestamp, image))
+                    self._condition.notify_all()
+                continue
+            failures += 1
+            if failures >= param_camera_max_failures:
+                with self._condition:
+                    # The camera does not work any more
+                    self._stopped = True
+                    self.frames.clear()
+                    self._condition.notify_all()
+            else:
+                time.sleep(min(param_camera_retry_delay
+                               * 2 ** (failures - 1),
+                               param_camera_max_retry_delay))
+
+    def latest_frame(self):
+        """Returns the (timestamp, image) tuple of the newest frame.
+
+        It waits only until the first frame of the camera arrives.
+        Returns (None, None) if no frame is available.
+
+        """
+        with self._condition:
+            if not self.frames and not self._stopped:
+                self._condition.wait(param_first_frame_timeout)
+            if self.frames:
+                return self.frames[-1]
+            else:
+                return None, None
+
+    def stop(self):
+        """Stops the thread and waits for it to finish."""
+        self._stopped = True
+        if self.is_alive():
+            self.join()
+
+
+class ErrorLogWriter(threading.Thread):
+    """Writes the traces and images of detection errors in the background.
+
+    Detection threads call `submit`, which never waits for the disk.
+    Errors that arrive too close to the previous one, or when the
+    queue is full, are just counted, and the count is written with
+    the next stored error. The log is rotated when it grows too large,
+    and the oldest error images are removed when they take too much
+    space.
+
+    """
+    def __init__(self, logging_dir):
+        super(ErrorLogWriter, self).__init__(name='ErrorLogWriter')
+        self.daemon = True
+        self.logging_dir = logging_dir
+        self.log_file = os.path.join(logging_dir, param_error_log)
+        self.queue = Queue.Queue(param_error_queue_size)
+        self.dropped = 0
+        self._last_submit = None
+        self._lock = threading.Lock()
+        pattern = os.path.join(logging_dir, param_error_image_pattern%'*')
+        self.image_files = sorted(glob.glob(pattern))
+
+    def submit(self, date, text, image):
+        """Queues an error for writing, or drops it.
+
+        Returns True if the error has been queued.
+
+        """
+        with self._lock:
+            now = time.time()
+            if (self._last_submit is not None
+                and now - self._last_submit < param_error_min_interval):
+                self.dropped += 1
+                return False
+            try:
+                self.queue.put_nowait((date, text, image, self.dropped))
+            except Queue.Full:
+                self.dropped += 1
+                return False
+            self._last_submit = now
+            self.dropped = 0
+            return True
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except (IOError, OSError) as e:
+                print 'Error logging failed:', e
+
+    def stop(self):
+        """Writes the pending errors and stops the thread."""
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+
+    def _write(self, date, text, image, dropped):
+        self._rotate_log()
+        with open(self.log_file, 'a') as file_:
+            file_.write('-' * 60 + '\n')
+            file_.write(date + '\n')
+            if dropped:
+                file_.write('Errors not logged before this one: %d\n'
+                            %dropped)
+            file_.write(text)
+        if image is not None:
+            im_file = os.path.join(self.logging_dir, param_error_image_pattern
+                                   %re.sub(r'[-\ \.:]', '_', date))
+            save_image(im_file, image)
+            self.image_files.append(im_file)
+            self._remove_old_images()
+
+    def _rotate_log(self):
+        if (not os.path.exists(self.log_file)
+            or os.path.getsize(self.log_file) < param_error_log_max_bytes):
+            return
+        for i in range(param_error_log_backups - 1, 0, -1):
+            older = '%s.%d'%(self.log_file, i)
+            if os.path.exists(older):
+                os.rename(older, '%s.%d'%(self.log_file, i + 1))
+        if param_error_log_backups > 0:
+            os.rename(self.log_file, self.log_file + '.1')
+        else:
+            os.remove(self.log_file)
+
+    def _remove_old_images(self):
+        sizes = [os.path.getsize(f) if os.path.exists(f) else 0 \
+                 for f in self.image_files]
+        total = sum(sizes)
+        while total > param_error_images_max_bytes and len(sizes) > 1:
+            old_file = self.image_files.pop(0)
+            total -= sizes.pop(0)
+            if os.path.exists(old_file):
+                os.remove(old_file)
+
+
+class FrameRecorder(threading.Thread):
+    """Appends the frames captured for detection to a recording file.
+
+    Every frame is stored with the time at which it was captured and
+    the Hough threshold in use, see `RecordingSource`. Frames are
+    encoded as PNG in this thread. Unlike errors, frames are never
+    dropped: `record` waits when the queue of the thread is full.
+
+    """
+    def __init__(self, filename):
+        super(FrameRecorder, self).__init__(name='FrameRecorder')
+        self.daemon = True
+        self.filename = filename
+        self.queue = Queue.Queue(param_recording_queue_size)
+
+    def record(self, timestamp, hough_threshold, image):
+        # The image is copied because detection may draw on it
+        self.queue.put((timestamp, hough_threshold, image.copy()))
+
+    def run(self):
+        with open(self.filename, 'ab') as file_:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                timestamp, hough_threshold, image = item
+                data = images.encode_image(image)
+                file_.write(_recording_header.pack(timestamp,
+                                                   hough_threshold,
+                                                   len(data)))
+                file_.write(data)
+
+    def stop(self):
+        """Writes the pending frames and stops the thread."""
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
 
 
 class ExamDetectorContext(object):
@@ -415,8 +1011,17 @@ class ExamDetectorContext(object):
         self.hough_thresholds_idx = 0
         self.failures_in_a_row = 0
         self.camera = None
+        self.camera_reader = None
+        self.error_log_writer = None
+        self._error_log_lock = threading.Lock()
+        self.recording_file = None
+        self.frame_recorder = None
         self.camera_id = camera_id
         self.threshold_locked = False
+        self.lines_orientation = None
+        self.tracked_axes = None
+        # Stage times of the frames detected with the 'timing' option
+        self.timing_stats = timing.TimingStats()
         self.ocr = classifiers.DefaultDigitClassifier()
         self.crosses_classifier = classifiers.DefaultCrossesClassifier()
 
@@ -444,6 +1049,7 @@ class ExamDetectorContext(object):
                     self.camera = self._try_camera(previous_camera)
                     if self.camera is None:
                         self.camera, self.camera_id = self._try_next_camera(-1)
+            self._start_reader()
         return self.camera is not None
 
     def current_camera_id(self):
@@ -462,10 +1068,12 @@ class ExamDetectorContext(object):
         """
 
         if self.camera is not None:
+            self._stop_reader()
             del self.camera
         camera, camera_id = self._try_next_camera(self.camera_id)
         if camera is not None:
             self.camera, self.camera_id = camera, camera_id
+            self._start_reader()
             return True
         else:
             return False
@@ -480,6 +1088,12 @@ class ExamDetectorContext(object):
     def get_hough_threshold(self):
         return self.hough_thresholds[self.hough_thresholds_idx]
 
+    def set_hough_threshold(self, threshold):
+        """Moves to `threshold` if it is in the list and not locked."""
+        if not self.threshold_locked and threshold in self.hough_thresholds:
+            self.hough_thresholds_idx = self.hough_thresholds.index(threshold)
+            self.failures_in_a_row = 0
+
     def next_hough_threshold(self):
         if not self.threshold_locked:
             self.hough_thresholds_idx = ((self.hough_thresholds_idx + 1)
@@ -501,16 +1115,48 @@ class ExamDetectorContext(object):
 
         """
         if self.camera is not None:
+            self._stop_reader()
             self.camera.release()
         self.camera = None
+        with self._error_log_lock:
+            writer = self.error_log_writer
+            self.error_log_writer = None
+        if writer is not None:
+            writer.stop()
+        if self.frame_recorder is not None:
+            self.frame_recorder.stop()
+            self.frame_recorder = None
+
+    def record_frames(self, filename):
+        """Appends from now on every captured frame to `filename`.
+
+        Frames are written in the background by a `FrameRecorder`.
+        The recording can be replayed with
+        `ReplayExamDetectorContext`.
+
+        """
+        self.recording_file = filename
+
+    def log_error(self, logging_dir, date, text, image):
+        """Stores the trace and image of an error without blocking.
+
+        See `ErrorLogWriter`.
+
+        """
+        with self._error_log_lock:
+            if self.error_log_writer is None:
+                self.error_log_writer = ErrorLogWriter(logging_dir)
+                self.error_log_writer.start()
+            writer = self.error_log_writer
+        writer.submit(date, text, image)
 
     def capture(self, clone=False, resize=None):
-        """Returns a capture.
+        """Returns the newest frame of the camera.
 
         If `clone` is True, the image returned is a copy of the
-        original.  Use this option if you plan to modify the image or
-        store it for later, because the buffer of the original image
-        will be reused by OpenCV por the next capture.
+        original.  Use this option if you plan to modify the image,
+        because the original image is kept in the frame buffer and
+        the same frame may be returned again.
 
         `resize` is a tuple (width, height). If it is not None, then
         the image is scaled to that size. Scaling implies a new copy
@@ -522,25 +1168,48 @@ class ExamDetectorContext(object):
             # The image will be cloned when resizing
             clone = False
         if self.camera is not None:
-            image = self.capture_image(clone=clone)
+            timestamp, image = self.capture_frame(clone=clone)
+            if image is not None and self.recording_file is not None:
+                self._record_frame(timestamp, image)
             if resize is not None:
                 image = cv2.resize(image, resize, interpolation=cv2.INTER_AREA)
         return image
 
-    def dump_buffer(self, delay_suffered):
-        if self.camera is not None and delay_suffered > 0.1:
-            frames_to_drop = min(8, int(1 + (delay_suffered - 0.1) / 0.04))
-            for i in range(0, frames_to_drop):
-                self.capture_image(False)
+    def capture_frame(self, clone=False):
+        """Returns the newest frame as a (timestamp, image) tuple."""
+        timestamp, image = None, None
+        if self.camera_reader is not None:
+            timestamp, image = self.camera_reader.latest_frame()
+        if image is not None and clone:
+            image = image.copy()
+        return timestamp, image
 
-    def capture_image(self, clone=False):
-        success, image = self.camera.read()
-        if not success:
-            image = None
-        elif clone:
-            return image.copy()
-        else:
-            return image
+    def next_capture_delay(self):
+        """Returns the time in seconds until the next capture, or None.
+
+        None means that frames may be captured at any rate. Only
+        replayed recordings return a delay, see
+        `ReplayExamDetectorContext`.
+
+        """
+        return None
+
+    def _record_frame(self, timestamp, image):
+        if self.frame_recorder is None:
+            self.frame_recorder = FrameRecorder(self.recording_file)
+            self.frame_recorder.start()
+        self.frame_recorder.record(timestamp, self.get_hough_threshold(),
+                                   image)
+
+    def _start_reader(self):
+        if self.camera is not None and self.camera_reader is None:
+            self.camera_reader = CameraReader(self.camera)
+            self.camera_reader.start()
+
+    def _stop_reader(self):
+        if self.camera_reader is not None:
+            self.camera_reader.stop()
+            self.camera_reader = None
 
     def _try_next_camera(self, cur_camera_id):
         camera = None
@@ -561,6 +1230,154 @@ class ExamDetectorContext(object):
         return cam
 
 
+class ContextSnapshot(object):
+    """The view of an `ExamDetectorContext` for a detection in flight.
+
+    In search mode the frames are detected concurrently in the worker
+    threads. Each detection reads the state that the context had when
+    its frame was captured (Hough threshold, tracked axes and lines
+    orientation), and its changes to that state are recorded instead
+    of applied. `apply` applies them, from the main thread and in frame
+    order, so that the context evolves as if the frames had been
+    detected one after the other. The camera, classifiers, error log
+    and timing statistics are those of the context itself.
+
+    """
+    def __init__(self, context):
+        self.context = context
+        self._updates = []
+        self._copy_state()
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    @property
+    def tracked_axes(self):
+        return self._tracked_axes
+
+    @tracked_axes.setter
+    def tracked_axes(self, axes):
+        self._tracked_axes = axes
+        self._record(setattr, self.context, 'tracked_axes', axes)
+
+    @property
+    def lines_orientation(self):
+        return self._lines_orientation
+
+    @lines_orientation.setter
+    def lines_orientation(self, orientation):
+        self._lines_orientation = orientation
+        self._record(setattr, self.context, 'lines_orientation', orientation)
+
+    def capture(self, clone=False, resize=None):
+        image = self.context.capture(clone=clone, resize=resize)
+        # Replayed recordings set the threshold of the frame on capture
+        self._copy_state()
+        return image
+
+    def get_hough_threshold(self):
+        return self.hough_thresholds[self.hough_thresholds_idx]
+
+    def set_hough_threshold(self, threshold):
+        if not self.threshold_locked and threshold in self.hough_thresholds:
+            self.hough_thresholds_idx = self.hough_thresholds.index(threshold)
+        self._record(self.context.set_hough_threshold, threshold)
+
+    def next_hough_threshold(self):
+        if not self.threshold_locked:
+            self.hough_thresholds_idx = ((self.hough_thresholds_idx + 1)
+                                         % len(self.hough_thresholds))
+        self._record(self.context.next_hough_threshold)
+
+    def notify_failure(self):
+        self._record(self.context.notify_failure)
+
+    def notify_success(self):
+        self._record(self.context.notify_success)
+
+    def apply(self):
+        """Applies the recorded changes to the context."""
+        updates, self._updates = self._updates, []
+        for function, args in updates:
+            function(*args)
+
+    def _record(self, function, *args):
+        self._updates.append((function, args))
+
+    def _copy_state(self):
+        self.hough_thresholds = self.context.hough_thresholds
+        self.hough_thresholds_idx = self.context.hough_thresholds_idx
+        self.threshold_locked = self.context.threshold_locked
+        self._tracked_axes = self.context.tracked_axes
+        self._lines_orientation = self.context.lines_orientation
+
+
+class SearchPipeline(object):
+    """Keeps the order of the frames detected concurrently in search mode.
+
+    Frames are numbered in capture order when their detection starts,
+    and `finish` returns the detections in that order, even when the
+    one of a frame finishes before the one of an older frame. `restart`
+    begins a new generation of the search: the detections of older
+    generations are dropped when they finish. `drop`, if given, is
+    called with every detection dropped.
+
+    """
+    def __init__(self, depth, drop=None):
+        self.depth = depth
+        self.drop = drop
+        self.generation = 0
+        self.done = {}
+        self.restart()
+
+    def restart(self):
+        if self.drop is not None:
+            for detector in self.done.values():
+                self.drop(detector)
+        self.generation += 1
+        self.next_sequence = 0
+        self.applied = -1
+        self.in_flight = set()
+        self.done = {}
+
+    def full(self):
+        """True when `depth` detections are in flight or not applied yet.
+
+        Finished detections waiting for an older frame count as well,
+        so that a slow detection does not let them pile up.
+
+        """
+        return len(self.in_flight) + len(self.done) >= self.depth
+
+    def start(self):
+        """Numbers a new frame and returns its (generation, sequence) key."""
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        self.in_flight.add(sequence)
+        return self.generation, sequence
+
+    def finish(self, key, detector):
+        """Registers a finished detection.
+
+        Returns the list of detections that can now be applied, in
+        frame order. It is empty if an older frame is still in flight,
+        or if the frame belongs to an older generation.
+
+        """
+        generation, sequence = key
+        if generation != self.generation:
+            if self.drop is not None:
+                self.drop(detector)
+            return []
+        self.in_flight.discard(sequence)
+        self.done[sequence] = detector
+        ready = []
+        while self.applied + 1 in self.done:
+            self.applied += 1
+            ready.append(self.done.pop(self.applied))
+        return ready
+
+
 class FalseExamDetectorContext(ExamDetectorContext):
     def __init__(self, session_file):
         super(FalseExamDetectorContext, self).__init__()
@@ -591,9 +1408,6 @@ class FalseExamDetectorContext(ExamDetectorContext):
             image = None
         return image
 
-    def dump_buffer(self, delay_suffered):
-        pass
-
     def notify_success(self):
         super(FalseExamDetectorContext, self).notify_success()
         self.next_exam_idx += 1
@@ -601,6 +1415,268 @@ class FalseExamDetectorContext(ExamDetectorContext):
             self.next_exam_idx = 0
 
 
+class VideoFileSource(object):
+    """Reads the frames of a video file.
+
+    `read` returns (timestamp, image) tuples, with timestamps in seconds
+    from the start of the video, or (None, None) at its end.
+
+    """
+    def __init__(self, filename):
+        self.video = cv2.VideoCapture(filename)
+        if not self.video.isOpened():
+            raise IOError('Cannot open video file: ' + filename)
+        fps = self.video.get(_cap_prop_fps)
+        self.frame_period = 1.0 / fps if fps > 0 else 1.0 / param_sequence_fps
+        self.frame_num = 0
+
+    def read(self):
+        success, image = self.video.read()
+        if not success or image is None:
+            return None, None
+        timestamp = self.video.get(_cap_prop_pos_msec) / 1000
+        if timestamp <= 0 and self.frame_num > 0:
+            # Some backends do not report positions
+            timestamp = self.frame_num * self.frame_period
+        self.frame_num += 1
+        return timestamp, image
+
+    def close(self):
+        self.video.release()
+
+
+class ImageSequenceSource(object):
+    """Reads the frames of a sequence of image files.
+
+    `path` is either a directory, whose images are read in the order of
+    their names, or a glob pattern such as 'frames/frame-*.png'. If the
+    directory contains a file named `param_sequence_timestamps`, it
+    must contain the timestamp in seconds of every frame, one per line.
+    Otherwise frames are `param_sequence_fps` per second.
+
+    """
+    def __init__(self, path):
+        self.files = images.image_files([path])
+        if not self.files:
+            raise IOError('No image files in: ' + path)
+        if os.path.isdir(path):
+            directory = path
+        else:
+            directory = os.path.dirname(path)
+        timestamps_file = os.path.join(directory, param_sequence_timestamps)
+        if os.path.exists(timestamps_file):
+            with open(timestamps_file) as f:
+                self.timestamps = [float(line) for line in f if line.strip()]
+        else:
+            self.timestamps = [i / param_sequence_fps \
+                               for i in range(len(self.files))]
+        self.frame_num = 0
+
+    def read(self):
+        if self.frame_num >= min(len(self.files), len(self.timestamps)):
+            return None, None
+        image = images.load_image(self.files[self.frame_num])
+        timestamp = self.timestamps[self.frame_num]
+        self.frame_num += 1
+        return timestamp, image
+
+    def close(self):
+        pass
+
+
+class RecordingSource(object):
+    """Reads the frames of a recording made by `FrameRecorder`.
+
+    `read` returns (timestamp, image) tuples, with the time at which
+    every frame was captured, or (None, None) at the end. The Hough
+    threshold in use when the last frame read was captured is kept in
+    `hough_threshold`. `next_timestamp` returns the time of the next
+    frame without reading it.
+
+    """
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.hough_threshold = None
+
+    def read(self):
+        header = self.file.read(_recording_header.size)
+        if len(header) < _recording_header.size:
+            return None, None
+        timestamp, hough_threshold, length = _recording_header.unpack(header)
+        data = self.file.read(length)
+        if len(data) < length:
+            # The recording was interrupted while writing this frame
+            return None, None
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8),
+                             cv2.IMREAD_COLOR)
+        self.hough_threshold = hough_threshold
+        return timestamp, image
+
+    def next_timestamp(self):
+        position = self.file.tell()
+        header = self.file.read(_recording_header.size)
+        self.file.seek(position)
+        if len(header) < _recording_header.size:
+            return None
+        return _recording_header.unpack(header)[0]
+
+    def close(self):
+        self.file.close()
+
+
+def open_frame_source(path):
+    """Returns the frame source for a video file, an image sequence or
+    a frame recording."""
+    if os.path.isdir(path) or glob.has_magic(path):
+        return ImageSequenceSource(path)
+    elif path.endswith(param_recording_extension):
+        return RecordingSource(path)
+    else:
+        return VideoFileSource(path)
+
+
+class ReplayExamDetectorContext(ExamDetectorContext):
+    """Takes the frames from a video file, image sequence or recording.
+
+    If `paced` is True, the frame returned by `capture` is the one that
+    a camera would provide at that moment according to the timestamps
+    of the frames, so that frames are skipped when detection is slower
+    than the recording. Otherwise, every frame is returned once, in
+    order, as fast as they are requested. After the last frame,
+    `capture` returns None.
+
+    Frame recordings hold just the frames that were captured for
+    detection. They are always returned once and in order, with the
+    Hough threshold that was in use. When `paced` is True,
+    `next_capture_delay` returns the time between the last frame
+    captured and the next one in the recording, so that the program
+    captures them with the same timing.
+
+    """
+    def __init__(self, path, paced=True):
+        super(ReplayExamDetectorContext, self).__init__()
+        self.path = path
+        self.paced = paced
+        self.camera_id = 99
+        self.frames_read = 0
+        self.start_time = None
+        self.first_timestamp = None
+        self.current = (None, None)
+        self.pending = (None, None)
+        self.frame_period = 1.0 / param_sequence_fps
+
+    def open_camera(self, camera_id=None):
+        if self.camera is None:
+            self.camera = open_frame_source(self.path)
+            self.frames_read = 0
+            self.start_time = None
+            self.current = (None, None)
+        return True
+
+    def current_camera_id(self):
+        return 99
+
+    def next_camera(self):
+        return True
+
+    def close_camera(self):
+        if self.camera is not None:
+            self.camera.close()
+        self.camera = None
+        super(ReplayExamDetectorContext, self).close_camera()
+
+    def capture_frame(self, clone=False):
+        if self.camera is None:
+            return None, None
+        # Frames are never reused, so that they need not be cloned
+        if isinstance(self.camera, RecordingSource):
+            return self._recorded_frame()
+        elif self.paced:
+            return self._paced_frame()
+        else:
+            return self._read_frame()
+
+    def next_capture_delay(self):
+        if (not self.paced or not isinstance(self.camera, RecordingSource)
+            or self.current[1] is None):
+            return None
+        timestamp = self.camera.next_timestamp()
+        if timestamp is None:
+            return None
+        return max(0.0, timestamp - self.current[0])
+
+    def _read_frame(self):
+        timestamp, image = self.camera.read()
+        if image is not None:
+            self.frames_read += 1
+        return timestamp, image
+
+    def _recorded_frame(self):
+        self.current = self._read_frame()
+        if self.current[1] is not None:
+            threshold = self.camera.hough_threshold
+            if threshold in self.hough_thresholds:
+                self.hough_thresholds_idx = \
+                                    self.hough_thresholds.index(threshold)
+        return self.current
+
+    def _paced_frame(self):
+        if self.start_time is None:
+            self.start_time = time.time()
+            self.current = self._read_frame()
+            self.pending = self._read_frame()
+            self.first_timestamp = self.current[0]
+            return self.current
+        if self.current[1] is None:
+            # The source had no frames, or they are over
+            return self.current
+        elapsed = time.time() - self.start_time + self.first_timestamp
+        while self.pending[1] is not None and self.pending[0] <= elapsed:
+            self.frame_period = self.pending[0] - self.current[0]
+            self.current = self.pending
+            self.pending = self._read_frame()
+        if (self.pending[1] is None
+            and self.current[0] + self.frame_period < elapsed):
+            # The time of the last frame is over
+            self.current = (None, None)
+        return self.current
+
+
+class HoughVotes(object):
+    """Counts the votes of lines in the Hough accumulator of an image.
+
+    Reproduces the voting of cv2.HoughLines(image, 1, 0.01, ...):
+    rho is rounded to the nearest integer, with the same
+    single-precision sine and cosine tables as OpenCV. Those tables
+    start at the `min_theta` of the transform, so that the votes of a
+    line found within an angle window are counted with the tables of
+    that window. The votes of all the lines with the same angle are
+    counted at once.
+
+    """
+    def __init__(self, image):
+        ys, xs = np.nonzero(image)
+        self.xs = xs.astype(np.float32)
+        self.ys = ys.astype(np.float32)
+        self._counts = {}
+
+    def count(self, line, min_theta=0.0):
+        n = int(round((line[1] - min_theta) / 0.01))
+        key = (min_theta, n)
+        if not key in self._counts:
+            sin_table, cos_table = _hough_tables(min_theta)
+            rhos = np.rint(self.xs * cos_table[n]
+                           + self.ys * sin_table[n]).astype(int)
+            rho_min = rhos.min()
+            self._counts[key] = (rho_min, np.bincount(rhos - rho_min))
+        rho_min, counts = self._counts[key]
+        idx = int(round(line[0])) - rho_min
+        if idx >= 0 and idx < len(counts):
+            return counts[idx]
+        else:
+            return 0
+
+
 def pre_process(image):
     gray = images.rgb_to_gray(image)
     thr = cv2.adaptiveThreshold(gray, 255,
@@ -610,35 +1686,333 @@ def pre_process(image):
                                 param_adaptive_threshold_offset)
     return thr
 
-def detect_lines(image, hough_threshold):
-    lines = cv2.HoughLines(image, 1, 0.01, hough_threshold)
-    if lines is None or len(lines[0]) > 500:
+def find_sheet_regions(image, accept=None):
+    """Returns the regions of the image that may hold different sheets.
+
+    The image is split recursively at the widest band without ink, as
+    long as the band and the parts it separates are wide enough (an
+    XY-cut). The regions are (x0, y0, x1, y1) rectangles. If the image
+    cannot be split, the only region returned is the whole image.
+
+    If `accept` is given, a band is used only if `accept` returns True
+    for both of the regions it separates; otherwise, the next widest
+    band is tried. Checking that both hold answer tables avoids
+    splitting one sheet at the gap between two of its tables, or
+    between its header and its tables. The regions are checked without
+    their empty borders, so that every region returned is exactly one
+    of the regions `accept` was called with.
+
+    """
+    scale = min(1.0, param_sheets_width / images.width(image))
+    if scale < 1.0:
+        small = cv2.resize(image, (0, 0), fx=scale, fy=scale,
+                           interpolation=cv2.INTER_AREA)
+    else:
+        small = image
+    gray = images.rgb_to_gray(small) if len(small.shape) == 3 else small
+    # The median filter removes the noise of the paper
+    gray = cv2.medianBlur(gray, 3)
+    ink = cv2.adaptiveThreshold(gray, 1, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                cv2.THRESH_BINARY_INV,
+                                param_adaptive_threshold_block_size,
+                                param_sheets_ink_offset)
+    def image_region(region):
+        x0, y0, x1, y1 = region
+        margin_x = int(param_sheets_margin * (x1 - x0)) + 1
+        margin_y = int(param_sheets_margin * (y1 - y0)) + 1
+        return (max(0, int((x0 - margin_x) / scale)),
+                max(0, int((y0 - margin_y) / scale)),
+                min(images.width(image), int((x1 + margin_x) / scale)),
+                min(images.height(image), int((y1 + margin_y) / scale)))
+    if accept is not None:
+        accept_region = lambda region: accept(image_region(region))
+    else:
+        accept_region = None
+    height, width = ink.shape
+    regions = []
+    region = _trim_region(ink, (0, 0, width, height))
+    if region is not None:
+        _xy_cut(ink, region, regions, accept_region)
+    if len(regions) < 2:
+        return [(0, 0, images.width(image), images.height(image))]
+    return [image_region(region) for region in regions]
+
+def _xy_cut(ink, region, regions, accept):
+    """Splits a region, whose empty borders are already removed."""
+    x0, y0, x1, y1 = region
+    height, width = ink.shape
+    cols, rows = _region_bands(ink, region)
+    cuts = []
+    for bands, start, size, vertical in ((cols, x0, width, True),
+                                         (rows, y0, height, False)):
+        end = bands[-1][1]
+        for (_, gap_start), (gap_end, _) in zip(bands[:-1], bands[1:]):
+            gap = gap_end - gap_start
+            if (gap >= param_sheets_min_gap * size
+                and gap_start >= param_sheets_min_size * size
+                and end - gap_end >= param_sheets_min_size * size):
+                cuts.append((gap, vertical, start + gap_start,
+                             start + gap_end))
+    # The widest bands first (the sort is stable for equal widths)
+    cuts.sort(key=lambda cut: -cut[0])
+    for gap, vertical, cut_start, cut_end in cuts:
+        if vertical:
+            parts = ((x0, y0, cut_start, y1), (cut_end, y0, x1, y1))
+        else:
+            parts = ((x0, y0, x1, cut_start), (x0, cut_end, x1, y1))
+        parts = [_trim_region(ink, part) for part in parts]
+        if None in parts:
+            continue
+        if accept is None or all(accept(part) for part in parts):
+            for part in parts:
+                _xy_cut(ink, part, regions, accept)
+            return
+    regions.append((x0, y0, x1, y1))
+
+def _trim_region(ink, region):
+    """Removes the empty borders of a region.
+
+    Returns None if the region has no ink at all.
+
+    """
+    x0, y0, x1, y1 = region
+    cols, rows = _region_bands(ink, region)
+    if not cols or not rows:
+        return None
+    return (x0 + cols[0][0], y0 + rows[0][0],
+            x0 + cols[-1][1], y0 + rows[-1][1])
+
+def _region_bands(ink, region):
+    """Returns the bands with ink of the columns and rows of a region."""
+    x0, y0, x1, y1 = region
+    block = ink[y0:y1, x0:x1]
+    return (_ink_bands(block.sum(axis=0), y1 - y0),
+            _ink_bands(block.sum(axis=1), x1 - x0))
+
+def _ink_bands(profile, length):
+    """Returns the (start, end) intervals of a profile that have ink."""
+    has_ink = profile > param_sheets_empty_ink * length
+    bands = []
+    start = None
+    for i, value in enumerate(has_ink):
+        if value and start is None:
+            start = i
+        elif not value and start is not None:
+            bands.append((start, i))
+            start = None
+    if start is not None:
+        bands.append((start, len(has_ink)))
+    return bands
+
+def capture_difference(image1, image2):
+    """Returns how different two captures of the same size are.
+
+    Both images are scaled down to `param_change_width` and their
+    pixels divided by their mean brightness, so that small exposure
+    changes are ignored. Returns the mean absolute difference of the
+    normalized pixels.
+
+    """
+    size = (param_change_width,
+            int(round(images.height(image1) * param_change_width
+                      / images.width(image1))))
+    normalized = []
+    for image in (image1, image2):
+        if len(image.shape) == 3:
+            image = images.rgb_to_gray(image)
+        small = cv2.resize(image, size,
+                           interpolation=cv2.INTER_AREA).astype(np.float32)
+        normalized.append(small / max(1.0, small.mean()))
+    return float(np.abs(normalized[0] - normalized[1]).mean())
+
+def pre_process_rows(image, y_start, y_end):
+    """Pre-processes only the rows from `y_start` to `y_end`.
+
+    The rest of the pre-processed image is left blank. The rows are
+    the same as they would be in `pre_process(image)`.
+
+    """
+    height = images.height(image)
+    y_start = max(0, y_start)
+    y_end = min(height, y_end)
+    margin = param_adaptive_threshold_block_size // 2
+    y_from = max(0, y_start - margin)
+    y_to = min(height, y_end + margin)
+    image_proc = np.zeros((height, images.width(image)), dtype=np.uint8)
+    if y_start < y_end:
+        part = pre_process(image[y_from:y_to])
+        image_proc[y_start:y_end] = part[y_start - y_from:y_end - y_from]
+    return image_proc
+
+def detect_lines(image, hough_threshold, angle_windows=None):
+    lines = hough_lines(image, hough_threshold, angle_windows)
+    if len(lines) > 500:
         return []
-    lines = lines[0]
     return sorted([(float(l[0]), float(l[1])) for l in lines],
                   key = lambda x: x[1])
 
+def detect_lines_multi(image, hough_thresholds, angle_windows=None):
+    """Detects lines for several Hough thresholds with just one transform.
+
+    The transform is computed once, at the lowest threshold, and the
+    votes of its lines are counted in order to filter them for the
+    other thresholds. Returns a list of (threshold, lines) tuples,
+    from the highest to the lowest threshold, with the same lines
+    detect_lines would return for each threshold.
+
+    """
+    thresholds = sorted(hough_thresholds, reverse=True)
+    selected = dict([(threshold, []) for threshold in thresholds])
+    votes = HoughVotes(image)
+    for min_theta, lines in _hough_lines_parts(image, thresholds[-1],
+                                               angle_windows):
+        # OpenCV sorts the lines by votes, from the highest, so the
+        # lines of each threshold are a prefix of the list
+        for threshold in thresholds:
+            low = 0
+            high = len(lines)
+            while low < high:
+                middle = (low + high) // 2
+                if votes.count(lines[middle], min_theta) > threshold:
+                    low = middle + 1
+                else:
+                    high = middle
+            selected[threshold].extend(lines[:low])
+    candidates = []
+    for threshold in thresholds:
+        lines = selected[threshold]
+        if len(lines) > 500:
+            lines = []
+        candidates.append((threshold,
+                           sorted([(float(l[0]), float(l[1])) \
+                                   for l in lines], key = lambda x: x[1])))
+    return candidates
+
+def hough_lines(image, hough_threshold, angle_windows=None):
+    """Runs the Hough transform, optionally within some angle windows.
+
+    `angle_windows` is a list of (min_theta, max_theta) tuples, as
+    returned by `angle_windows`. Returns an N x 2 array of (rho,
+    theta) lines. OpenCV releases older than 3.0 cannot restrict the
+    angles of the transform: the lines out of the windows are
+    discarded after it instead.
+
+    """
+    return np.concatenate([lines for min_theta, lines \
+                           in _hough_lines_parts(image, hough_threshold,
+                                                 angle_windows)])
+
+def _hough_lines_parts(image, hough_threshold, angle_windows):
+    # Returns a list of (min_theta, lines) tuples, with the first
+    # angle of the transform and an array of lines sorted by votes
+    if angle_windows is None or not _hough_angle_range:
+        lines = _lines_array(cv2.HoughLines(image, 1, 0.01, hough_threshold))
+        if angle_windows is not None:
+            inside = np.zeros(len(lines), dtype=bool)
+            for min_theta, max_theta in angle_windows:
+                inside |= ((lines[:, 1] > min_theta - 1e-6)
+                           & (lines[:, 1] < max_theta))
+            lines = lines[inside]
+        parts = [(0.0, lines)]
+    else:
+        parts = []
+        for min_theta, max_theta in angle_windows:
+            lines = cv2.HoughLines(image, 1, 0.01, hough_threshold,
+                                   min_theta=min_theta, max_theta=max_theta)
+            parts.append((min_theta, _lines_array(lines)))
+    return parts
+
+def angle_windows(horizontal_theta, width):
+    """Returns the Hough angle windows around the axes of the tables.
+
+    `horizontal_theta` is the expected angle of the horizontal lines,
+    and `width` the half width of the windows, in radians. The windows
+    are (min_theta, max_theta) tuples within [0, pi], aligned to the
+    angle resolution of the transform. The window of the vertical
+    lines is split in two when it wraps around 0.
+
+    """
+    windows = []
+    for center in (horizontal_theta, horizontal_theta - math.pi / 2):
+        low = center - width
+        high = center + width
+        if low < 0:
+            windows.append((low + math.pi, math.pi))
+            low = 0
+        if high > math.pi:
+            windows.append((0, high - math.pi))
+            high = math.pi
+        windows.append((low, high))
+    return [(max(0, math.floor(low / 0.01) * 0.01),
+             min(math.pi, math.ceil(high / 0.01) * 0.01)) \
+            for low, high in windows]
+
+def _lines_array(lines):
+    if lines is None:
+        return np.zeros((0, 2), dtype=np.float32)
+    # OpenCV 2.4 returns a 1 x N x 2 array, and newer releases N x 1 x 2
+    return lines.reshape(-1, 2)
+
+_hough_angle_range = int(cv2.__version__.split('.')[0]) >= 3
+
+def _hough_tables(min_theta=0.0):
+    """Returns the sine and cosine tables of cv2.HoughLines.
+
+    They start at `min_theta` and go on in steps of 0.01 up to pi.
+
+    """
+    if min_theta in _hough_tables_cache:
+        return _hough_tables_cache[min_theta]
+    num_angles = int(round((math.pi - min_theta) / 0.01)) + 1
+    sin_table = np.zeros(num_angles, dtype=np.float32)
+    cos_table = np.zeros(num_angles, dtype=np.float32)
+    # OpenCV accumulates the angle in single precision
+    angle = np.float32(min_theta)
+    for n in range(0, num_angles):
+        sin_table[n] = math.sin(angle)
+        cos_table[n] = math.cos(angle)
+        angle = np.float32(float(angle) + 0.01)
+    _hough_tables_cache[min_theta] = (sin_table, cos_table)
+    return sin_table, cos_table
+
+_hough_tables_cache = {}
+
 def detect_directions(lines):
+    """Groups the lines, sorted by theta, by their direction.
+
+    Every group takes the lines whose theta is less than
+    `param_directions_threshold` above the theta of its first line.
+    Returns a list of (average theta, lines sorted by abs(rho)).
+
+    """
     assert(len(lines) >= 2)
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 2)
+    thetas = lines[:, 1]
+    groups = []
+    start = 0
+    while start < len(lines):
+        end = np.searchsorted(thetas, thetas[start]
+                              + param_directions_threshold, side='left')
+        end = max(end, start + 1)
+        groups.append(lines[start:end])
+        start = end
+    if (len(groups) > 1 and abs(groups[0][0, 1] - groups[-1][0, 1] + math.pi)
+                            < param_directions_threshold):
+        wrapped = groups.pop()
+        groups[0] = np.vstack((groups[0],
+                               np.column_stack((-wrapped[:, 0],
+                                                wrapped[:, 1] - math.pi))))
     axes = []
-    rho, theta = lines[0]
-    axes.append((theta, [(rho, theta)]))
-    for rho, theta in lines[1:]:
-        if abs(theta - axes[-1][0]) < param_directions_threshold:
-            axes[-1][1].append((rho, theta))
-        else:
-            axes.append((theta, [(rho, theta)]))
-    if abs(axes[0][0] - axes[-1][0] + math.pi) < param_directions_threshold:
-        axes[0][1].extend([(-rho, theta - math.pi) \
-                           for rho, theta in axes[-1][1]])
-        del axes[-1]
-    for i in range(0, len(axes)):
-        avg = sum([theta for rho, theta in axes[i][1]]) / len(axes[i][1])
-        axes[i] = (avg, sorted(axes[i][1], key = lambda x: abs(x[0])))
+    for group in groups:
+        order = np.argsort(np.abs(group[:, 0]), kind='mergesort')
+        axes.append((float(group[:, 1].mean()), _lines_list(group[order])))
     if abs(axes[-1][0] - math.pi) < abs(axes[0][0]):
         axes = axes[-1:] + axes[0:-1]
     return axes
 
+def _lines_list(lines):
+    return [(rho, theta) for rho, theta in lines.tolist()]
+
 def detect_boxes(lines, dimensions):
     v_expected = len(dimensions) + sum([box[0] for box in dimensions])
     h_expected = 1 + max([box[1] for box in dimensions])
@@ -678,29 +2052,34 @@ def filter_axes(axes, dimensions, image_width, image_height, read_id):
 
     """
     # First, filter out lines too close to image borders
-    axes = ((axes[0][0],
-             [l for l in axes[0][1] \
-                 if ((abs(l[0]) < 0.97 * image_width and
-                      abs(l[0]) > 0.03 * image_width) or
-                     not g.angles_perpendicular(math.pi / 2, l[1]))]),
-            (axes[1][0],
-             [l for l in axes[1][1] \
-                 if ((abs(l[0]) < 0.97 * image_height and
-                      abs(l[0]) > 0.03 * image_height) or
-                     not g.angles_perpendicular(0.0, l[1]))]))
+    vlines = _filter_border_lines(axes[0][1], image_width, math.pi / 2)
+    hlines = _filter_border_lines(axes[1][1], image_height, 0.0)
+    axes = ((axes[0][0], _lines_list(vlines)),
+            (axes[1][0], _lines_list(hlines)))
     # Now, colapse lines that are too close
     v_expected = len(dimensions) + sum([box[0] for box in dimensions])
     h_expected = 1 + max([box[1] for box in dimensions])
     if read_id:
         h_expected += 2
-    hlines = collapse_lines_angles(axes[1][1], h_expected, True)
+    hlines = collapse_lines_angles(hlines, h_expected, True)
     if hlines is None:
         return axes
-    vlines = collapse_lines_angles(axes[0][1], v_expected, False)
+    vlines = collapse_lines_angles(vlines, v_expected, False)
     if vlines is None:
         return axes
     return [(axes[0][0], vlines), (axes[1][0], hlines)]
 
+def _filter_border_lines(lines, size, perpendicular_angle):
+    # Removes the lines perpendicular to `perpendicular_angle` whose
+    # rho is within 3% of the borders of the image
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 2)
+    rhos = np.abs(lines[:, 0])
+    diffs = lines[:, 1] - perpendicular_angle
+    perpendicular = ((np.abs(diffs - math.pi / 2) < 0.1)
+                     | (np.abs(diffs + math.pi / 2) < 0.1))
+    inside = (rhos < 0.97 * size) & (rhos > 0.03 * size)
+    return lines[inside | ~perpendicular]
+
 def collapse_lines_angles(lines, expected, horizontal):
     """Collapses lines that are close together.
 
@@ -710,34 +2089,30 @@ def collapse_lines_angles(lines, expected, horizontal):
        lines is not matched.
 
     """
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 2)
     if len(lines) < 2:
         return None
-    main_lines = []
-    sum_rho = lines[0][0]
-    sum_theta = lines[0][1]
-    num_lines = 1
-    last_line = lines[0]
-    for line in lines[1:]:
-        if ((((horizontal and line[1] > last_line[1]) or
-              (not horizontal and line[1] < last_line[1])) and
-             abs(line[0] - last_line[0]) >= 5) or
-            abs(line[0] - last_line[0]) > param_collapse_lines_maxgap):
-            main_lines.append((sum_rho / num_lines, sum_theta / num_lines))
-            sum_rho = line[0]
-            sum_theta = line[1]
-            num_lines = 1
-        else:
-            sum_rho += line[0]
-            sum_theta += line[1]
-            num_lines += 1
-        last_line = line
-    main_lines.append((sum_rho / num_lines, sum_theta / num_lines))
+    drhos = np.abs(np.diff(lines[:, 0]))
+    dthetas = np.diff(lines[:, 1])
+    turn = (dthetas > 0) if horizontal else (dthetas < 0)
+    splits = ((turn & (drhos >= 5))
+              | (drhos > param_collapse_lines_maxgap))
+    starts = np.concatenate(([0], np.flatnonzero(splits) + 1))
+    sizes = np.diff(np.concatenate((starts, [len(lines)])))
+    main_lines = np.add.reduceat(lines, starts, axis=0) / sizes[:, np.newaxis]
     if (not horizontal and len(main_lines) == expected) or horizontal:
-        return main_lines
+        return _lines_list(main_lines)
     else:
         return None
 
 def cell_corners(hlines, vlines, iwidth, iheight, dimensions):
+    """Returns the corners of the cells of the answer tables.
+
+    The result is a list with a (rows + 1, columns + 1, 2) array of
+    integer points per table, or an empty list if the lines do not
+    match `dimensions` or the corners fail `check_corners`.
+
+    """
     h_expected = 1 + max([box[1] for box in dimensions])
     v_expected = len(dimensions) + sum([box[0] for box in dimensions])
     if len(vlines) != v_expected:
@@ -749,65 +2124,257 @@ def cell_corners(hlines, vlines, iwidth, iheight, dimensions):
     corner_matrixes = []
     vini = 0
     for width, height in dimensions:
-        corners = []
-        for i in range(0, height + 1):
-            cpart = []
-            corners.append(cpart)
-            for j in range(vini, vini + width + 1):
-                c = g.intersection(hlines[i], vlines[j])
-                cpart.append(c)
-        corner_matrixes.append(corners)
+        corner_matrixes.append(g.intersections(hlines[:height + 1],
+                                               vlines[vini:vini + width + 1]))
         vini += 1 + width
     if check_corners(corner_matrixes, iwidth, iheight):
         return corner_matrixes
     else:
         return []
 
+def detect_quads(image):
+    """Returns the convex quadrilaterals drawn in the image.
+
+    Their corners are in the order top-left, top-right, bottom-right
+    and bottom-left. They are sorted by area, from the largest one.
+    Quadrilaterals inside others are included as well, because the
+    edge of the page or a frame may surround the tables; the ones that
+    are not tables are discarded by `select_table_quads`.
+
+    """
+    gray = images.rgb_to_gray(image) if len(image.shape) == 3 else image
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                   cv2.THRESH_BINARY_INV,
+                                   param_adaptive_threshold_block_size,
+                                   param_contours_threshold_offset)
+    # The position of the contours in the result differs among versions
+    contours = cv2.findContours(binary, cv2.RETR_LIST,
+                                cv2.CHAIN_APPROX_SIMPLE)[-2]
+    min_area = param_contours_min_area * gray.shape[0] * gray.shape[1]
+    quads = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < min_area:
+            continue
+        epsilon = param_contours_approx_epsilon \
+                  * cv2.arcLength(contour, True)
+        polygon = cv2.approxPolyDP(contour, epsilon, True)
+        if len(polygon) == 4 and cv2.isContourConvex(polygon):
+            quads.append((area, _sort_quad_corners(polygon.reshape(4, 2))))
+    quads.sort(key=lambda quad: -quad[0])
+    return [corners for area, corners in quads]
+
+def _sort_quad_corners(points):
+    # Top-left has the lowest x + y and bottom-right the highest;
+    # top-right has the highest x - y and bottom-left the lowest
+    sums = points.sum(axis=1)
+    diffs = points[:, 0] - points[:, 1]
+    return [tuple(int(v) for v in points[i]) \
+            for i in (np.argmin(sums), np.argmax(diffs),
+                      np.argmax(sums), np.argmin(diffs))]
+
+def select_table_quads(quads, dimensions):
+    """Chooses the quadrilaterals of the answer tables.
+
+    Returns them from left to right, or None if no combination of
+    `quads` looks like the tables of `dimensions`: their cells must
+    have similar sizes and their top lines must be aligned.
+
+    """
+    best = None
+    candidates = quads[:param_contours_max_quads]
+    for combination in itertools.combinations(candidates, len(dimensions)):
+        tables = sorted(combination, key=lambda quad: quad[0][0])
+        if _check_table_quads(tables, dimensions):
+            area = sum(cv2.contourArea(np.array(quad, np.float32)) \
+                       for quad in tables)
+            if best is None or area > best[0]:
+                best = (area, tables)
+    return best[1] if best is not None else None
+
+def _check_table_quads(tables, dimensions):
+    cell_widths = []
+    cell_heights = []
+    for quad, (width, height) in zip(tables, dimensions):
+        plu, pru, prd, pld = quad
+        cell_widths.append((g.distance(plu, pru) + g.distance(pld, prd))
+                           / (2 * width))
+        cell_heights.append((g.distance(plu, pld) + g.distance(pru, prd))
+                            / (2 * height))
+    for sizes in (cell_widths, cell_heights):
+        if min(sizes) < (1 - param_contours_cell_tolerance) * max(sizes):
+            return False
+    # The top-left corners must be close to the top line of the first
+    # table, and tables must not overlap
+    top = g.line_from_points(tables[0][0], tables[0][1])
+    tolerance = param_contours_align_tolerance * min(cell_heights)
+    for quad, next_quad in zip(tables[:-1], tables[1:]):
+        if next_quad[0][0] <= quad[1][0]:
+            return False
+    for quad in tables[1:]:
+        rho = quad[0][0] * math.cos(top[1]) + quad[0][1] * math.sin(top[1])
+        if abs(rho - top[0]) > tolerance:
+            return False
+    return True
+
+def select_id_quad(quads, tables, dimensions, top_line, num_digits):
+    """Chooses the quadrilateral of the ID box among `quads`.
+
+    It must be above the top line of the tables, not farther than the
+    ID box usually is, and its shape must fit `num_digits` cells.
+    Returns None if no quadrilateral matches.
+
+    """
+    row_height = g.distance(tables[0][0], tables[0][3]) / dimensions[0][1]
+    for quad in quads:
+        if quad in tables:
+            continue
+        plu, pru, prd, pld = quad
+        width = (g.distance(plu, pru) + g.distance(pld, prd)) / 2
+        height = (g.distance(plu, pld) + g.distance(pru, prd)) / 2
+        if (height < 0.5 * row_height
+            or not 0.5 < width / height / num_digits < 2.0):
+            continue
+        distance = top_line[0] - (pld[0] * math.cos(top_line[1])
+                                  + pld[1] * math.sin(top_line[1]))
+        if 0 < distance < 3.5 * row_height:
+            return quad
+    return None
+
+def quads_corners(tables, dimensions):
+    """Returns the corner matrixes of the tables from their outer corners.
+
+    The corners of the cells are predicted from the homography that
+    maps the grid of every table in `dimensions` to its corners.
+
+    """
+    corner_matrixes = []
+    for quad, (width, height) in zip(tables, dimensions):
+        grid = np.array([(0, 0), (width, 0), (width, height), (0, height)],
+                        np.float32)
+        homography = cv2.getPerspectiveTransform(grid,
+                                                 np.array(quad, np.float32))
+        points = np.array([[(j, i) for j in range(width + 1)] \
+                           for i in range(height + 1)], np.float32)
+        projected = cv2.perspectiveTransform(points, homography)
+        corner_matrixes.append(g.round_points(projected))
+    return corner_matrixes
+
+def corners_lines(corner_matrixes):
+    """Returns the (hlines, vlines) of the tables of `corner_matrixes`.
+
+    Horizontal lines are shared by all the tables that have them.
+
+    """
+    hlines = []
+    for i in range(max(len(corners) for corners in corner_matrixes)):
+        rows = [corners[i] for corners in corner_matrixes \
+                if len(corners) > i]
+        hlines.append(g.line_from_points(rows[0][0], rows[-1][-1]))
+    vlines = [g.line_from_points(corners[0][j], corners[-1][j]) \
+              for corners in corner_matrixes \
+              for j in range(len(corners[0]))]
+    return hlines, vlines
+
+def lines_extents(hlines, vlines, dimensions):
+    """Returns the extents of the lines of the answer tables.
+
+    Returns two lists: the (x_start, x_end) range of every line in
+    `hlines` and the (y_start, y_end) range of every line in `vlines`.
+    Horizontal lines go from the first to the last vertical line.
+    Vertical lines go from the top to the bottom line of their table.
+
+    """
+    h_expected = 1 + max([box[1] for box in dimensions])
+    hends = [(g.intersection(line, vlines[0])[0],
+              g.intersection(line, vlines[-1])[0]) for line in hlines]
+    table_hlines = hlines[-h_expected:]
+    vends = []
+    for width, height in dimensions:
+        for j in range(len(vends), len(vends) + width + 1):
+            vends.append((g.intersection(table_hlines[0], vlines[j])[1],
+                          g.intersection(table_hlines[height], vlines[j])[1]))
+    return hends, vends
+
+def track_lines(image, lines, extents, horizontal,
+                rho_var=param_tracking_rho_var):
+    """Follows lines detected in a previous frame.
+
+    Every line is moved to the nearby line, within `rho_var` pixels
+    and `param_tracking_theta_var`
+    radians, with more ink pixels along its extent (see
+    `lines_extents`). Pixels are sampled every
+    `param_tracking_step` pixels. Returns the new lines, or None if
+    the ratio of ink pixels of some line is below
+    `param_tracking_min_ink`.
+
+    """
+    iwidth = images.width(image)
+    iheight = images.height(image)
+    rho_offsets = np.arange(-rho_var, rho_var + 1, dtype=float)
+    theta_offsets = np.array([0.0, -param_tracking_theta_var,
+                              param_tracking_theta_var])
+    drhos = np.tile(rho_offsets, len(theta_offsets))
+    dthetas = np.repeat(theta_offsets, len(rho_offsets))
+    tracked = []
+    for (rho, theta), (start, end) in zip(lines, extents):
+        # One row per candidate line, one column per sampled pixel
+        coords = np.arange(min(start, end), max(start, end) + 1,
+                           param_tracking_step)
+        rhos = (rho + drhos)[:, np.newaxis]
+        thetas = (theta + dthetas)[:, np.newaxis]
+        if horizontal:
+            xs = np.tile(coords, (len(drhos), 1))
+            ys = np.rint((rhos - xs * np.cos(thetas)) / np.sin(thetas))
+        else:
+            ys = np.tile(coords, (len(drhos), 1))
+            xs = np.rint((rhos - ys * np.sin(thetas)) / np.cos(thetas))
+        xs = xs.astype(int)
+        ys = ys.astype(int)
+        inside = (xs >= 0) & (xs < iwidth) & (ys >= 0) & (ys < iheight)
+        ink = np.zeros(xs.shape, dtype=bool)
+        ink[inside] = image[ys[inside], xs[inside]] > 0
+        scores = ink.sum(axis=1)
+        best = scores.max()
+        if best < param_tracking_min_ink * len(coords):
+            return None
+        # The center of the best candidates with the best angle,
+        # because lines in the image are several pixels thick
+        best_theta = dthetas[np.argmax(scores)]
+        selected = (scores == best) & (dthetas == best_theta)
+        tracked.append((rho + float(drhos[selected].mean()),
+                        theta + float(best_theta)))
+    return tracked
+
 def check_corners(corner_matrixes, width, height):
+    """Checks that the corner matrixes of the tables are coherent."""
     # Check differences between horizontal lines:
     corners = corner_matrixes[(len(corner_matrixes) - 1) // 2]
-    ypoints = [row[-1][1] for row in corners]
-    difs = []
-    difs2 = []
-    for i in range(1, len(ypoints)):
-        difs.append(ypoints[i] - ypoints[i - 1])
-    for i in range(1, len(difs)):
-        difs2.append(difs[i] - difs[i - 1])
-    max_difs2 = 1 + float(max(difs) - min(difs)) / len(difs) \
+    difs = np.diff(corners[:, -1, 1])
+    difs2 = np.diff(difs)
+    max_difs2 = 1 + float(difs.max() - difs.min()) / len(difs) \
         * param_check_corners_tolerance_mul
-    if max(difs2) > max_difs2:
-#        print "Failure in differences"
-#        print difs
-#        print difs2
+    if len(difs2) and difs2.max() > max_difs2:
         return False
-    if 0.5 * max(difs) > min(difs):
+    if 0.5 * difs.max() > difs.min():
         return False
-    # Check that no points are negative
-    for corners in corner_matrixes:
-        for row in corners:
-            for point in row:
-                if point[0] < 0 or point[0] >= width \
-                        or point[1] < 0 or point[1] >= height:
-#                    print "Failure at point", point
-                    return False
-
-    # Check that the sequence of points is coherent
     for corners in corner_matrixes:
-        for i in range(0, len(corners) - 1):
-            for j in range(0, len(corners[0]) - 1):
-                if corners[i][j][1] >= corners[i + 1][j][1] or \
-                        corners[i][j + 1][1] >= corners[i + 1][j + 1][1] or \
-                        corners[i][j][0] >= corners[i][j + 1][0] or \
-                        corners[i + 1][j][0] >= corners[i + 1][j + 1][0]:
-                    return False
-
-    # Success if control reaches here
+        # Check that no points are out of the image
+        xs = corners[:, :, 0]
+        ys = corners[:, :, 1]
+        if (xs.min() < 0 or xs.max() >= width
+            or ys.min() < 0 or ys.max() >= height):
+            return False
+        # Check that the sequence of points is coherent
+        if (ys[:-1, :] >= ys[1:, :]).any() or (xs[:, :-1] >= xs[:, 1:]).any():
+            return False
     return True
 
 def read_infobits(image, corner_matrixes):
-    mask = images.new_image(images.width(image), images.height(image), 1)
     bits = []
     for corners in corner_matrixes:
+        # Python integers are faster than NumPy scalars for single points
+        corners = np.asarray(corners).tolist()
         for i in range(1, len(corners[0])):
             dx = g.diff_points(corners[-1][i - 1], corners[-1][i])
             dy = g.diff_points(corners[-1][i], corners[-2][i])
@@ -815,33 +2382,47 @@ def read_infobits(image, corner_matrixes):
                                     + dx[0] / 2 + dy[0] / 2.6,
                                     corners[-1][i][1]
                                     + dx[1] / 2 + dy[1] / 2.6))
-            bits.append(decide_infobit(image, mask, center, dy))
+            bits.append(decide_infobit(image, center, dy))
     # Check validity
     if min([b[0] ^ b[1] for b in bits]) == True:
         return [b[0] for b in bits]
     else:
         return None
 
-def decide_infobit(image, mask, center_up, dy):
+def decide_infobit(image, center_up, dy):
     center_down = g.add_points(center_up, dy)
     radius = int(round(math.sqrt(dy[0] * dy[0] + dy[1] * dy[1]) \
                            * param_bit_mask_radius_multiplier))
     if radius == 0:
         radius = 1
-    images.zero_image(mask)
-    cv2.circle(mask, center_up, radius, (1), thickness=-1)
-    mask_pixels = cv2.countNonZero(mask)
-    masked = cv2.multiply(image, mask)
-    masked_pixels_up = cv2.countNonZero(masked)
-    images.zero_image(mask)
-    cv2.circle(mask, center_down, radius, (1), thickness=-1)
-    masked = cv2.multiply(image, mask)
-    masked_pixels_down = cv2.countNonZero(masked)
+    mask_pixels, masked_pixels_up = count_circle_pixels(image, center_up,
+                                                        radius)
+    masked_pixels_down = count_circle_pixels(image, center_down, radius)[1]
     if mask_pixels < 1:
         return (False, False)
     return (float(masked_pixels_up) / mask_pixels >= param_bit_mask_threshold,
             float(masked_pixels_down) / mask_pixels >= param_bit_mask_threshold)
 
+def count_circle_pixels(image, center, radius):
+    """Counts the pixels of a filled circle and the non-zero ones in it.
+
+    Returns a tuple (circle pixels, non-zero pixels). Only a small
+    window around the circle is processed. The circle is clipped to
+    the image, exactly as if it were drawn on a full-frame mask.
+
+    """
+    x0 = max(0, center[0] - radius - 1)
+    y0 = max(0, center[1] - radius - 1)
+    x1 = min(images.width(image), center[0] + radius + 2)
+    y1 = min(images.height(image), center[1] + radius + 2)
+    if x0 >= x1 or y0 >= y1:
+        return 0, 0
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.circle(mask, (center[0] - x0, center[1] - y0), radius, (1),
+               thickness=-1)
+    masked = cv2.multiply(image[y0:y1, x0:x1], mask)
+    return cv2.countNonZero(mask), cv2.countNonZero(masked)
+
 def decide_answer(cell_decisions):
     marked = [i for i in range(0, len(cell_decisions)) if cell_decisions[i]]
     if len(marked) == 1:
@@ -949,24 +2530,29 @@ def id_boxes_adjust_points(image, p_up, p_down, line_up, line_down,
                            x_var, iwidth):
     points_up = []
     points_down = []
+    iheight = images.height(image)
     for x in range(p_up[0] - x_var, p_up[0] + x_var + 1):
         p = g.line_point(line_up, x=x)
-        if p[0] >= 0 and p[0] < iwidth and p[1] >= 0:
+        if p[0] >= 0 and p[0] < iwidth and p[1] >= 0 and p[1] < iheight:
             points_up.append(p)
     for x in range(p_down[0] - x_var, p_down[0] + x_var + 1):
         p = g.line_point(line_down, x=x)
-        if p[0] >= 0 and p[0] < iwidth and p[1] >= 0:
+        if p[0] >= 0 and p[0] < iwidth and p[1] >= 0 and p[1] < iheight:
             points_down.append(p)
     pairs = [(u, v) for u in points_up for v in points_down]
     energies = []
     best = None
-    for u, v in pairs:
-        energy = id_boxes_match_level(image, u, v)
-        if energy > param_id_boxes_energy_break:
-            best = ((u, v), energy)
-            break
+    if pairs:
+        # The match level of all the pairs is computed at once
+        levels = id_boxes_match_levels(image, [u for u, v in pairs],
+                                       [v for u, v in pairs])
+        breaks = np.flatnonzero(levels > param_id_boxes_energy_break)
+        if len(breaks) > 0:
+            u, v = pairs[breaks[0]]
+            best = ((u, v), float(levels[breaks[0]]))
         else:
-            energies.append((energy, u, v))
+            energies = [(energy, u, v) \
+                        for energy, (u, v) in zip(levels.tolist(), pairs)]
     if best is not None:
         return best
     else:
@@ -990,33 +2576,50 @@ def id_boxes_adjust_points(image, p_up, p_down, line_up, line_down,
 
 def id_boxes_adjust_point_vertically(image, point, line, interval, iwidth):
     rho, theta = line
-    lines = [line]
+    offsets = [0]
     for i in range(interval[0], interval[1] + 1):
-        lines.append((rho + i, theta))
-        lines.append((rho - i, theta))
-    values = []
-    for l in lines:
-        match = 0
-        for xx in range(point[0] - 2, point[0] + 3):
-            x, y = g.line_point(l, x=xx)
-            if y >= 0 and x >= 0 and x < iwidth and image[y, x] > 0:
-                match += 1
-        p = g.line_point(l, x=point[0])
-        values.append((match, p[1], p))
+        offsets.append(i)
+        offsets.append(-i)
+    # Points of every candidate line at x in [point[0] - 2, point[0] + 2],
+    # computed as in g.line_point
+    rhos = rho + np.array(offsets, dtype=float)
+    xs = np.tile(np.arange(point[0] - 2, point[0] + 3), (len(offsets), 1))
+    ys = np.trunc((rhos[:, np.newaxis] - xs * math.cos(theta))
+                  / math.sin(theta)).astype(int)
+    valid = (ys >= 0) & (xs >= 0) & (xs < iwidth)
+    ink = np.zeros(ys.shape, dtype=bool)
+    ink[valid] = image[ys[valid], xs[valid]] > 0
+    matches = ink.sum(axis=1).tolist()
+    x = int(point[0])
+    values = [(match, y, (x, y)) \
+              for match, y in zip(matches, ys[:, 2].tolist())]
     values.sort(reverse = True)
     best = [(m, ppp) for (m, yyy, ppp) in values if m == values[0][0]]
     return best[len(best) // 2][1]
 
 def id_boxes_match_level(image, p0, p1):
-    points = [(x, y) for (x, y) in g.walk_line(p0, p1)]
-    active = len([(x, y) for (x, y) in points if image[y, x] > 0])
-    return float(active) / len(points)
+    xs, ys = g.line_pixels(p0, p1)
+    return np.count_nonzero(image[ys, xs]) / len(xs)
+
+def id_boxes_match_levels(image, points0, points1):
+    """Computes id_boxes_match_level for many segments at once.
+
+    Returns a NumPy array with the level of each segment.
+
+    """
+    xs, ys, segments = g.walk_lines(points0, points1)
+    active = np.bincount(segments, weights=(image[ys, xs] > 0))
+    return active / np.bincount(segments)
 
 def save_image(filename, image):
     cv2.imwrite(filename, image)
 
 # Utility functions
 #
+def _point(point):
+    """Returns a point of a corner matrix as a tuple of integers."""
+    return (int(point[0]), int(point[1]))
+
 def line_bounds_adaptive(image, line_up, line_down, iwidth, rho_var):
     points_left_up, points_right_up = \
         line_bounds_one_line(image, line_up, iwidth, rho_var)
@@ -1065,32 +2668,20 @@ def line_bounds(image, line, iwidth):
     if (not g.point_is_valid(p0, image_dimensions)
         or not g.point_is_valid(p1, image_dimensions)):
         return None, None
-    # get bounds
-    ini_found = False
-    ini = None
-    end = None
-    last = 0
-    count = 0
-    for x, y in g.walk_line(p0, p1):
-        value = 1 if image[y, x] > 0 else 0
-        if value == last:
-            count += 1
-        else:
-            last = value
-            count = 1
-        if not ini_found:
-            if last == 1:
-                if count == 1:
-                    ini = (x, y)
-                elif count == 3:
-                    ini_found = True
-        else:
-            if last == 1 and count > 2:
-                end = (x, y)
-    if ini is None or end is None:
-        ini = None
-        end = None
-    return ini, end
+    # get bounds: the first point of the first run of at least 3 ink
+    # pixels, and the last point after it that belongs to such a run
+    xs, ys = g.line_pixels(p0, p1)
+    ink = image[ys, xs] > 0
+    positions = np.arange(len(ink))
+    changes = np.ones(len(ink), dtype=bool)
+    changes[1:] = ink[1:] != ink[:-1]
+    run_starts = np.maximum.accumulate(np.where(changes, positions, 0))
+    in_long_run = np.flatnonzero(ink & (positions - run_starts >= 2))
+    if len(in_long_run) < 2:
+        return None, None
+    ini = run_starts[in_long_run[0]]
+    end = in_long_run[-1]
+    return (int(xs[ini]), int(ys[ini])), (int(xs[end]), int(ys[end]))
 
 def process_box_corners(points, dimensions):
     num_boxes = len(dimensions)
@@ -1127,7 +2718,8 @@ def process_box_corners(points, dimensions):
                                         group2[2 * i], group2[2 * i + 1])))
     corners = []
     for box_dims, box_corners in zip(dimensions, boxes):
-        corners.append(construct_box(box_corners, box_dims[0], box_dims[1]))
+        corners.append(np.array(construct_box(box_corners, box_dims[0],
+                                              box_dims[1])))
     return corners
 
 def construct_box(outer_corners, num_columns, num_rows):
@@ -0,0 +1,226 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+#
+# Replays the raw captures of one or more sessions through ExamDetector
+# and compares the results with the answers and student ids stored in
+# the sessions, which have already been reviewed by the user.
+#
+from __future__ import print_function, division
+
+from optparse import OptionParser
+import json
+import time
+import logging
+import collections
+
+from .. import sessiondb
+from .. import detection
+from .. import images
+from .. import utils
+from .. import batch
+
+
+class Accuracy(object):
+    """Counts hits over a number of trials."""
+
+    def __init__(self):
+        self.hits = 0
+        self.total = 0
+
+    def add(self, hit):
+        self.total += 1
+        if hit:
+            self.hits += 1
+
+    @property
+    def ratio(self):
+        if self.total:
+            return self.hits / self.total
+        else:
+            return None
+
+    def __str__(self):
+        if self.total:
+            return '{0} of {1} ({2:.2%})'.format(self.hits, self.total,
+                                                 self.ratio)
+        else:
+            return 'none'
+
+
+class DetectionBenchmark(object):
+    """Accumulates the speed and accuracy of detection over many captures.
+
+    `overrides` is a dictionary of detector options that replace the
+    ones batch grading would use. Every capture is detected `repeat`
+    times; accuracy is computed just from the first one.
+
+    """
+    def __init__(self, overrides=None, repeat=1):
+        self.overrides = overrides if overrides is not None else {}
+        self.repeat = repeat
+        self.context = detection.ExamDetectorContext()
+        self.elapsed_time = 0.0
+        self.num_captures = 0
+        self.detected = Accuracy()
+        self.models = Accuracy()
+        self.questions = Accuracy()
+        self.cells = Accuracy()
+        self.digits = Accuracy()
+        self.ids = Accuracy()
+
+    @property
+    def frames_per_second(self):
+        if self.elapsed_time:
+            return self.repeat * self.num_captures / self.elapsed_time
+        else:
+            return 0.0
+
+    def process_session(self, session_path):
+        not_found = utils.resource_path('not_found.png')
+        session = sessiondb.SessionDB(session_path)
+        options = batch.detector_options(session.exam_config)
+        options.update(self.overrides)
+        options['timing'] = True
+        dimensions = session.exam_config.dimensions
+        for exam in session.exams_iterator():
+            image_file = session.get_raw_capture_path(exam['exam_id'])
+            if image_file == not_found:
+                continue
+            image = images.load_image(image_file)
+            self.num_captures += 1
+            for i in range(0, self.repeat):
+                start_time = time.time()
+                detector = batch.detect_image(image, dimensions,
+                                              self.context, options)
+                self.elapsed_time += time.time() - start_time
+                if i == 0:
+                    self._compare(detector, exam, session.num_choices,
+                                  options['read-id'])
+        session.close()
+
+    def summary(self):
+        data = collections.OrderedDict()
+        data['captures'] = self.num_captures
+        data['frames-per-second'] = self.frames_per_second
+        for key in ('detected', 'models', 'questions', 'cells',
+                    'digits', 'ids'):
+            data[key] = getattr(self, key).ratio
+        data['stages'] = self.context.timing_stats.summary()
+        return data
+
+    def report(self):
+        print('Captures: {0}, {1:.2f} frames/s'\
+              .format(self.num_captures, self.frames_per_second))
+        print('Detected: {0}'.format(self.detected))
+        print('Models:   {0}'.format(self.models))
+        print('Answers:  {0}'.format(self.questions))
+        print('Cells:    {0}'.format(self.cells))
+        print('Digits:   {0}'.format(self.digits))
+        print('Ids:      {0}'.format(self.ids))
+        print(self.context.timing_stats)
+
+    def _compare(self, detector, exam, num_choices, read_id):
+        self.detected.add(detector.success)
+        if not detector.success:
+            return
+        decisions = detector.decisions
+        if exam['model'] is not None:
+            self.models.add(decisions.model == exam['model'])
+        for choices, truth, answer in zip(num_choices, exam['answers'],
+                                          decisions.answers):
+            self.questions.add(answer == truth)
+            for choice in range(1, choices + 1):
+                self.cells.add((answer == choice) == (truth == choice))
+        student_id = exam['student_id']
+        if read_id and student_id:
+            detected_id = decisions.detected_id
+            if detected_id is None or len(detected_id) != len(student_id):
+                detected_id = ' ' * len(student_id)
+            for digit, truth in zip(detected_id, student_id):
+                self.digits.add(digit == truth)
+            self.ids.add(detected_id == student_id)
+
+
+def parse_overrides(values):
+    """Parses the name=value detector options of the command line."""
+    defaults = detection.ExamDetector.get_default_options()
+    overrides = {}
+    for value in values:
+        name, _, setting = value.partition('=')
+        if (not defaults.get(name) in (True, False)
+            or not setting in ('yes', 'no')):
+            raise ValueError('Bad detector option: ' + value)
+        overrides[name] = (setting == 'yes')
+    return overrides
+
+def read_cmd_options():
+    parser = OptionParser(usage='usage: %prog [options] <session_dir> [...]')
+    parser.add_option('-o', '--option', dest='overrides', action='append',
+                      default=[],
+                      help='set a detector option, e.g. pyramid=yes '
+                           '(can be repeated)')
+    parser.add_option('-e', '--engine', dest='engines', action='append',
+                      default=[], choices=detection.detection_engines,
+                      help='detection engine to benchmark: '
+                           + ', '.join(detection.detection_engines)
+                           + ' (can be repeated for comparing them)')
+    parser.add_option('-r', '--repeat', type='int', dest='repeat',
+                      default=1,
+                      help='number of times every capture is detected')
+    parser.add_option('-j', '--json', dest='json_file', default=None,
+                      help='save the results as JSON in this file')
+    (options, args) = parser.parse_args()
+    if len(args) < 1:
+        parser.error('Required parameters expected')
+    try:
+        options.overrides = parse_overrides(options.overrides)
+    except ValueError as ex:
+        parser.error(str(ex))
+    return options, args
+
+def run_benchmark(session_paths, overrides, repeat):
+    benchmark = DetectionBenchmark(overrides=overrides, repeat=repeat)
+    for session_path in session_paths:
+        logging.info('Processing session {}'.format(session_path))
+        benchmark.process_session(utils.path_to_unicode(session_path))
+    return benchmark
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    options, args = read_cmd_options()
+    if not options.engines:
+        benchmark = run_benchmark(args, options.overrides, options.repeat)
+        benchmark.report()
+        summary = benchmark.summary()
+    else:
+        # The same captures are detected with every engine
+        summary = collections.OrderedDict()
+        for engine in options.engines:
+            overrides = dict(options.overrides, engine=engine)
+            benchmark = run_benchmark(args, overrides, options.repeat)
+            print('Engine: {0}'.format(engine))
+            benchmark.report()
+            print()
+            summary[engine] = benchmark.summary()
+    if options.json_file is not None:
+        with open(options.json_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    main()
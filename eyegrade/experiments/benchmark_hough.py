@@ -0,0 +1,126 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+#
+# Compares the full-range Hough transform with the angle-restricted one
+# on the raw captures of one or more sessions.
+#
+from __future__ import print_function, division
+
+import sys
+import math
+import time
+import logging
+
+import numpy as np
+
+from .. import sessiondb
+from .. import detection
+from .. import images
+from .. import utils
+
+
+class LineDetectionMode(object):
+    """Accumulates the time and detection rate of a line detection mode."""
+
+    def __init__(self, name, angle_windows):
+        self.name = name
+        self.angle_windows = angle_windows
+        self.elapsed_time = 0.0
+        self.num_captures = 0
+        self.num_detected = 0
+
+    def detect(self, image_proc, dimensions):
+        """Tries the Hough thresholds until the cells are found.
+
+        Returns the corner matrices, or None if the cells are not found.
+
+        """
+        self.num_captures += 1
+        corner_matrixes = None
+        start_time = time.time()
+        for threshold in detection.param_hough_thresholds:
+            lines = detection.detect_lines(image_proc, threshold,
+                                           angle_windows=self.angle_windows)
+            corner_matrixes = _cell_corners(image_proc, lines, dimensions)
+            if corner_matrixes:
+                self.num_detected += 1
+                break
+        self.elapsed_time += time.time() - start_time
+        return corner_matrixes
+
+    def report(self):
+        print('{0:>8}: {1} of {2} captures detected, {3:.1f} ms/capture'\
+              .format(self.name, self.num_detected, self.num_captures,
+                      1000 * self.elapsed_time / max(1, self.num_captures)))
+
+
+def _cell_corners(image_proc, lines, dimensions):
+    if len(lines) < 2:
+        return None
+    axes = detection.detect_boxes(lines, dimensions)
+    if axes is None:
+        return None
+    axes = detection.filter_axes(axes, dimensions,
+                                 images.width(image_proc),
+                                 images.height(image_proc), False)
+    return detection.cell_corners(axes[1][1], axes[0][1],
+                                  images.width(image_proc),
+                                  images.height(image_proc), dimensions)
+
+def _same_corners(corner_matrixes1, corner_matrixes2):
+    if not corner_matrixes1 or not corner_matrixes2:
+        return not corner_matrixes1 and not corner_matrixes2
+    return (len(corner_matrixes1) == len(corner_matrixes2)
+            and all(np.array_equal(corners1, corners2) \
+                    for corners1, corners2 \
+                    in zip(corner_matrixes1, corner_matrixes2)))
+
+def process_session(modes, session_path):
+    not_found = utils.resource_path('not_found.png')
+    session = sessiondb.SessionDB(session_path)
+    dimensions = session.exam_config.dimensions
+    differences = 0
+    for exam in session.exams_iterator():
+        image_file = session.get_raw_capture_path(exam['exam_id'])
+        if image_file == not_found:
+            continue
+        image_proc = detection.pre_process(images.load_image(image_file))
+        results = [mode.detect(image_proc, dimensions) for mode in modes]
+        if any(not _same_corners(result, results[0]) \
+               for result in results[1:]):
+            differences += 1
+    session.close()
+    return differences
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    windows = detection.angle_windows(math.pi / 2,
+                                      detection.param_angle_window)
+    modes = [LineDetectionMode('full', None),
+             LineDetectionMode('windows', windows)]
+    differences = 0
+    for session_path in sys.argv[1:]:
+        logging.info('Processing session {}'.format(session_path))
+        differences += process_session(modes, session_path)
+    for mode in modes:
+        mode.report()
+    print('Captures with different cell corners: {0}'.format(differences))
+
+if __name__ == '__main__':
+    main()
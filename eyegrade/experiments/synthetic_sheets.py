@@ -0,0 +1,482 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+#
+# Generates synthetic captures of answer sheets with known answers,
+# model and student id, stored as a session that the detection
+# benchmark can replay.
+#
+from __future__ import print_function, division
+
+from optparse import OptionParser
+import os
+import json
+import logging
+
+import numpy as np
+import cv2
+
+from .. import exammaker
+from .. import sessiondb
+from .. import capture
+from .. import utils
+from ..ocr import sample
+
+# Size of the cells in the flat sheet, in pixels
+param_cell_width = 40
+param_cell_height = 32
+param_line_width = 2
+
+# Paper around the tables, in cells. Captures are framed so that the
+# edges of the paper usually fall outside them, as in the camera
+param_margin = 8
+
+# Probability of a question being left blank
+param_blank_probability = 0.15
+
+# Part of a sample image, at every side, that is discarded because
+# it may contain the borders of the cell
+param_sample_margin = 0.15
+
+# Ranges of the random distortions of the captures. The tables and
+# ID box take `param_frame_fill` of the width or height of the frame
+param_frame_fill = (0.7, 0.9)
+param_max_rotation = 0.08
+param_max_skew = 0.04
+param_max_blur = 1.2
+param_max_noise = 1.5
+param_noise_grain = 1.0
+param_max_lighting = 0.35
+param_brightness = (0.7, 1.0)
+
+# Texture of the paper and desk: ratio of the pixels that are darker
+# fibres, and range of their darkness
+param_fibre_density = (0.03, 0.05)
+param_fibre_darkness = (80, 120)
+
+
+class SheetLayout(object):
+    """Geometry of a flat answer sheet.
+
+    The tables follow the layout `exammaker.create_answer_table`
+    produces: every table is preceded by the column of question numbers
+    and followed by the two rows of infobits, and the ID box is above
+    the tables.
+
+    """
+    def __init__(self, dimensions, id_num_digits=0):
+        self.dimensions = dimensions
+        self.id_num_digits = id_num_digits
+        self.num_choices = dimensions[0][0]
+        self.rows, question_numbers = exammaker.table_geometry(dimensions)
+        cw, ch = param_cell_width, param_cell_height
+        self.top = param_margin * ch + (3.5 * ch if id_num_digits else ch)
+        self.table_x = [param_margin * cw
+                        + (j * (self.num_choices + 1) + 1) * cw \
+                        for j in range(len(dimensions))]
+        self.width = int(2 * param_margin * cw
+                         + len(dimensions) * (self.num_choices + 1) * cw)
+        self.height = int(self.top + len(self.rows) * ch + param_margin * ch)
+        # Bounding box (x0, y0, x1, y1) of the tables and the ID box
+        self.content = (param_margin * cw, self.top - (3 * ch if id_num_digits
+                                                       else ch),
+                        self.width - param_margin * cw,
+                        self.top + len(self.rows) * ch)
+        # Upper-left corner of every cell, by question and choice
+        self.cells = []
+        for j, (num_choices, num_rows) in enumerate(dimensions):
+            for i in range(num_rows):
+                self.cells.append([(self.table_x[j] + k * cw,
+                                    self.top + i * ch) \
+                                   for k in range(num_choices)])
+        self.question_numbers = [n + i \
+                                 for n, (c, rows) in zip(question_numbers,
+                                                         dimensions) \
+                                 for i in range(rows)]
+        # ID box cells are a bit bigger, as in create_id_box
+        self.id_cell_width = 1.1 * cw
+        self.id_cell_height = 1.2 * ch
+        id_x = (self.width - id_num_digits * self.id_cell_width) / 2
+        self.id_cells = [(id_x + k * self.id_cell_width, self.top - 2.6 * ch) \
+                         for k in range(id_num_digits)]
+
+    def cell_corners(self, x, y, width=param_cell_width,
+                     height=param_cell_height):
+        """Returns the (plu, pru, pld, prd) corners of a cell."""
+        return [(x, y), (x + width, y), (x, y + height),
+                (x + width, y + height)]
+
+    def infobit_squares(self, model):
+        """Returns the centers of the black squares that encode the model.
+
+        As in `exammaker._create_infobits`, the square is in the first
+        row below the table for the bits that are set, and in the
+        second row for the others.
+
+        """
+        num_tables = len(self.dimensions)
+        if model != '0':
+            bits = utils.encode_model(model, num_tables, self.num_choices)
+        else:
+            bits = [False] * num_tables * self.num_choices
+        centers = []
+        for j, (num_choices, num_rows) in enumerate(self.dimensions):
+            bottom = self.top + num_rows * param_cell_height
+            for k in range(num_choices):
+                row = 0 if bits[j * num_choices + k] else 1
+                centers.append((self.table_x[j] + (k + 0.5) * param_cell_width,
+                                bottom + (row + 0.45) * param_cell_height))
+        return centers
+
+
+class SyntheticSheet(object):
+    """A generated capture and its ground truth."""
+
+    def __init__(self, image, model, answers, student_id, answer_cells,
+                 id_cells):
+        self.image = image
+        self.model = model
+        self.answers = answers
+        self.student_id = student_id
+        self.answer_cells = answer_cells
+        self.id_cells = id_cells
+
+    def ground_truth(self):
+        return {
+            'model': self.model,
+            'answers': self.answers,
+            'student_id': self.student_id,
+            'answer_cells': [[cell.corners() for cell in cells] \
+                             for cells in self.answer_cells],
+            'id_cells': [cell.corners() for cell in self.id_cells],
+            }
+
+
+class SheetGenerator(object):
+    """Renders random answer sheets from a seed.
+
+    The crosses and digits are taken from the given OCR sample sets
+    when available, and drawn with lines and a Hershey font otherwise.
+    The same seed and arguments produce always the same sheets.
+
+    """
+    def __init__(self, layout, models, frame_size=(640, 480), seed=0,
+                 cross_samples=None, digit_samples=None):
+        self.layout = layout
+        self.models = models
+        self.frame_size = frame_size
+        self.random = np.random.RandomState(seed)
+        self.cross_samples = cross_samples
+        self.digit_samples = digit_samples
+
+    def generate(self):
+        layout = self.layout
+        model = self.models[self.random.randint(len(self.models))]
+        answers = []
+        for cells in layout.cells:
+            if self.random.rand() < param_blank_probability:
+                answers.append(0)
+            else:
+                answers.append(1 + self.random.randint(len(cells)))
+        student_id = ''.join(str(self.random.randint(10)) \
+                             for i in range(layout.id_num_digits))
+        flat = self._render(model, answers, student_id)
+        image, homography = self._distort(flat)
+        answer_cells = [[self._cell_geometry(homography,
+                                             layout.cell_corners(x, y)) \
+                         for x, y in cells] for cells in layout.cells]
+        id_cells = [self._cell_geometry(homography,
+                                        layout.cell_corners(x, y,
+                                                layout.id_cell_width,
+                                                layout.id_cell_height)) \
+                    for x, y in layout.id_cells]
+        return SyntheticSheet(image, model, answers, student_id or None,
+                              answer_cells, id_cells)
+
+    def _render(self, model, answers, student_id):
+        layout = self.layout
+        cw, ch = param_cell_width, param_cell_height
+        image = np.full((layout.height, layout.width), 255, dtype=np.uint8)
+        for j, (num_choices, num_rows) in enumerate(layout.dimensions):
+            x0 = int(layout.table_x[j])
+            x1 = int(x0 + num_choices * cw)
+            y0 = int(layout.top)
+            y1 = int(y0 + num_rows * ch)
+            for i in range(num_rows + 1):
+                y = int(y0 + i * ch)
+                cv2.line(image, (x0, y), (x1, y), 0, param_line_width)
+            for k in range(num_choices + 1):
+                x = int(x0 + k * cw)
+                cv2.line(image, (x, y0), (x, y1), 0, param_line_width)
+            for k in range(num_choices):
+                _put_text(image, chr(65 + k), x0 + (k + 0.5) * cw,
+                          y0 - 0.5 * ch, 0.5 * ch)
+        for number, cells in zip(layout.question_numbers, layout.cells):
+            x, y = cells[0]
+            _put_text(image, str(number), x - 0.5 * cw, y + 0.5 * ch,
+                      0.5 * ch)
+        side = 0.5 * ch
+        for x, y in layout.infobit_squares(model):
+            cv2.rectangle(image, _point(x - side / 2, y - side / 2),
+                          _point(x + side / 2, y + side / 2), 0, -1)
+        for answer, cells in zip(answers, layout.cells):
+            if answer > 0:
+                x, y = cells[answer - 1]
+                self._draw_cross(image, x, y, cw, ch)
+        if layout.id_num_digits:
+            self._draw_id_box(image, student_id)
+        return image
+
+    def _draw_id_box(self, image, student_id):
+        layout = self.layout
+        w, h = layout.id_cell_width, layout.id_cell_height
+        x0, y0 = layout.id_cells[0]
+        x1 = x0 + layout.id_num_digits * w
+        cv2.line(image, _point(x0, y0), _point(x1, y0), 0, param_line_width)
+        cv2.line(image, _point(x0, y0 + h), _point(x1, y0 + h), 0,
+                 param_line_width)
+        for x, y in layout.id_cells + [(x1, y0)]:
+            cv2.line(image, _point(x, y), _point(x, y + h), 0,
+                     param_line_width)
+        _put_text(image, 'ID:', x0 - 1.2 * w, y0 + h / 2, 0.6 * h)
+        for digit, (x, y) in zip(student_id, layout.id_cells):
+            if self.digit_samples and self.digit_samples.get(int(digit)):
+                self._paste_sample(image, self.digit_samples[int(digit)],
+                                   x, y, w, h)
+            else:
+                _put_text(image, digit,
+                          x + w / 2 + self.random.uniform(-0.1, 0.1) * w,
+                          y + h / 2 + self.random.uniform(-0.1, 0.1) * h,
+                          self.random.uniform(0.5, 0.7) * h,
+                          thickness=self.random.randint(1, 3))
+
+    def _draw_cross(self, image, x, y, width, height):
+        if self.cross_samples:
+            self._paste_sample(image, self.cross_samples, x, y, width, height)
+        else:
+            jitter = lambda: self.random.uniform(0.15, 0.3)
+            thickness = self.random.randint(2, 4)
+            cv2.line(image, _point(x + jitter() * width, y + jitter() * height),
+                     _point(x + (1 - jitter()) * width,
+                            y + (1 - jitter()) * height), 0, thickness)
+            cv2.line(image, _point(x + (1 - jitter()) * width,
+                                   y + jitter() * height),
+                     _point(x + jitter() * width,
+                            y + (1 - jitter()) * height), 0, thickness)
+
+    def _paste_sample(self, image, samples, x, y, width, height):
+        samp = samples[self.random.randint(len(samples))].crop()
+        ink = samp.image
+        my = int(param_sample_margin * ink.shape[0])
+        mx = int(param_sample_margin * ink.shape[1])
+        ink = ink[my:ink.shape[0] - my, mx:ink.shape[1] - mx]
+        size = (int(width * (1 - 2 * param_sample_margin)),
+                int(height * (1 - 2 * param_sample_margin)))
+        if ink.size == 0 or min(size) <= 0:
+            return
+        ink = cv2.resize(ink, size) > 127
+        x0 = int(x + param_sample_margin * width)
+        y0 = int(y + param_sample_margin * height)
+        region = image[y0:y0 + size[1], x0:x0 + size[0]]
+        region[ink[:region.shape[0], :region.shape[1]]] = 0
+
+    def _distort(self, flat):
+        """Places the sheet in the frame and degrades the capture.
+
+        Returns the capture and the homography from the flat sheet to it.
+
+        """
+        rnd = self.random
+        frame_width, frame_height = self.frame_size
+        height, width = flat.shape
+        x0, y0, x1, y1 = self.layout.content
+        fill = rnd.uniform(*param_frame_fill)
+        scale = fill * min(frame_width / (x1 - x0), frame_height / (y1 - y0))
+        angle = rnd.uniform(-param_max_rotation, param_max_rotation)
+        rotation = np.array([[np.cos(angle), -np.sin(angle)],
+                             [np.sin(angle), np.cos(angle)]])
+        src = np.array([(0, 0), (width, 0), (width, height), (0, height)],
+                       dtype=np.float32)
+        centered = (src - ((x0 + x1) / 2, (y0 + y1) / 2)) * scale
+        dst = np.dot(centered, rotation.T) + (frame_width / 2,
+                                              frame_height / 2)
+        dst += rnd.uniform(-param_max_skew, param_max_skew, (4, 2)) \
+               * (frame_width, frame_height)
+        homography = cv2.getPerspectiveTransform(src, dst.astype(np.float32))
+        background = int(rnd.uniform(40, 110))
+        image = cv2.warpPerspective(flat, homography,
+                                    (frame_width, frame_height),
+                                    flags=cv2.INTER_LINEAR,
+                                    borderValue=background)
+        # Lighting gradient in a random direction
+        direction = rnd.uniform(0, 2 * np.pi)
+        ys, xs = np.mgrid[0:frame_height, 0:frame_width]
+        ramp = (xs * np.cos(direction) + ys * np.sin(direction))
+        ramp = (ramp - ramp.min()) / max(1, ramp.max() - ramp.min())
+        lighting = (rnd.uniform(*param_brightness)
+                    * (1 - rnd.uniform(0, param_max_lighting) * ramp))
+        image = image * lighting
+        sigma = rnd.uniform(0, param_max_blur)
+        if sigma > 0.3:
+            image = cv2.GaussianBlur(image, (0, 0), sigma)
+        image = self._add_texture(image)
+        # Camera noise is correlated among neighbouring pixels
+        noise = cv2.GaussianBlur(rnd.normal(0, 1, image.shape), (0, 0),
+                                 param_noise_grain)
+        image += noise * rnd.uniform(0, param_max_noise) / noise.std()
+        image = np.clip(image, 0, 255).astype(np.uint8)
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR), homography
+
+    def _add_texture(self, image):
+        """Darkens random pixels, as the fibres of paper and desk do.
+
+        A flat surface would be as bright as its local mean, which the
+        adaptive threshold of detection takes as ink. With the fibres,
+        the local mean is below the rest of the surface.
+
+        """
+        rnd = self.random
+        fibres = rnd.rand(*image.shape) < rnd.uniform(*param_fibre_density)
+        image = image.astype(np.float64)
+        image[fibres] -= rnd.uniform(*param_fibre_darkness,
+                                     size=np.count_nonzero(fibres))
+        return image
+
+    def _cell_geometry(self, homography, corners):
+        points = cv2.perspectiveTransform(np.array([corners],
+                                                   dtype=np.float32),
+                                          homography)[0]
+        plu, pru, pld, prd = [_point(x, y) for x, y in points]
+        return capture.CellGeometry(plu, pru, pld, prd, None, None)
+
+
+def create_session(session_dir, layout, models, seed):
+    """Creates a session for the layout, with random solutions."""
+    exam_data = utils.ExamConfig()
+    exam_data.set_dimensions(';'.join('{0},{1}'.format(*d) \
+                                      for d in layout.dimensions))
+    exam_data.id_num_digits = layout.id_num_digits
+    rnd = np.random.RandomState(seed)
+    for model in models:
+        exam_data.set_solutions(model,
+                                [1 + rnd.randint(choices) \
+                                 for choices in exam_data.num_options])
+    sessiondb.create_session_directory(session_dir, exam_data, [])
+    return sessiondb.SessionDB(session_dir)
+
+def store_sheet(session, exam_id, sheet):
+    student = None
+    if sheet.student_id is not None:
+        student = session.students.get(sheet.student_id)
+        if student is None:
+            student = utils.Student(None, sheet.student_id,
+                                    'Student ' + sheet.student_id,
+                                    None, None, None, None, None)
+            session.store_new_student(student)
+    exam_capture = capture.ExamCapture(sheet.image, sheet.answer_cells,
+                                       sheet.id_cells)
+    decisions = capture.ExamDecisions(True, sheet.answers, None, None,
+                                      model=sheet.model)
+    decisions.set_student(student)
+    score = utils.Score(sheet.answers,
+                        session.exam_config.get_solutions(sheet.model), None)
+    session.store_exam(exam_id, exam_capture, decisions, score)
+
+def load_samples(filenames):
+    """Loads the samples of the index files, grouped by label."""
+    sample_set = sample.SampleSet()
+    for filename in filenames:
+        sample_set.load_from_loader(sample.SampleLoader(filename))
+    return sample_set.samples_dict
+
+def read_cmd_options():
+    parser = OptionParser(usage='usage: %prog [options] <session_dir>'
+                                ' <num_sheets>')
+    parser.add_option('-d', '--dimensions', dest='dimensions',
+                      default='4,10;4,10',
+                      help='dimensions of the answer tables '
+                           '(default: 4,10;4,10)')
+    parser.add_option('-i', '--id-digits', type='int', dest='id_num_digits',
+                      default=0, help='number of digits of the student id')
+    parser.add_option('-m', '--models', dest='models', default='A',
+                      help='letters of the exam models (default: A)')
+    parser.add_option('-s', '--seed', type='int', dest='seed', default=0,
+                      help='seed of the random generator')
+    parser.add_option('--frame-size', dest='frame_size', default='640x480',
+                      help='size of the captures (default: 640x480)')
+    parser.add_option('--cross-samples', dest='cross_samples',
+                      action='append', default=[],
+                      help='index file of cross samples (can be repeated)')
+    parser.add_option('--digit-samples', dest='digit_samples',
+                      action='append', default=[],
+                      help='index file of digit samples (can be repeated)')
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error('Required parameters expected')
+    try:
+        options.dimensions = utils.parse_dimensions(options.dimensions,
+                                                check_equal_num_choices=True)[0]
+        options.frame_size = tuple(int(n) \
+                                   for n in options.frame_size.split('x'))
+    except (ValueError, utils.EyegradeException):
+        parser.error('Bad dimensions or frame size')
+    return options, args
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    options, args = read_cmd_options()
+    session_dir = utils.path_to_unicode(args[0])
+    num_sheets = int(args[1])
+    layout = SheetLayout(options.dimensions, options.id_num_digits)
+    models = list(options.models)
+    cross_samples = None
+    digit_samples = None
+    if options.cross_samples:
+        cross_samples = load_samples(options.cross_samples)[1]
+    if options.digit_samples:
+        digit_samples = load_samples(options.digit_samples)
+    generator = SheetGenerator(layout, models, frame_size=options.frame_size,
+                               seed=options.seed,
+                               cross_samples=cross_samples,
+                               digit_samples=digit_samples)
+    session = create_session(session_dir, layout, models, options.seed)
+    ground_truth = {'seed': options.seed, 'sheets': {}}
+    for exam_id in range(1, num_sheets + 1):
+        sheet = generator.generate()
+        store_sheet(session, exam_id, sheet)
+        ground_truth['sheets'][exam_id] = sheet.ground_truth()
+    session.close()
+    with open(os.path.join(session_dir, 'ground-truth.json'), 'w') as f:
+        json.dump(ground_truth, f, indent=2)
+    logging.info('Generated {0} sheets in {1}'.format(num_sheets,
+                                                      session_dir))
+
+def _point(x, y):
+    return (int(round(x)), int(round(y)))
+
+def _put_text(image, text, x, y, height, thickness=1):
+    """Draws the text centered at (x, y), `height` pixels high."""
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    (text_width, text_height), _ = cv2.getTextSize(text, font, 1.0, thickness)
+    scale = height / text_height
+    cv2.putText(image, text,
+                _point(x - scale * text_width / 2, y + height / 2),
+                font, scale, 0, thickness)
+
+if __name__ == '__main__':
+    main()
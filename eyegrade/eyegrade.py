@@ -35,6 +35,7 @@ import gettext
 
 # Local imports
 from . import detection
+from . import images
 from . import utils
 from .qtgui import gui
 from . import sessiondb
@@ -91,12 +92,32 @@ def select_camera(options, config):
 
 
 class ImageDetectTask(object):
-    """Used for running image detection in another thread."""
-    def __init__(self, detector):
+    """Used for running image detection in another thread.
+
+    The capture is graded with `grade` in this thread as well, and the
+    exam, if any, is left at the `exam` attribute of the detector.
+    Unless the exam is ready to be locked, its status and answers are
+    drawn and the image is converted for display here too, and left
+    at the `display_image` attribute of the detector, which owns that
+    buffer of `display_buffers`.
+
+    """
+    def __init__(self, detector, display_buffers, grade):
         self.detector = detector
+        self.display_buffers = display_buffers
+        self.grade = grade
 
     def run(self):
-        self.detector.detect_safe()
+        detector = self.detector
+        detector.detect_safe()
+        if detector.capture is not None:
+            detector.exam = self.grade(detector)
+            if not detector.success or detector.exam is None:
+                detector.capture.draw_status()
+                if detector.exam is not None:
+                    detector.exam.draw_answers()
+                detector.display_image = \
+                    self.display_buffers.convert(detector.capture.image_drawn)
         self.detector = None
 
 
@@ -107,7 +128,7 @@ class ImageChangeTask(object):
         self.reference_image = reference_image
 
     def run(self):
-        self.detector.exam_detected()
+        self.detector.exam_detected(reference_image=self.reference_image)
         self.detector = None
 
 
@@ -204,8 +225,13 @@ class ProgramManager(object):
         self.sessiondb = None
         self.detection_context = self._get_detection_context()
         self.detection_options = None
+        # One buffer for every frame in flight, plus the displayed one
+        self.display_buffers = images.DisplayBufferPool(
+                                        self.config['pipeline-depth'] + 1)
+        self.displayed_buffer = None
         self.drop_next_capture = False
-        self.dump_buffer = False
+        self.search = detection.SearchPipeline(self.config['pipeline-depth'],
+                                               drop=self._drop_detection)
         self._register_listeners()
         self.from_manual_detection = False
         self.manual_detect_manager = None
@@ -218,11 +244,21 @@ class ProgramManager(object):
 
     def _get_detection_context(self):
         false_detector_session = os.getenv('EYEGRADE_CAMERA_SESSION')
-        if not false_detector_session:
-            return detection.ExamDetectorContext( \
-                                        camera_id=self.config['camera-dev'])
+        replay_path = os.getenv('EYEGRADE_CAMERA_REPLAY')
+        recording_file = os.getenv('EYEGRADE_CAMERA_RECORD')
+        if false_detector_session:
+            context = detection.FalseExamDetectorContext( \
+                                        false_detector_session)
+        elif replay_path:
+            paced = os.getenv('EYEGRADE_CAMERA_REPLAY_PACED', 'yes') != 'no'
+            context = detection.ReplayExamDetectorContext(replay_path,
+                                                          paced=paced)
         else:
-            return detection.FalseExamDetectorContext(false_detector_session)
+            context = detection.ExamDetectorContext( \
+                                        camera_id=self.config['camera-dev'])
+        if recording_file:
+            context.record_frames(recording_file)
+        return context
 
     def _try_session_file(self, session_file):
         if os.path.isdir(session_file):
@@ -248,9 +284,14 @@ class ProgramManager(object):
         self.latest_graded_exam = None
         self.latest_detector = None
         self.manual_detect_manager = None
-        self.interface.register_timer(50, self._next_search)
-        self.detection_context.dump_buffer(1.0)
-        self.next_capture = time.time() + 0.05
+        self.next_capture = time.time()
+        self._restart_search(0.05)
+
+    def _restart_search(self, delay):
+        """Drops the detections in flight and schedules a new capture."""
+        self.search.restart()
+        self.search_timer_pending = False
+        self._schedule_next_search(delay)
 
     def _start_review_mode(self):
         if self.mode.in_grading():
@@ -261,7 +302,7 @@ class ProgramManager(object):
             self.drop_next_capture = False
         self.mode.enter_review()
         self.interface.activate_review_mode(self.mode.in_review_from_grading())
-        self.interface.display_capture(self.exam.get_image_drawn())
+        self._display_capture(self.exam.get_image_drawn())
         self.interface.update_text_up(self.exam.get_student_id_and_name())
         if self.exam.score is not None:
             self.interface.update_status(self.exam.score,
@@ -283,58 +324,106 @@ class ProgramManager(object):
     def _start_manual_detect_mode(self):
         self.mode.enter_manual_detect()
         self.interface.activate_manual_detect_mode()
-        self.interface.display_capture(self.exam.get_image_drawn())
+        self._display_capture(self.exam.get_image_drawn())
         self.manual_detect_manager = \
             ManualDetectionManager(self.exam, self.exam_data.dimensions,
                                    self.detection_context,
                                    self.detection_options)
 
-    def _next_search(self):
-        if not self.mode.in_search():
+    def _next_search(self, generation):
+        """Captures an image and launches its detection.
+
+        Up to 'pipeline-depth' detections run at the same time in the
+        worker threads. Each one works on a snapshot of the detection
+        context, and its results and context changes are applied at
+        `_apply_search_result` in frame order (see `SearchPipeline`).
+
+        """
+        if (generation != self.search.generation
+            or not self.mode.in_search()):
             return
-        if self.dump_buffer:
-            self.dump_buffer = False
-            self.detection_context.dump_buffer(after_removal_delay)
+        self.search_timer_pending = False
         detector = detection.ExamDetector(self.exam_data.dimensions,
-                                          self.detection_context,
-                                          self.detection_options)
-        self.current_detector = detector
-        task = ImageDetectTask(detector)
-        self.interface.run_worker(task, self._after_image_detection)
+                            detection.ContextSnapshot(self.detection_context),
+                            self.detection_options)
+        key = self.search.start()
+        task = ImageDetectTask(detector, self.display_buffers,
+                               self._grade_capture)
+        self.interface.run_worker(task,
+                                  lambda: self._after_image_detection(
+                                      key, detector))
+        self._schedule_next_search(self._search_period())
 
-    def _after_image_detection(self):
-        detector = self.current_detector
-        self.current_detector = None
+    def _search_period(self):
+        """Returns the time between two captures in search mode.
+
+        Replayed recordings keep the time between their frames.
+
+        """
+        delay = self.detection_context.next_capture_delay()
+        if delay is None:
+            return capture_period
+        return delay
+
+    def _schedule_next_search(self, period):
+        if not self.search_timer_pending and not self.search.full():
+            self.search_timer_pending = True
+            generation = self.search.generation
+            self._schedule_next_capture(period,
+                                        lambda: self._next_search(generation))
+
+    def _after_image_detection(self, key, detector):
         if not self.mode.in_search():
             # The user switched to other mode while the image was processed
+            self._drop_detection(detector)
             return
+        # Detections of an older generation (e.g. an exam was locked
+        # from a newer frame) are dropped by the pipeline
+        ready = self.search.finish(key, detector)
+        for i, detector in enumerate(ready):
+            if not self._apply_search_result(detector):
+                for dropped in ready[i + 1:]:
+                    self._drop_detection(dropped)
+                return
+        self._schedule_next_search(self._search_period())
+
+    def _apply_search_result(self, detector):
+        """Shows the result of a detection in search mode.
+
+        Returns False when the search must not go on with the rest of
+        the frames in flight, which are then dropped.
+
+        """
+        detector.context.apply()
         self.latest_detector = detector
         if (detector.status['boxes']
             and self.detection_context.threshold_locked):
             self.detection_context.unlock_threshold()
-        exam = self._process_capture(detector)
+        exam = detector.exam
+        self._register_grading(detector, exam)
         if exam is None or not detector.success:
+            # The capture was drawn and converted by ImageDetectTask
             if exam is not None:
-                exam.draw_answers()
-                exam.draw_status()
                 self.interface.enable_manual_detect(False)
-            elif detector.capture is not None:
-                detector.capture.draw_status()
-            if detector.capture is not None:
-                self.interface.display_capture(detector.capture.image_drawn)
-            self._schedule_next_capture(capture_period, self._next_search)
+            if detector.display_image is not None:
+                self._display_converted(detector.display_image)
+                detector.display_image = None
+            return True
         elif not self.drop_next_capture:
             exam.draw_answers()
             self.exam = exam
+            self.search.restart()
             self._start_review_mode()
+            return False
         else:
             # Special mode: do not lock until another capture is
             # available.  Used after auto exam removal detection.
+            # The frames in flight were captured too early.
             exam.draw_answers()
-            self.interface.display_capture(detector.capture.image_drawn)
-            self._schedule_next_capture(after_removal_delay, self._next_search)
+            self._display_capture(detector.capture.image_drawn)
             self.drop_next_capture = False
-            self.dump_buffer = True
+            self._restart_search(after_removal_delay)
+            return False
 
     def _next_change_detection(self):
         """Used to detect exam removal.
@@ -346,12 +435,11 @@ class ProgramManager(object):
         if (not self.mode.in_review_from_grading()
             or not self.interface.is_action_checked(('tools', 'auto_change'))):
             return
-        self.detection_context.dump_buffer(1.0)
         detector = detection.ExamDetector(self.exam_data.dimensions,
                                           self.detection_context,
                                           self.detection_options)
         self.current_detector = detector
-        task = ImageChangeTask(detector, self.exam.capture)
+        task = ImageChangeTask(detector, self.exam.capture.image_raw)
         self.interface.run_worker(task, self._after_change_detection)
 
     def _after_change_detection(self):
@@ -396,8 +484,6 @@ class ProgramManager(object):
         current_time = time.time()
         self.next_capture += period
         if current_time > self.next_capture:
-            self.detection_context.dump_buffer((current_time
-                                                - self.next_capture))
             wait = 0.010
             self.next_capture = time.time() + 0.010
         else:
@@ -406,29 +492,67 @@ class ProgramManager(object):
 
     def _process_capture(self, detector):
         """Processes a captured image."""
+        exam = self._grade_capture(detector)
+        self._register_grading(detector, exam)
+        return exam
+
+    def _grade_capture(self, detector):
+        """Returns the exam of a capture, or None if it cannot be graded.
+
+        It has no side effects, because `ImageDetectTask` runs it in
+        the worker threads. See `_register_grading`.
+
+        """
         exam = None
         if detector.status['infobits']:
             model = detector.decisions.model
-            if model is not None:
-                if (model in self.exam_data.solutions
-                    or self.exam_data.survey_mode):
-                    if model in self.exam_data.scores:
-                        scores = self.exam_data.scores[model]
-                    else:
-                        scores = None
-                    exam = utils.Exam(detector.capture, detector.decisions,
-                                      self.exam_data.get_solutions(model),
-                                      self.sessiondb.students,
-                                      self.exam_id,
-                                      scores,
-                                      sessiondb=self.sessiondb)
-                    self.latest_graded_exam = exam
-                elif model not in self.exam_data.solutions:
-                    msg = _('There are no solutions for model {0}.')\
-                          .format(model)
-                    self.interface.show_error(msg)
+            if (model is not None
+                and (model in self.exam_data.solutions
+                     or self.exam_data.survey_mode)):
+                if model in self.exam_data.scores:
+                    scores = self.exam_data.scores[model]
+                else:
+                    scores = None
+                exam = utils.Exam(detector.capture, detector.decisions,
+                                  self.exam_data.get_solutions(model),
+                                  self.sessiondb.students,
+                                  self.exam_id,
+                                  scores,
+                                  sessiondb=self.sessiondb)
         return exam
 
+    def _register_grading(self, detector, exam):
+        if exam is not None:
+            self.latest_graded_exam = exam
+        elif (detector.status['infobits']
+              and detector.decisions.model is not None):
+            msg = _('There are no solutions for model {0}.')\
+                  .format(detector.decisions.model)
+            self.interface.show_error(msg)
+
+    def _display_capture(self, image):
+        self.interface.display_capture(image)
+        self._release_displayed_buffer()
+
+    def _display_converted(self, image):
+        """Displays an image converted by the display buffer pool.
+
+        Its buffer is given back to the pool when another image
+        replaces it, because the GUI displays it without a copy.
+
+        """
+        self.interface.display_capture(image, converted=True)
+        self._release_displayed_buffer()
+        self.displayed_buffer = image
+
+    def _release_displayed_buffer(self):
+        self.display_buffers.release(self.displayed_buffer)
+        self.displayed_buffer = None
+
+    def _drop_detection(self, detector):
+        self.display_buffers.release(detector.display_image)
+        detector.display_image = None
+
     def _new_session(self):
         """Callback for when the new session action is selected."""
         values = self.interface.dialog_new_session()
@@ -693,7 +817,7 @@ class ProgramManager(object):
         question, answer = self.exam.capture.get_cell_clicked(point)
         if question is not None:
             self.exam.toggle_answer(question, answer)
-            self.interface.display_capture(self.exam.get_image_drawn())
+            self._display_capture(self.exam.get_image_drawn())
             self.interface.update_status(self.exam.score,
                                         self.exam.decisions.model,
                                         self.exam.exam_id,
@@ -709,7 +833,7 @@ class ProgramManager(object):
         success = False
         manager.add_point(point)
         self.exam.draw_corner(point)
-        self.interface.display_capture(self.exam.get_image_drawn())
+        self._display_capture(self.exam.get_image_drawn())
         if manager.is_ready():
             success = manager.detect()
             if success:
@@ -755,6 +879,14 @@ class ProgramManager(object):
             self.detection_options['id-num-digits'] = exam_data.id_num_digits
         self.detection_options['left-to-right-numbering'] = \
                                             exam_data.left_to_right_numbering
+        self.detection_options['multi-threshold'] = \
+                                            self.config['multi-threshold']
+        self.detection_options['angle-windows'] = \
+                                            self.config['angle-windows']
+        self.detection_options['tracking'] = self.config['tracking']
+        self.detection_options['pyramid'] = self.config['pyramid']
+        self.detection_options['engine'] = self.config['engine']
+        self.detection_options['timing'] = 'timing-file' in self.config
         # Set the debug options in detection_options:
         self._action_debug_changed()
         self.detection_context.open_camera()
@@ -769,6 +901,9 @@ class ProgramManager(object):
     def _stop_grading(self):
         if self.mode.in_grading():
             self.detection_context.close_camera()
+            if 'timing-file' in self.config:
+                self.detection_context.timing_stats.save(
+                                                self.config['timing-file'])
         self._activate_session_mode()
 
     def _store_capture_and_add(self):
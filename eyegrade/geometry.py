@@ -18,6 +18,8 @@
 
 import math
 
+import numpy as np
+
 # Data representation:
 # - points: tuples (x, y)
 # - Lines: tuples (rho, theta) as returned by the Hough transform
@@ -158,6 +160,56 @@ def walk_line_ordered(p0, p1):
     else:
         return reversed([p for p in walk_line(p0, p1)])
 
+def walk_lines(points0, points1, ordered=False):
+    """Vectorized version of walk_line for many segments at once.
+
+       Segment i goes from points0[i] to points1[i]. Returns a tuple
+       (xs, ys, segments) of NumPy arrays: the coordinates of the
+       points of all the segments, concatenated, and the index of the
+       segment each point belongs to. The points of every segment are
+       exactly the ones walk_line returns, in the same order, or in
+       the order of walk_line_ordered if `ordered` is True."""
+    p0 = np.asarray(points0, dtype=int).reshape(-1, 2)
+    p1 = np.asarray(points1, dtype=int).reshape(-1, 2)
+    x0, y0 = p0[:, 0], p0[:, 1]
+    x1, y1 = p1[:, 0], p1[:, 1]
+    # Work along the main axis 'a', with the secondary axis 'b'
+    steep = np.abs(y1 - y0) > np.abs(x1 - x0)
+    a0 = np.where(steep, y0, x0)
+    b0 = np.where(steep, x0, y0)
+    a1 = np.where(steep, y1, x1)
+    b1 = np.where(steep, x1, y1)
+    reverse = a0 > a1
+    a0, a1 = np.where(reverse, a1, a0), np.where(reverse, a0, a1)
+    b0, b1 = np.where(reverse, b1, b0), np.where(reverse, b0, b1)
+    deltax = a1 - a0
+    deltay = np.abs(b1 - b0)
+    bstep = np.where(b0 < b1, 1, -1)
+    lengths = deltax + 1
+    segments = np.repeat(np.arange(len(p0)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    k = np.arange(lengths.sum()) - starts[segments]
+    dx = deltax[segments]
+    if ordered:
+        k = np.where(reverse[segments], dx - k, k)
+    # Closed form of the number of steps Bresenham's algorithm has
+    # taken in the secondary axis after k steps in the main axis,
+    # being its initial error dx / 2:
+    steps = (k * deltay[segments] - dx // 2 + dx - 1) // np.maximum(dx, 1)
+    steps[dx == 0] = 0
+    a = a0[segments] + k
+    b = b0[segments] + bstep[segments] * steps
+    steep = steep[segments]
+    return np.where(steep, b, a), np.where(steep, a, b), segments
+
+def line_pixels(p0, p1, ordered=False):
+    """Returns the points of walk_line as a tuple (xs, ys) of arrays.
+
+       The points go from p0 to p1 if `ordered` is True, as in
+       walk_line_ordered."""
+    xs, ys, segments = walk_lines([p0], [p1], ordered=ordered)
+    return xs, ys
+
 def interpolate_line(p0, p1, num_points):
     """Returns a list of num_points points in the line from p0 to p1.
 
@@ -214,6 +266,52 @@ def intersection(hline, vline):
     x = (rho2 - y * math.sin(theta2)) / math.cos(theta2)
     return round_point((x, y))
 
+def intersections(hlines, vlines):
+    """Returns the intersection points of every hline with every vline.
+
+    `hlines` and `vlines` are sequences of lines (rho, theta). The
+    result is an array of shape (len(hlines), len(vlines), 2) with the
+    points that `intersection` would return for every pair, already
+    rounded to integers.
+
+    """
+    hlines = np.asarray(hlines, dtype=np.float64).reshape(-1, 2)
+    vlines = np.asarray(vlines, dtype=np.float64).reshape(-1, 2)
+    rho1 = hlines[:, 0, np.newaxis]
+    theta1 = hlines[:, 1, np.newaxis]
+    rho2 = vlines[np.newaxis, :, 0]
+    theta2 = vlines[np.newaxis, :, 1]
+    y = (rho1 * np.cos(theta2) - rho2 * np.cos(theta1)) \
+        / np.sin(theta1 - theta2)
+    x = (rho2 - y * np.sin(theta2)) / np.cos(theta2)
+    return round_points(np.dstack((x, y)))
+
+def round_points(points):
+    """Rounds an array of coordinates to the nearest integers.
+
+    Halves are rounded away from zero, as `round_point` does.
+
+    """
+    points = np.asarray(points)
+    rounded = np.where(points >= 0, np.floor(points + 0.5),
+                       np.ceil(points - 0.5))
+    return rounded.astype(np.int64)
+
+def line_from_points(p0, p1):
+    """Returns the line (rho, theta) that contains two points.
+
+    Theta is in the range [0, pi), as in the lines of the Hough
+    transform.
+
+    """
+    theta = math.atan2(p1[0] - p0[0], p0[1] - p1[1])
+    if theta < 0:
+        theta += math.pi
+    elif theta >= math.pi:
+        theta -= math.pi
+    rho = p0[0] * math.cos(theta) + p0[1] * math.sin(theta)
+    return (rho, theta)
+
 def line_point(line, x = None, y = None):
     """Returns a point in the line with the given x or y coordinate.
        Either x or y must be None. Throws division by zero exception
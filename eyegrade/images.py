@@ -19,6 +19,9 @@
 from __future__ import division
 
 import math
+import os
+import glob
+import threading
 
 import cv2
 import numpy as np
@@ -56,8 +59,71 @@ def rgb_to_gray(image):
     return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
 
 
+class DisplayBufferPool(object):
+    """Reusable buffers for images already converted for display.
+
+    OpenCV images store their channels in BGR order, whereas the GUI
+    displays them in RGB order. `convert` swaps the channels into a
+    free buffer of the pool, which belongs to the caller until it is
+    given back with `release`. Up to `size` free buffers are kept for
+    reuse, so that no memory is allocated per frame while no more than
+    `size` converted images are in use at the same time.
+
+    """
+    def __init__(self, size=2):
+        self.size = size
+        self.free = []
+        self.lock = threading.Lock()
+
+    def convert(self, image):
+        buf = None
+        with self.lock:
+            for i, candidate in enumerate(self.free):
+                if candidate.shape == image.shape:
+                    buf = self.free.pop(i)
+                    break
+        if buf is None:
+            buf = np.empty(image.shape, np.uint8)
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, buf)
+        return buf
+
+    def release(self, buf):
+        """Gives back a buffer returned by `convert`. None is ignored."""
+        if buf is not None:
+            with self.lock:
+                self.free.append(buf)
+                if len(self.free) > self.size:
+                    del self.free[0]
+
+
 # Image reading and writing
 #
+image_extensions = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+def image_files(paths, extensions=image_extensions):
+    """Expands directories and glob patterns into a sorted file list.
+
+    Only the files with the given extensions are taken from directories.
+
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(os.path.join(path, name) \
+                                    for name in os.listdir(path) \
+                                    if _has_extension(name, extensions)))
+        elif os.path.isfile(path):
+            filenames.append(path)
+        else:
+            filenames.extend(sorted(glob.glob(path)))
+    return filenames
+
+def is_image_file(filename):
+    return _has_extension(filename, image_extensions)
+
+def _has_extension(filename, extensions):
+    return os.path.splitext(filename)[1].lower() in extensions
+
 def load_image_grayscale(filename):
     return cv2.imread(filename, flags=cv2.IMREAD_GRAYSCALE)
 
@@ -65,6 +131,13 @@ def load_image(filename):
     str_filename = utils.unicode_path_to_str(filename)
     return cv2.imread(str_filename)
 
+def encode_image(image, extension='.png'):
+    """Returns the image encoded in the given format, as a string."""
+    success, data = cv2.imencode(extension, image)
+    if not success:
+        raise ValueError('Cannot encode the image as {0}'.format(extension))
+    return data.tostring()
+
 
 # Drawing functions
 #
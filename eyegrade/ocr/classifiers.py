@@ -44,11 +44,9 @@ class SVMClassifier(object):
         return self.features_extractor.features_len
 
     def train(self, samples, params=None):
-        features = np.ndarray(shape=(len(samples), self.features_len),
-                              dtype='float32')
+        features = self._features_matrix(samples)
         labels = np.ndarray(shape=(len(samples), 1), dtype='float32')
         for i, sample in enumerate(samples):
-            features[i,:] = self.features_extractor.extract(sample)
             labels[i] = float(sample.label)
         svm_params = dict(kernel_type=cv2.SVM_RBF,
                           svm_type=cv2.SVM_C_SVC,
@@ -65,6 +63,17 @@ class SVMClassifier(object):
         features = self.features_extractor.extract(sample)
         return int(round(self.svm.predict(features)))
 
+    def classify_all(self, samples):
+        """Classifies a list of samples with just one call to the SVM.
+
+        Returns the list of labels, in the same order as the samples.
+
+        """
+        if len(samples) == 0:
+            return []
+        results = self.svm.predict_all(self._features_matrix(samples))
+        return [int(round(result)) for result in results.ravel()]
+
     def reset(self):
         self.svm = cv2.SVM()
 
@@ -75,6 +84,13 @@ class SVMClassifier(object):
     def resource(filename):
         return utils.resource_path(os.path.join(DEFAULT_DIR, filename))
 
+    def _features_matrix(self, samples):
+        features = np.ndarray(shape=(len(samples), self.features_len),
+                              dtype='float32')
+        for i, sample in enumerate(samples):
+            features[i,:] = self.features_extractor.extract(sample)
+        return features
+
 
 class SVMDigitClassifier(SVMClassifier):
     def __init__(self, features_extractor, load_from_file=None,
@@ -123,6 +139,9 @@ class SVMCrossesClassifier(SVMClassifier):
     def is_cross(self, sample):
         return self.classify(sample) == 1
 
+    def are_crosses(self, samples):
+        return [label == 1 for label in self.classify_all(samples)]
+
 
 class DefaultCrossesClassifier(SVMCrossesClassifier):
     def __init__(self, load_from_file=DEFAULT_CROSS_CLASS_FILE):
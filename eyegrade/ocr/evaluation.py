@@ -42,8 +42,9 @@ class Evaluation(object):
         self.results = np.zeros(len(self.samples), dtype=bool)
         self.confusion_matrix = np.zeros(shape=(num_classes, num_classes),
                                          dtype='int')
-        for i, samp in enumerate(self.samples):
-            detected = self.classifier.classify(samp)
+        samples = list(self.samples)
+        labels = self.classifier.classify_all(samples)
+        for i, (samp, detected) in enumerate(zip(samples, labels)):
             self.confusion_matrix[samp.label, detected] += 1
             self.results[i] = samp.check_label(detected)
         self.success_rate = sum(self.results) / len(self.results)
@@ -46,21 +46,33 @@ class FeatureExtractor(object):
 
     @staticmethod
     def _project_to_rectangle(sample, width, height):
-        p = sample.corners
-        corners_dst = np.array([[0, 0],
-                                [width - 1, 0],
-                                [0, height - 1],
-                                [width - 1, height - 1]],
-                                dtype='float32')
-        h = cv2.findHomography(np.array(p, dtype='float32'), corners_dst)
-        image = cv2.warpPerspective(sample.image, h[0], (width, height))
+        if sample.rectified:
+            # No projection needed: the sample was cut from an
+            # already rectified image
+            image = sample.image
+            if image.shape[:2] != (height, width):
+                image = cv2.resize(image, (width, height))
+        else:
+            p = sample.corners
+            corners_dst = np.array([[0, 0],
+                                    [width - 1, 0],
+                                    [0, height - 1],
+                                    [width - 1, height - 1]],
+                                    dtype='float32')
+            h = cv2.findHomography(np.array(p, dtype='float32'), corners_dst)
+            image = cv2.warpPerspective(sample.image, h[0], (width, height))
         return cv2.threshold(image, 64, 255, cv2.THRESH_BINARY)[1]
 
     @staticmethod
     def _reshape(sample):
-        p = sample.corners
-        width = int((cv2.norm(p[0,:], p[1,:]) + cv2.norm(p[2,:], p[3,:])) / 2)
-        height = int((cv2.norm(p[0,:], p[2,:]) + cv2.norm(p[1,:], p[3,:])) / 2)
+        if sample.rectified:
+            height, width = sample.image.shape[:2]
+        else:
+            p = sample.corners
+            width = int((cv2.norm(p[0,:], p[1,:])
+                         + cv2.norm(p[2,:], p[3,:])) / 2)
+            height = int((cv2.norm(p[0,:], p[2,:])
+                          + cv2.norm(p[1,:], p[3,:])) / 2)
         return FeatureExtractor._project_to_rectangle(sample, width, height)
 
 
@@ -37,6 +37,7 @@ class Sample(object):
         self.corners = corners
         self.image_filename = image_filename
         self.label = label
+        self.rectified = False
         self._image = image
         self._features = None
 
@@ -80,6 +81,83 @@ class CrossSampleFromCam(Sample):
         return np.array((plu, pru, pld, prd))
 
 
+class RectifiedGrid(object):
+    """Fronto-parallel view of a planar grid of cells.
+
+    The image is warped just once, with the homography that maps the
+    corners of the grid to a regular grid of `cell_width` x
+    `cell_height` cells. The cells can then be cut from the rectified
+    image by array slicing.
+
+    `corners` is a (num_rows + 1, num_cols + 1, 2) array with the
+    corners of the cells, as returned by `detection.cell_corners`.
+
+    """
+    def __init__(self, image, corners, cell_width, cell_height):
+        self.num_rows = len(corners) - 1
+        self.num_cols = len(corners[0]) - 1
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        corners_src = np.asarray(corners, dtype='float32').reshape(-1, 2)
+        corners_dst = np.array([(j * cell_width, i * cell_height) \
+                                for i in range(self.num_rows + 1) \
+                                for j in range(self.num_cols + 1)],
+                               dtype='float32')
+        h = cv2.findHomography(corners_src, corners_dst)
+        size = (self.num_cols * cell_width + 1,
+                self.num_rows * cell_height + 1)
+        self.image = cv2.warpPerspective(image, h[0], size)
+
+    def cell(self, row, col, margin_x=0, margin_y=0):
+        """Returns the image of a cell, without `margin` pixels per side."""
+        x0 = col * self.cell_width + margin_x
+        x1 = (col + 1) * self.cell_width - margin_x
+        y0 = row * self.cell_height + margin_y
+        y1 = (row + 1) * self.cell_height - margin_y
+        return self.image[y0:y1 + 1, x0:x1 + 1]
+
+
+class CrossSampleFromGrid(Sample):
+    """Sample of an answer cell cut from a rectified answer table.
+
+    As in CrossSampleFromCam, just the central area of the cell is
+    taken in order to leave the borders of the cell out.
+
+    """
+    # With this cell size, the central area of the cell is 28x28,
+    # the input size of the default crosses feature extractor.
+    cell_size = 35
+
+    def __init__(self, grid, row, col):
+        margin_x = int(round(0.1 * grid.cell_width))
+        margin_y = int(round(0.1 * grid.cell_height))
+        image = grid.cell(row, col, margin_x=margin_x, margin_y=margin_y)
+        super(CrossSampleFromGrid, self).__init__(_image_corners(image),
+                                                  image=image)
+        self.rectified = True
+
+
+class DigitSampleFromGrid(Sample):
+    """Sample of a digit cell cut from a rectified ID box.
+
+    The borders of the cell are removed the same way as in
+    DigitSampleFromCam, but within the rectified cell.
+
+    """
+    def __init__(self, grid, col, row=0):
+        image = grid.cell(row, col)
+        plu, pru, pld, prd = adjust_cell_corners(image, _image_corners(image))
+        x0 = max(plu[0], pld[0])
+        x1 = min(pru[0], prd[0])
+        y0 = max(plu[1], pru[1])
+        y1 = min(pld[1], prd[1])
+        if x0 < x1 and y0 < y1:
+            image = image[y0:y1 + 1, x0:x1 + 1]
+        super(DigitSampleFromGrid, self).__init__(_image_corners(image),
+                                                  image=image)
+        self.rectified = True
+
+
 class SampleSet(object):
     def __init__(self):
         self.samples_dict = collections.defaultdict(list)
@@ -219,6 +297,11 @@ class SampleLoader(object):
         return Sample(corners, image_filename=image_path, label=label)
 
 
+def _image_corners(image):
+    height, width = image.shape[:2]
+    return np.array([(0, 0), (width - 1, 0),
+                     (0, height - 1), (width - 1, height - 1)])
+
 def adjust_cell_corners(image, corners):
     plu = adjust_cell_corner(image, corners[0, :], corners[3, :])
     prd = adjust_cell_corner(image, corners[3, :], corners[0, :])
@@ -227,14 +310,10 @@ def adjust_cell_corners(image, corners):
     return np.array([plu, pru, pld, prd])
 
 def adjust_cell_corner(image, corner, towards_corner):
-    margin = None
-    for x, y in g.walk_line_ordered(corner, towards_corner):
-        if margin is None:
-            if image[y, x] == 0:
-                margin = 2
-        else:
-            margin -= 1
-            if margin == 0:
-                return (x, y)
+    # Two points past the first non-ink point from the corner
+    xs, ys = g.line_pixels(corner, towards_corner, ordered=True)
+    blank = np.flatnonzero(image[ys, xs] == 0)
+    if len(blank) > 0 and blank[0] + 2 < len(xs):
+        return (int(xs[blank[0] + 2]), int(ys[blank[0] + 2]))
     # In case of failure, return the original point
     return corner
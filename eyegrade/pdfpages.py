@@ -0,0 +1,86 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+#
+# Rasterisation of the pages of scanned PDF files with the Poppler
+# utilities (pdfinfo and pdftoppm)
+#
+from __future__ import division
+
+import os
+import re
+import subprocess
+
+import cv2
+import numpy as np
+
+from . import utils
+
+# Default resolution (dots per inch) of the rasterised pages
+param_resolution = 150
+
+extensions = ('.pdf', )
+
+utils.EyegradeException.register_error('poppler_not_found',
+    'Install the Poppler utilities (pdfinfo and pdftoppm) and make sure\n'
+    'they are in your system\'s PATH variable.',
+    'The Poppler utilities were not found.')
+
+
+def is_pdf_file(filename):
+    return os.path.splitext(filename)[1].lower() in extensions
+
+def num_pages(filename):
+    """Returns the number of pages of a PDF file."""
+    output = _run(['pdfinfo', filename])
+    match = re.search(r'^Pages:\s+(\d+)\s*$', output, re.MULTILINE)
+    if match is None:
+        raise utils.EyegradeException('Cannot read the number of pages of '
+                                      + filename)
+    return int(match.group(1))
+
+def load_page(filename, page, resolution=param_resolution):
+    """Rasterises a page (numbered from 1) of a PDF file.
+
+    The page is received from pdftoppm through a pipe, in grayscale, so
+    that nothing is written to disk and only one page is kept in memory.
+    Returns it as a three-channel image, as `images.load_image` does.
+
+    """
+    data = _run(['pdftoppm', '-gray', '-r', str(resolution),
+                 '-f', str(page), '-l', str(page), '-singlefile', filename])
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8),
+                         cv2.IMREAD_COLOR)
+    if image is None:
+        raise utils.EyegradeException('Cannot rasterise page {0} of {1}'\
+                                      .format(page, filename))
+    return image
+
+def _run(args):
+    # The last argument is the name of the PDF file
+    args = args[:-1] + [utils.unicode_path_to_str(args[-1])]
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+    except OSError:
+        raise utils.EyegradeException('', key='poppler_not_found')
+    output, errors = process.communicate()
+    if process.returncode != 0:
+        message = errors.strip() or '{0} failed'.format(args[0])
+        raise utils.EyegradeException(message)
+    return output
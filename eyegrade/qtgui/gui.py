@@ -461,13 +461,14 @@ class CenterView(QWidget):
     def update_text_down(self, text):
         self.label_down.setText(text)
 
-    def display_capture(self, ipl_image):
+    def display_capture(self, ipl_image, converted=False):
         """Displays a captured image in the window.
 
-        The image is in the OpenCV IPL format.
+        The image is in the OpenCV IPL format. See
+        `widgets.CamView.display_capture` for `converted`.
 
         """
-        self.camview.display_capture(ipl_image)
+        self.camview.display_capture(ipl_image, converted=converted)
 
     def display_wait_image(self):
         """Displays the default image instead of a camera capture."""
@@ -706,13 +707,14 @@ class Interface(object):
         """Registers a callback for immediate enqueueing in the event loop."""
         self.register_timer(delay, callback)
 
-    def display_capture(self, ipl_image):
+    def display_capture(self, ipl_image, converted=False):
         """Displays a captured image in the window.
 
-        The image is in the OpenCV IPL format.
+        The image is in the OpenCV IPL format. See
+        `widgets.CamView.display_capture` for `converted`.
 
         """
-        self.window.center_view.display_capture(ipl_image)
+        self.window.center_view.display_capture(ipl_image, converted=converted)
 
     def save_capture(self, filename):
         """Saves the current capture and its annotations to the given file."""
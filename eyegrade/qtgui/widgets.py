@@ -430,17 +430,26 @@ class CamView(QWidget):
         else:
             painter.drawImage(event.rect(), self.image)
 
-    def display_capture(self, cv_image):
+    def display_capture(self, cv_image, converted=False):
         """Displays a captured image in the window.
 
-        The image is in the numpy format used by opencv.
+        The image is in the numpy format used by opencv. If `converted`
+        is True, its channels are already in RGB order (see
+        `images.DisplayBufferPool`) and the image is displayed without
+        copying it. It must not be modified while it is displayed.
 
         """
         # It is important to use the variable data to prevent issue #58.
         data = cv_image.data
         height, width, nbytes = cv_image.shape
         self.image = QImage(data, width, height, nbytes * width,
-                            QImage.Format_RGB888).rgbSwapped()
+                            QImage.Format_RGB888)
+        if converted:
+            # Keep a reference: the QImage does not own the buffer
+            self.image_buffer = cv_image
+        else:
+            self.image = self.image.rgbSwapped()
+            self.image_buffer = None
         if self.logo is not None:
             painter = QPainter(self.image)
             painter.drawPixmap(width - 40, height - 40, 36, 36, self.logo)
@@ -450,6 +459,7 @@ class CamView(QWidget):
         self.image = QImage(self.image_size[0], self.image_size[1],
                             QImage.Format_RGB888)
         self.image.fill(Qt.darkBlue)
+        self.image_buffer = None
         self.update()
 
     def register_mouse_pressed_listener(self, listener):
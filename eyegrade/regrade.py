@@ -0,0 +1,236 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+#
+# Re-grading of the raw captures of an existing session
+#
+from __future__ import division, print_function
+
+from optparse import OptionParser
+import sys
+import csv
+import time
+import multiprocessing
+
+from . import utils
+from . import sessiondb
+from . import batch
+
+# Per-process state of the worker processes (see _init_worker)
+_worker = None
+
+
+class ExamChange(object):
+    """Differences between the stored and the re-graded results of an exam.
+
+    `stored` is the exam as `sessiondb.SessionDB.exams_iterator`
+    returns it, and `sheet` the `batch.GradedSheet` of its raw capture.
+    The student changes only when the detected id belongs to a student
+    of the session.
+
+    """
+    def __init__(self, stored, sheet, students):
+        self.exam_id = stored['exam_id']
+        self.sheet = sheet
+        self.old_model = stored['model']
+        self.old_student_id = stored['student_id']
+        decisions = sheet.decisions
+        self.answers = [(question, old, new) for question, (old, new) \
+                        in enumerate(zip(stored['answers'], decisions.answers)) \
+                        if old != new]
+        detected_id = decisions.detected_id
+        if (detected_id and detected_id != self.old_student_id
+            and detected_id in students):
+            self.student = students[detected_id]
+        elif self.old_student_id is not None:
+            self.student = students.get(self.old_student_id)
+        else:
+            self.student = None
+        decisions.set_student(self.student)
+
+    @property
+    def new_model(self):
+        return self.sheet.decisions.model
+
+    @property
+    def new_student_id(self):
+        return self.student.student_id if self.student is not None else None
+
+    @property
+    def changed(self):
+        return (len(self.answers) > 0 or self.old_model != self.new_model
+                or self.old_student_id != self.new_student_id)
+
+    def report_rows(self):
+        rows = [(self.exam_id, 'question {0}'.format(question + 1),
+                 _format_answer(old), _format_answer(new)) \
+                for question, old, new in self.answers]
+        if self.old_model != self.new_model:
+            rows.append((self.exam_id, 'model', self.old_model or '',
+                         self.new_model or ''))
+        if self.old_student_id != self.new_student_id:
+            rows.append((self.exam_id, 'student', self.old_student_id or '',
+                         self.new_student_id or ''))
+        return rows
+
+
+class SessionRegrading(object):
+    """Runs detection again on the raw captures of a session.
+
+    Detection runs in a pool of worker processes, as in batch grading.
+    The results are compared with the ones stored in the session, and
+    the exams that change are kept in `changes`. Nothing is written to
+    the session until `apply` is called.
+
+    """
+    def __init__(self, session_dir, num_processes=None):
+        self.session_dir = session_dir
+        self.num_processes = num_processes
+        self.num_exams = 0
+        self.changes = []
+        self.failures = []
+        self.elapsed_time = None
+
+    def run(self, listener=None):
+        """Re-grades all the exams with a raw capture.
+
+        `listener`, if not None, is called with the `GradedSheet`
+        object of every exam.
+
+        """
+        session = sessiondb.SessionDB(self.session_dir)
+        stored = dict((exam['exam_id'], exam) \
+                      for exam in session.exams_iterator())
+        students = session.students
+        session.close()
+        pool = multiprocessing.Pool(self.num_processes,
+                                    initializer=_init_worker,
+                                    initargs=(self.session_dir, ))
+        start_time = time.time()
+        try:
+            for sheet in pool.imap(_regrade_exam, sorted(stored)):
+                self.num_exams += 1
+                if sheet.success:
+                    change = ExamChange(stored[sheet.filename], sheet,
+                                        students)
+                    if change.changed:
+                        self.changes.append(change)
+                else:
+                    self.failures.append(sheet)
+                if listener is not None:
+                    listener(sheet)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            self.elapsed_time = time.time() - start_time
+
+    def apply(self):
+        """Stores the changes in the session, in just one transaction.
+
+        The drawn captures of the changed exams are replaced as well.
+
+        """
+        session = sessiondb.SessionDB(self.session_dir)
+        try:
+            session.update_exams([(change.exam_id, change.sheet.decisions,
+                                   change.sheet.score) \
+                                  for change in self.changes])
+            for change in self.changes:
+                if change.old_student_id != change.new_student_id:
+                    old_student = session.students.get(change.old_student_id)
+                    session.remove_drawn_capture(change.exam_id, old_student)
+                session.save_drawn_capture(change.exam_id,
+                                           change.sheet.capture,
+                                           change.student)
+        finally:
+            session.close()
+
+    def write_report(self, file_):
+        writer = csv.writer(file_, dialect='excel-tab')
+        writer.writerow(('exam', 'field', 'stored', 'regraded'))
+        for change in self.changes:
+            for row in change.report_rows():
+                writer.writerow([utils.encode_string(str(item)) \
+                                 for item in row])
+        for sheet in self.failures:
+            writer.writerow((sheet.filename, 'error', '', sheet.error))
+
+
+def _format_answer(answer):
+    return chr(64 + answer) if answer > 0 else '-'
+
+def _init_worker(session_dir):
+    global _worker
+    _worker = batch.SheetGrader(sessiondb.SessionDB(session_dir))
+
+def _regrade_exam(exam_id):
+    # The exam id is used as the "file name" of the graded sheet
+    session = _worker.session
+    try:
+        if (session.get_raw_capture_path(exam_id)
+            == utils.resource_path('not_found.png')):
+            return batch.GradedSheet(exam_id, error='raw capture not found')
+        return _worker.grade_image(exam_id, session.load_raw_capture(exam_id))
+    except Exception as e:
+        return batch.GradedSheet(exam_id, error=str(e))
+
+def read_cmd_options():
+    parser = OptionParser(usage='usage: %prog [options] <session_dir>',
+                          version=utils.program_name + ' ' + utils.version)
+    parser.add_option('-j', '--processes', type='int', dest='num_processes',
+                      default=None,
+                      help='number of worker processes (default: '
+                           'number of CPUs)')
+    parser.add_option('-r', '--report', dest='report_file', default=None,
+                      help='write the report of changes to this file '
+                           '(default: standard output)')
+    parser.add_option('-a', '--apply', dest='apply', action='store_true',
+                      default=False,
+                      help='store the changes in the session')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error('Required parameters expected')
+    return options, args
+
+def main():
+    options, args = read_cmd_options()
+    regrading = SessionRegrading(utils.path_to_unicode(args[0]),
+                                 num_processes=options.num_processes)
+    try:
+        regrading.run()
+    except utils.EyegradeException as ex:
+        print(ex, file=sys.stderr)
+        sys.exit(1)
+    if options.report_file is not None:
+        with open(options.report_file, 'wb') as f:
+            regrading.write_report(f)
+    else:
+        regrading.write_report(sys.stdout)
+    print('Re-graded {0} exams in {1:.1f} s: {2} changed, {3} failed'\
+          .format(regrading.num_exams, regrading.elapsed_time,
+                  len(regrading.changes), len(regrading.failures)),
+          file=sys.stderr)
+    if options.apply and regrading.changes:
+        regrading.apply()
+        print('Changes stored in the session', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
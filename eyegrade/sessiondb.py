@@ -229,6 +229,31 @@ class SessionDB(object):
         if store_captures:
             self.save_drawn_capture(exam_id, capture, decisions.student)
 
+    def update_exams(self, changes):
+        """Updates the student, model, answers and score of several exams.
+
+        `changes` is a list of (exam_id, decisions, score) tuples. All
+        the exams are updated in just one transaction: if any of them
+        fails, none is changed. Captures are not stored.
+
+        """
+        cursor = self.conn.cursor()
+        try:
+            for exam_id, decisions, score in changes:
+                cursor.execute('UPDATE Exams SET student = ?, model = ? '
+                               'WHERE exam_id = ?',
+                               (self._student_db_id(decisions.student),
+                                _Adapter.enc_model(decisions.model),
+                                exam_id))
+                for question, answer in enumerate(decisions.answers):
+                    self._update_answer(exam_id, question, answer,
+                                        commit=False)
+                self._update_score(exam_id, score, commit=False)
+        except:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
     def store_new_student(self, student, commit=True):
         cursor = self.conn.cursor()
         if student.group_id is None:
@@ -0,0 +1,138 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+#
+# Timing of the stages of detection
+#
+from __future__ import division
+
+import collections
+import json
+import timeit
+import threading
+
+import numpy as np
+
+# Number of recent frames kept for computing percentiles
+param_max_samples = 10000
+
+
+class FrameTimer(object):
+    """Records the wall-clock time and outcome of the stages of a frame.
+
+    `stages` maps every stage name, in the order they first ran, to a
+    (seconds, outcome) tuple. When a stage runs more than once in the
+    same frame, its times are added up and the last outcome is kept.
+
+    """
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self._running = {}
+
+    def start(self, stage):
+        self._running[stage] = timeit.default_timer()
+
+    def stop(self, stage, outcome=None):
+        elapsed = timeit.default_timer() - self._running.pop(stage)
+        if stage in self.stages:
+            elapsed += self.stages[stage][0]
+        self.stages[stage] = (elapsed, outcome)
+
+
+class NullFrameTimer(object):
+    """Timer that records nothing, used when timing is disabled."""
+    stages = collections.OrderedDict()
+
+    def start(self, stage):
+        pass
+
+    def stop(self, stage, outcome=None):
+        pass
+
+
+# The timers that record nothing can be shared
+null_timer = NullFrameTimer()
+
+
+class TimingStats(object):
+    """Aggregates the stage times of many frames.
+
+    Frames may be added from several detection threads at once.
+
+    """
+    def __init__(self):
+        self.counts = collections.OrderedDict()
+        self.successes = {}
+        self.totals = {}
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, stages):
+        """Adds the `stages` of a frame, as in `FrameTimer.stages`."""
+        with self._lock:
+            for stage, (seconds, outcome) in stages.iteritems():
+                if not stage in self.counts:
+                    self.counts[stage] = 0
+                    self.successes[stage] = 0
+                    self.totals[stage] = 0.0
+                    self.samples[stage] = collections.deque(
+                                                    maxlen=param_max_samples)
+                self.counts[stage] += 1
+                self.totals[stage] += seconds
+                self.samples[stage].append(seconds)
+                if outcome:
+                    self.successes[stage] += 1
+
+    def summary(self):
+        """Returns the statistics of every stage as a dictionary.
+
+        Times are in milliseconds. Percentiles are computed over the
+        last `param_max_samples` frames.
+
+        """
+        summary = collections.OrderedDict()
+        with self._lock:
+            for stage, count in self.counts.iteritems():
+                percentiles = np.percentile(list(self.samples[stage]),
+                                            [50, 95, 99]) * 1000
+                summary[stage] = collections.OrderedDict([
+                    ('count', count),
+                    ('successes', self.successes[stage]),
+                    ('mean', 1000 * self.totals[stage] / count),
+                    ('p50', percentiles[0]),
+                    ('p95', percentiles[1]),
+                    ('p99', percentiles[2]),
+                    ])
+        return summary
+
+    def save(self, filename):
+        """Saves the summary as a JSON file."""
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def __str__(self):
+        lines = ['{0:<12} {1:>7} {2:>7} {3:>9} {4:>9} {5:>9} {6:>9}'\
+                 .format('stage', 'count', 'success', 'mean ms', 'p50 ms',
+                         'p95 ms', 'p99 ms')]
+        for stage, data in self.summary().iteritems():
+            lines.append('{0:<12} {1:>7} {2:>7} {3:>9.2f} {4:>9.2f} '
+                         '{5:>9.2f} {6:>9.2f}'\
+                         .format(stage, data['count'], data['successes'],
+                                 data['mean'], data['p50'], data['p95'],
+                                 data['p99']))
+        return '\n'.join(lines)
@@ -80,6 +80,8 @@ def _read_config():
 
     """
     config = {'camera-dev': '0',
+              'pipeline-depth': '1',
+              'engine': 'hough',
               'save-filename-pattern': _default_capture_pattern,
               'csv-dialect': 'tabs',
               'default-charset': 'utf8', # special value: 'system-default'
@@ -93,11 +95,19 @@ def _read_config():
             config[option] = parser.get('default', option)
     if not config['csv-dialect'] in csv.list_dialects():
         config['csv-dialect'] = 'tabs'
+    if not config['engine'] in ('hough', 'contours'):
+        config['engine'] = 'hough'
     if 'error-logging' in config and config['error-logging'] == 'yes':
         config['error-logging'] = True
     else:
         config['error-logging'] = False
+    for key in ('multi-threshold', 'angle-windows', 'tracking', 'pyramid'):
+        if key in config and config[key] == 'yes':
+            config[key] = True
+        else:
+            config[key] = False
     config['camera-dev'] = int(config['camera-dev'])
+    config['pipeline-depth'] = max(1, int(config['pipeline-depth']))
     if config['default-charset'] == 'system-default':
         config['default-charset'] = locale.getpreferredencoding()
     return config
@@ -0,0 +1,402 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+import eyegrade.detection as detection
+
+
+class FakeCamera(object):
+    """Camera whose reads fail or succeed following a list of results."""
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.frame_num = 0
+
+    def read(self):
+        if self.results and not self.results.pop(0):
+            return False, None
+        self.frame_num += 1
+        return True, np.full((4, 4, 3), self.frame_num, dtype=np.uint8)
+
+
+class TestCameraReader(unittest.TestCase):
+
+    def setUp(self):
+        self.retry_delay = detection.param_camera_retry_delay
+        detection.param_camera_retry_delay = 0.0
+
+    def tearDown(self):
+        detection.param_camera_retry_delay = self.retry_delay
+
+    def read_frame(self, results):
+        reader = detection.CameraReader(FakeCamera(results))
+        reader.start()
+        try:
+            return reader.latest_frame()[1]
+        finally:
+            reader.stop()
+
+    def test_transient_failures(self):
+        failures = detection.param_camera_max_failures - 1
+        image = self.read_frame([False] * failures)
+        self.assertIsNotNone(image)
+
+    def test_dead_camera(self):
+        failures = detection.param_camera_max_failures
+        image = self.read_frame([False] * failures)
+        self.assertIsNone(image)
+
+
+class TestSearchPipeline(unittest.TestCase):
+
+    def test_frame_order(self):
+        pipeline = detection.SearchPipeline(3)
+        keys = [pipeline.start() for i in range(3)]
+        self.assertTrue(pipeline.full())
+        self.assertEqual(pipeline.finish(keys[2], 'frame 2'), [])
+        self.assertEqual(pipeline.finish(keys[1], 'frame 1'), [])
+        self.assertEqual(pipeline.finish(keys[0], 'frame 0'),
+                         ['frame 0', 'frame 1', 'frame 2'])
+        self.assertFalse(pipeline.full())
+        key = pipeline.start()
+        self.assertEqual(pipeline.finish(key, 'frame 3'), ['frame 3'])
+
+    def test_slow_head_frame(self):
+        # The oldest frame finishes last: the newer ones are kept until
+        # it finishes, and no more frames can be started meanwhile
+        pipeline = detection.SearchPipeline(3)
+        head = pipeline.start()
+        keys = [pipeline.start() for i in range(2)]
+        for i, key in enumerate(keys):
+            self.assertEqual(pipeline.finish(key, 'frame %d' % (i + 1)), [])
+            self.assertTrue(pipeline.full())
+        self.assertEqual(pipeline.finish(head, 'frame 0'),
+                         ['frame 0', 'frame 1', 'frame 2'])
+        self.assertFalse(pipeline.full())
+
+    def test_restart_drops_older_generations(self):
+        pipeline = detection.SearchPipeline(2)
+        old_keys = [pipeline.start() for i in range(2)]
+        pipeline.restart()
+        self.assertFalse(pipeline.full())
+        key = pipeline.start()
+        self.assertEqual(pipeline.finish(old_keys[0], 'old frame 0'), [])
+        self.assertEqual(pipeline.finish(key, 'frame 0'), ['frame 0'])
+        self.assertEqual(pipeline.finish(old_keys[1], 'old frame 1'), [])
+
+    def test_dropped_detections(self):
+        dropped = []
+        pipeline = detection.SearchPipeline(3, drop=dropped.append)
+        keys = [pipeline.start() for i in range(3)]
+        pipeline.finish(keys[1], 'frame 1')
+        pipeline.restart()
+        self.assertEqual(dropped, ['frame 1'])
+        pipeline.finish(keys[0], 'frame 0')
+        self.assertEqual(dropped, ['frame 1', 'frame 0'])
+
+
+@unittest.skipUnless(hasattr(cv2, 'SVM'), 'the classifiers need cv2.SVM')
+class TestContextSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.context = detection.ExamDetectorContext()
+
+    def test_changes_are_deferred(self):
+        snapshot = detection.ContextSnapshot(self.context)
+        snapshot.tracked_axes = 'axes'
+        snapshot.next_hough_threshold()
+        self.assertEqual(snapshot.tracked_axes, 'axes')
+        self.assertEqual(snapshot.hough_thresholds_idx, 1)
+        self.assertIsNone(self.context.tracked_axes)
+        self.assertEqual(self.context.hough_thresholds_idx, 0)
+        snapshot.apply()
+        self.assertEqual(self.context.tracked_axes, 'axes')
+        self.assertEqual(self.context.hough_thresholds_idx, 1)
+
+    def test_frame_order(self):
+        # Both frames are captured before any of them is applied;
+        # the newer one finishes first
+        older = detection.ContextSnapshot(self.context)
+        newer = detection.ContextSnapshot(self.context)
+        newer.tracked_axes = 'axes'
+        newer.notify_success()
+        older.tracked_axes = None
+        older.notify_failure()
+        older.apply()
+        newer.apply()
+        self.assertEqual(self.context.tracked_axes, 'axes')
+        self.assertEqual(self.context.failures_in_a_row, 0)
+
+
+class FakeHoughContext(object):
+    """Context that counts how many times the Hough check runs."""
+
+    def __init__(self):
+        self.hough_checks = 0
+
+    def get_hough_threshold(self):
+        self.hough_checks += 1
+        return detection.param_hough_thresholds[0]
+
+
+class TestCaptureDifference(unittest.TestCase):
+    """Frames of a sheet on a desk, compared with the locked capture."""
+
+    def frame(self, sheet=True, gain=1.0):
+        image = np.full((480, 640, 3), 90, dtype=np.uint8)
+        if sheet:
+            cv2.rectangle(image, (120, 40), (520, 440), (230, 230, 230), -1)
+            for x in range(160, 481, 40):
+                cv2.line(image, (x, 100), (x, 400), (30, 30, 30), 2)
+            for y in range(100, 401, 30):
+                cv2.line(image, (160, y), (480, y), (30, 30, 30), 2)
+        return np.clip(image * gain, 0, 255).astype(np.uint8)
+
+    def exam_detected(self, image, reference):
+        context = FakeHoughContext()
+        detector = detection.ExamDetector(
+                        [(4, 10)], context,
+                        detection.ExamDetector.get_default_options(),
+                        image_raw=image)
+        detector.exam_detected(reference_image=reference)
+        return detector.exam_detected, context.hough_checks
+
+    def test_same_frame(self):
+        reference = self.frame()
+        self.assertAlmostEqual(
+            detection.capture_difference(self.frame(), reference), 0.0)
+        self.assertEqual(self.exam_detected(self.frame(), reference),
+                         (True, 0))
+
+    def test_exposure_change(self):
+        reference = self.frame()
+        for gain in (0.85, 1.1):
+            image = self.frame(gain=gain)
+            self.assertLess(detection.capture_difference(image, reference),
+                            detection.param_change_max_difference)
+            self.assertEqual(self.exam_detected(image, reference), (True, 0))
+
+    def test_removed_sheet(self):
+        reference = self.frame()
+        image = self.frame(sheet=False)
+        self.assertGreater(detection.capture_difference(image, reference),
+                           detection.param_change_max_difference)
+        # The usual Hough check runs, and finds no exam on the desk
+        self.assertEqual(self.exam_detected(image, reference), (False, 1))
+
+
+class TestFindSheetRegions(unittest.TestCase):
+    """Pages with sheets made of a header and two answer tables."""
+
+    def draw_sheet(self, page, x, y):
+        header = (x + 20, y + 10, x + 130, y + 40)
+        tables = [(x + 20, y + 100, x + 130, y + 380),
+                  (x + 170, y + 100, x + 280, y + 380)]
+        for line_y in range(header[1], header[3], 10):
+            cv2.line(page, (header[0], line_y), (header[2], line_y), 0, 2)
+        for x0, y0, x1, y1 in tables:
+            for line_x in range(x0, x1 + 1, 22):
+                cv2.line(page, (line_x, y0), (line_x, y1), 0, 2)
+            for line_y in range(y0, y1 + 1, 28):
+                cv2.line(page, (x0, line_y), (x1, line_y), 0, 2)
+        return [header] + tables
+
+    def page(self, num_sheets, offsets=None):
+        offsets = offsets or [0] * num_sheets
+        page = np.full((400 + max(offsets), 20 + 320 * num_sheets, 3), 255,
+                       dtype=np.uint8)
+        sheets = [self.draw_sheet(page, 10 + 320 * i, offsets[i]) \
+                  for i in range(num_sheets)]
+        return page, sheets
+
+    def accept(self, sheets):
+        # Accepts the regions that contain both tables of a sheet
+        def accept(region):
+            return any(all(self.contains(region, table) \
+                           for table in sheet[1:]) for sheet in sheets)
+        return accept
+
+    def contains(self, region, rectangle):
+        return (region[0] <= rectangle[0] and region[1] <= rectangle[1]
+                and rectangle[2] <= region[2] and rectangle[3] <= region[3])
+
+    def test_one_sheet(self):
+        page, sheets = self.page(1)
+        # The gap between the tables is wide enough for a cut
+        self.assertGreater(len(detection.find_sheet_regions(page)), 1)
+        regions = detection.find_sheet_regions(page,
+                                               accept=self.accept(sheets))
+        self.assertEqual(regions, [(0, 0, page.shape[1], page.shape[0])])
+
+    def test_two_sheets(self):
+        page, sheets = self.page(2)
+        regions = detection.find_sheet_regions(page,
+                                               accept=self.accept(sheets))
+        self.assertEqual(len(regions), 2)
+        for region, sheet in zip(regions, sheets):
+            for rectangle in sheet:
+                self.assertTrue(self.contains(region, rectangle))
+
+    def test_regions_are_the_accepted_ones(self):
+        # The batch grader reuses the detection of the accepted regions
+        page, sheets = self.page(3, offsets=[0, 60, 30])
+        accept = self.accept(sheets)
+        accepted = []
+        def record(region):
+            if accept(region):
+                accepted.append(region)
+                return True
+            return False
+        regions = detection.find_sheet_regions(page, accept=record)
+        self.assertEqual(len(regions), 3)
+        for region in regions:
+            self.assertIn(region, accepted)
+
+
+class TestDetectQuads(unittest.TestCase):
+
+    def test_tables_inside_page_edge(self):
+        # The edge of the page surrounds the tables with a closed contour
+        image = np.full((480, 640), 255, dtype=np.uint8)
+        cv2.rectangle(image, (20, 20), (620, 460), 0, 3)
+        tables = [(150, 100, 310, 400), (350, 100, 510, 400)]
+        for x0, y0, x1, y1 in tables:
+            for x in range(x0, x1 + 1, 40):
+                cv2.line(image, (x, y0), (x, y1), 0, 2)
+            for y in range(y0, y1 + 1, 30):
+                cv2.line(image, (x0, y), (x1, y), 0, 2)
+        quads = detection.detect_quads(image)
+        selected = detection.select_table_quads(quads, [(4, 10), (4, 10)])
+        self.assertIsNotNone(selected)
+        for quad, (x0, y0, x1, y1) in zip(selected, tables):
+            expected = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+            for corner, expected_corner in zip(quad, expected):
+                self.assertLessEqual(abs(corner[0] - expected_corner[0]), 3)
+                self.assertLessEqual(abs(corner[1] - expected_corner[1]), 3)
+
+
+class TestFrameRecording(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'frames.eyerec')
+        self.frames = [(1000.0, 160, self.image(50)),
+                       (1000.25, 160, self.image(100)),
+                       (1001.0, 140, self.image(150))]
+        recorder = detection.FrameRecorder(self.filename)
+        recorder.start()
+        for timestamp, threshold, image in self.frames:
+            recorder.record(timestamp, threshold, image)
+        recorder.stop()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def image(self, value):
+        image = np.full((20, 30, 3), value, dtype=np.uint8)
+        image[5:10, 5:20] = 255 - value
+        return image
+
+    def test_round_trip(self):
+        source = detection.RecordingSource(self.filename)
+        for timestamp, threshold, image in self.frames:
+            self.assertEqual(source.next_timestamp(), timestamp)
+            read_timestamp, read_image = source.read()
+            self.assertEqual(read_timestamp, timestamp)
+            self.assertEqual(source.hough_threshold, threshold)
+            self.assertTrue(np.array_equal(read_image, image))
+        self.assertIsNone(source.next_timestamp())
+        self.assertEqual(source.read(), (None, None))
+        source.close()
+
+    @unittest.skipUnless(hasattr(cv2, 'SVM'), 'the classifiers need cv2.SVM')
+    def test_replay(self):
+        context = detection.ReplayExamDetectorContext(self.filename)
+        context.open_camera()
+        delays = []
+        for timestamp, threshold, image in self.frames:
+            self.assertTrue(np.array_equal(context.capture(), image))
+            self.assertEqual(context.get_hough_threshold(), threshold)
+            delays.append(context.next_capture_delay())
+        self.assertEqual(delays, [0.25, 0.75, None])
+        self.assertIsNone(context.capture())
+        context.close_camera()
+
+    @unittest.skipUnless(hasattr(cv2, 'SVM'), 'the classifiers need cv2.SVM')
+    def test_paced_replay_without_frames(self):
+        # The timestamps file leaves the image sequence with no frames
+        sequence = os.path.join(self.directory, 'sequence')
+        os.mkdir(sequence)
+        cv2.imwrite(os.path.join(sequence, 'frame-0.png'), self.image(50))
+        with open(os.path.join(sequence,
+                               detection.param_sequence_timestamps), 'w'):
+            pass
+        context = detection.ReplayExamDetectorContext(sequence)
+        context.open_camera()
+        self.assertIsNone(context.capture())
+        self.assertIsNone(context.capture())
+        context.close_camera()
+
+
+# The votes of the lines are recounted as in the Hough transform of
+# these releases of OpenCV
+@unittest.skipUnless(cv2.__version__.split('.')[0] in ('2', '3', '4'),
+                     'untested release of OpenCV')
+class TestDetectLinesMulti(unittest.TestCase):
+
+    def grid(self, angle, seed):
+        random = np.random.RandomState(seed)
+        image = np.zeros((480, 640), dtype=np.uint8)
+        for x in range(150, 500, 40):
+            cv2.line(image, (x, 100), (x, 400), 255, 2)
+        for y in range(100, 401, 30):
+            cv2.line(image, (150, y), (500, y), 255, 2)
+        rotation = cv2.getRotationMatrix2D((320, 240), math.degrees(angle),
+                                           1.0)
+        image = cv2.warpAffine(image, rotation, (640, 480))
+        image[random.rand(480, 640) < 0.02] = 255
+        return np.where(image > 127, 255, 0).astype(np.uint8)
+
+    def check_thresholds(self, image, windows):
+        thresholds = detection.param_hough_thresholds
+        candidates = detection.detect_lines_multi(image, thresholds,
+                                                  angle_windows=windows)
+        self.assertEqual([threshold for threshold, lines in candidates],
+                         sorted(thresholds, reverse=True))
+        for threshold, lines in candidates:
+            self.assertEqual(lines,
+                             detection.detect_lines(image, threshold,
+                                                    angle_windows=windows))
+
+    def test_same_lines(self):
+        for seed, angle in enumerate((0.0, 0.05, -0.08, 0.13)):
+            self.check_thresholds(self.grid(angle, seed), None)
+
+    def test_same_lines_in_windows(self):
+        for seed, angle in enumerate((0.0, 0.05, -0.08, 0.13)):
+            windows = detection.angle_windows(math.pi / 2 - angle,
+                                              detection.param_angle_window)
+            self.check_thresholds(self.grid(angle, seed), windows)
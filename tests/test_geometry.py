@@ -0,0 +1,86 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+import itertools
+import math
+
+import eyegrade.geometry as g
+
+class TestWalkLines(unittest.TestCase):
+
+    def setUp(self):
+        coordinates = [-3, 0, 1, 2, 5, 7, 12]
+        points = list(itertools.product(coordinates, coordinates))
+        self.segments = list(itertools.product(points, points))
+
+    def test_line_pixels(self):
+        for p0, p1 in self.segments:
+            xs, ys = g.line_pixels(p0, p1)
+            self.assertEqual(zip(xs, ys), list(g.walk_line(p0, p1)))
+
+    def test_line_pixels_ordered(self):
+        for p0, p1 in self.segments:
+            xs, ys = g.line_pixels(p0, p1, ordered=True)
+            self.assertEqual(zip(xs, ys), list(g.walk_line_ordered(p0, p1)))
+
+    def test_walk_lines(self):
+        points0 = [p0 for p0, p1 in self.segments]
+        points1 = [p1 for p0, p1 in self.segments]
+        xs, ys, segments = g.walk_lines(points0, points1)
+        for i, (p0, p1) in enumerate(self.segments):
+            selected = segments == i
+            self.assertEqual(zip(xs[selected], ys[selected]),
+                             list(g.walk_line(p0, p1)))
+
+    def test_single_point(self):
+        xs, ys = g.line_pixels((4, 5), (4, 5))
+        self.assertEqual(zip(xs, ys), [(4, 5)])
+
+
+class TestLines(unittest.TestCase):
+
+    def test_line_from_points(self):
+        hline = g.line_from_points((10, 20), (110, 25))
+        vline = g.line_from_points((50, 120), (45, 0))
+        self.assertTrue(0 <= hline[1] < math.pi)
+        self.assertTrue(0 <= vline[1] < math.pi)
+        self.assertAlmostEqual(hline[1], math.pi / 2, delta=0.1)
+        self.assertEqual(g.intersection(hline, vline), (46, 22))
+
+    def test_line_from_points_axes(self):
+        rho, theta = g.line_from_points((3, 7), (9, 7))
+        self.assertAlmostEqual(rho, 7)
+        self.assertAlmostEqual(theta, math.pi / 2)
+        rho, theta = g.line_from_points((3, 7), (3, 1))
+        self.assertAlmostEqual(rho, 3)
+        self.assertAlmostEqual(theta, 0)
+
+    def test_intersections(self):
+        hlines = [(10.0, 1.57), (55.5, 1.56), (120.0, 1.58)]
+        vlines = [(20.0, 0.0), (-80.0, 3.13), (200.3, 0.02)]
+        points = g.intersections(hlines, vlines)
+        self.assertEqual(points.shape, (3, 3, 2))
+        for i, hline in enumerate(hlines):
+            for j, vline in enumerate(vlines):
+                self.assertEqual(tuple(points[i, j]),
+                                 g.intersection(hline, vline))
+
+    def test_round_points(self):
+        self.assertEqual(g.round_points([2.5, -2.5, 1.4, -1.6]).tolist(),
+                         [3, -3, 1, -2])
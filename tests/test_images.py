@@ -0,0 +1,52 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+import numpy as np
+
+import eyegrade.images as images
+
+
+class TestDisplayBufferPool(unittest.TestCase):
+
+    def image(self, value):
+        image = np.zeros((4, 6, 3), dtype=np.uint8)
+        image[:, :, 0] = value
+        return image
+
+    def test_convert(self):
+        pool = images.DisplayBufferPool(2)
+        converted = pool.convert(self.image(7))
+        self.assertTrue((converted[:, :, 2] == 7).all())
+        self.assertTrue((converted[:, :, 0] == 0).all())
+
+    def test_buffers_in_use_are_not_reused(self):
+        pool = images.DisplayBufferPool(2)
+        taken = [pool.convert(self.image(i)) for i in range(4)]
+        for i, buf in enumerate(taken):
+            self.assertTrue((buf[:, :, 2] == i).all())
+
+    def test_released_buffers_are_reused(self):
+        pool = images.DisplayBufferPool(2)
+        first = pool.convert(self.image(1))
+        pool.release(first)
+        second = pool.convert(self.image(2))
+        self.assertIs(second, first)
+        pool.release(None)
@@ -0,0 +1,54 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+import cv2
+
+import eyegrade.detection as detection
+import eyegrade.experiments.synthetic_sheets as synthetic_sheets
+
+@unittest.skipUnless(hasattr(cv2, 'SVM'),
+                     'the classifiers need the SVM of OpenCV 2.4')
+class TestSyntheticSheets(unittest.TestCase):
+
+    def detect_sample(self, dimensions, id_num_digits):
+        layout = synthetic_sheets.SheetLayout(dimensions, id_num_digits)
+        generator = synthetic_sheets.SheetGenerator(layout, ['A', 'B'],
+                                                    seed=5)
+        context = detection.ExamDetectorContext()
+        options = detection.ExamDetector.get_default_options()
+        options['multi-threshold'] = True
+        if id_num_digits:
+            options['read-id'] = True
+            options['id-num-digits'] = id_num_digits
+        num_detected = 0
+        for i in range(10):
+            sheet = generator.generate()
+            detector = detection.ExamDetector(dimensions, context, options,
+                                              image_raw=sheet.image)
+            if detector.detect_safe():
+                num_detected += 1
+                self.assertEqual(detector.decisions.model, sheet.model)
+        return num_detected
+
+    def test_detected(self):
+        self.assertGreaterEqual(self.detect_sample([(4, 10), (4, 10)], 0), 9)
+
+    def test_detected_with_id(self):
+        self.assertGreaterEqual(self.detect_sample([(4, 10), (4, 10)], 8), 8)
@@ -0,0 +1,92 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2015 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+import collections
+import json
+import os
+import tempfile
+import threading
+
+import eyegrade.timing as timing
+
+class TestTimingStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = timing.TimingStats()
+        # Times from 1 to 100 ms; the last 10 frames fail in 'read'
+        for i in range(1, 101):
+            self.stats.add(collections.OrderedDict([
+                                ('capture', (0.0005, True)),
+                                ('read', (i / 1000.0, i <= 90))]))
+
+    def test_summary(self):
+        summary = self.stats.summary()
+        self.assertEqual(summary.keys(), ['capture', 'read'])
+        read = summary['read']
+        self.assertEqual(read['count'], 100)
+        self.assertEqual(read['successes'], 90)
+        self.assertAlmostEqual(read['mean'], 50.5)
+        self.assertAlmostEqual(read['p50'], 50.5)
+        self.assertAlmostEqual(read['p95'], 95.05)
+        self.assertAlmostEqual(read['p99'], 99.01)
+        self.assertAlmostEqual(summary['capture']['p99'], 0.5)
+
+    def test_max_samples(self):
+        max_samples = timing.param_max_samples
+        timing.param_max_samples = 10
+        try:
+            stats = timing.TimingStats()
+            for i in range(1, 101):
+                stats.add({'read': (i / 1000.0, True)})
+        finally:
+            timing.param_max_samples = max_samples
+        summary = stats.summary()['read']
+        # Percentiles come from the last frames, but not the mean
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['mean'], 50.5)
+        self.assertAlmostEqual(summary['p50'], 95.5)
+
+    def test_save(self):
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            self.stats.save(filename)
+            with open(filename) as f:
+                data = json.load(f)
+        finally:
+            os.remove(filename)
+        self.assertEqual(set(data.keys()), set(['capture', 'read']))
+        self.assertEqual(data['read']['count'], 100)
+        self.assertAlmostEqual(data['read']['p95'], 95.05)
+
+    def test_concurrent_add(self):
+        stats = timing.TimingStats()
+        def add_frames():
+            for i in range(1000):
+                stats.add({'read': (0.001, True), 'cells': (0.002, False)})
+        threads = [threading.Thread(target=add_frames) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        summary = stats.summary()
+        self.assertEqual(summary['read']['count'], 4000)
+        self.assertEqual(summary['read']['successes'], 4000)
+        self.assertEqual(summary['cells']['successes'], 0)
+        self.assertAlmostEqual(summary['cells']['mean'], 2.0)